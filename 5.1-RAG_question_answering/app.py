@@ -1,82 +1,60 @@
-from flask import Flask, request, render_template
+from flask import Flask, request, render_template, jsonify, abort, Response, stream_with_context
 import os
+import json
 import markdown
-import re
 from werkzeug.utils import secure_filename
-from rag import add_document, answer_query, list_collections
+from rag import add_document, answer_query, stream_answer_query, list_collections, save_uploaded_file, cache_stats, retrieve
+from jobs import IngestionJobQueue
+from highlight import highlight_phrases, quote_phrases
 
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+# number of files ingested in parallel by the background job queue
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", 2))
+# job status is kept on disk so every gunicorn worker can answer /jobs for uploads another worker accepted
+JOBS_DIR = os.getenv("JOBS_DIR", "./rag_jobs")
 
 app = Flask(__name__)
+ingestion_jobs = IngestionJobQueue(add_document, max_workers=INGEST_MAX_WORKERS, state_dir=JOBS_DIR)
 
 # Utility to extract and format citation context
 def get_cited_context(result_obj):
     source_with_citations = {}
-
-    def highlight_text(context, quote):
-        quote = re.sub(r'\s+', ' ', quote).strip()
-        context = re.sub(r'\s+', ' ', context).strip()
-        phrases = [phrase.strip() for phrase in re.split(r'[.!?]', quote) if phrase.strip()]
-        highlighted_context = context
-        for phrase in phrases:
-            escaped_phrase = re.escape(phrase)
-            pattern = re.compile(r'\b' + escaped_phrase + r'\b', re.IGNORECASE)
-            highlighted_context = pattern.sub(lambda m: f"**{m.group(0)}**", highlighted_context)
-        return highlighted_context
+    # (source, title, id, page) -> citation entry, so grouping and context lookup are dict hits
+    citation_index = {}
 
     for cite in result_obj['citations'].dict()['citations']:
-        cite_id = cite['id']
-        title = cite['title']
-        source = cite['source']
-        page = cite['page']
-        quote = cite['quotes']
-
-        if (source, title) not in source_with_citations:
-            source_with_citations[(source, title)] = {
-                'title': title,
-                'source': source,
-                'citations': []
-            }
-
-        citation_entry = next(
-            (c for c in source_with_citations[(source, title)]['citations'] if c['id'] == cite_id and c['page'] == page),
-            None
-        )
+        source, title = cite['source'], cite['title']
+        key = (source, title, cite['id'], cite['page'])
+
+        citation_entry = citation_index.get(key)
         if citation_entry is None:
-            citation_entry = {'id': cite_id, 'page': page, 'quote': [quote], 'context': None}
+            if (source, title) not in source_with_citations:
+                source_with_citations[(source, title)] = {
+                    'title': title,
+                    'source': source,
+                    'citations': []
+                }
+            citation_entry = {'id': cite['id'], 'page': cite['page'], 'quote': [], 'context': None}
             source_with_citations[(source, title)]['citations'].append(citation_entry)
-        else:
-            citation_entry['quote'].append(quote)
+            citation_index[key] = citation_entry
+        citation_entry['quote'].append(cite['quotes'])
 
     for context in result_obj['context']:
-        context_id = context.metadata['id']
-        context_page = context.metadata['page']
-        source = context.metadata['source']
-        title = context.metadata['title']
-        page_content = context.page_content
-
-        if (source, title) in source_with_citations:
-            for citation in source_with_citations[(source, title)]['citations']:
-                if citation['id'] == context_id and citation['page'] == context_page:
-                    highlighted_content = page_content
-                    for quote in citation['quote']:
-                        highlighted_content = highlight_text(highlighted_content, quote)
-                    citation['context'] = markdown.markdown(highlighted_content)
-
-    return [
-        {
-            'title': details['title'],
-            'source': details['source'],
-            'citations': details['citations']
-        }
-        for details in source_with_citations.values()
-    ]
+        metadata = context.metadata
+        citation = citation_index.get((metadata['source'], metadata['title'], metadata['id'], metadata['page']))
+        if citation is not None:
+            # all phrases of all quotes for this chunk are marked in a single pass over it
+            phrases = [phrase for quote in citation['quote'] for phrase in quote_phrases(quote)]
+            citation['context'] = markdown.markdown(highlight_phrases(context.page_content, phrases))
+
+    return list(source_with_citations.values())
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
     collections = list_collections()
     result = None
+    jobs = []
     active_tab = 'upload'  # Default tab
 
     if request.method == 'POST':
@@ -88,14 +66,14 @@ def index():
             existing_collection = request.form.get('existing_collection', '').strip()
             collection = new_collection if new_collection else existing_collection
 
-            # Handle document upload
+            # Handle document upload: files are queued and ingested in the background
             if collection:
                 files = request.files.getlist("documents")
                 for file in files:
                     filename = secure_filename(file.filename)
-                    save_path = os.path.join(UPLOAD_DIR, filename)
-                    file.save(save_path)
-                    add_document(save_path, collection)
+                    save_path = save_uploaded_file(file, filename)
+                    job_id = ingestion_jobs.submit(save_path, collection)
+                    jobs.append(ingestion_jobs.status(job_id))
 
         else:
             # Handle question query
@@ -106,7 +84,57 @@ def index():
             result['formatted_citations'] = get_cited_context(result)
             active_tab = 'ask'
 
-    return render_template("index.html", collections=collections, result=result, active_tab=active_tab)
+    return render_template("index.html", collections=collections, result=result, jobs=jobs, active_tab=active_tab)
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/stream', methods=['GET'])
+def stream_answer():
+    # answer tokens are sent as they arrive; citations and highlighted contexts follow in a final event
+    collection = request.args['collection_name']
+    question = request.args['query']
+
+    def generate():
+        result = {'question': question, 'context': [], 'answer': ''}
+        try:
+            for event, payload in stream_answer_query(question, collection):
+                if event == 'token':
+                    result['answer'] += payload
+                    yield sse_event('token', {'text': payload})
+                else:
+                    result[event] = payload
+            result['answer'] = markdown.markdown(result['answer'])
+            result['formatted_citations'] = get_cited_context(result)
+            yield sse_event('final', {'html': render_template('_answer.html', result=result)})
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/search', methods=['GET'])
+def search():
+    # retrieval only, no LLM call: the chunks a question would be answered from
+    collection = request.args['collection_name']
+    docs = retrieve(request.args['query'], collection)
+    return jsonify([{'id': doc.metadata['id'], 'title': doc.metadata['title'], 'source': doc.metadata['source'],
+                     'page': doc.metadata['page'], 'text': doc.page_content} for doc in docs])
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(cache_stats())
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify(ingestion_jobs.list_jobs(request.args.get('collection')))
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = ingestion_jobs.status(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job)
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,104 @@
+"""
+Micro-benchmark of citation highlighting: the previous per-phrase regex loop against the
+single-pass Aho-Corasick matcher in highlight.py, on synthetic 3500-char chunks.
+
+Every chunk gets `--quotes` citations of a few sentences each, taken from the chunk itself
+(the shape the citation step produces), so the amount of highlighting is realistic.
+
+    python bench_highlight.py --chunks 20 --quotes 10
+"""
+import argparse
+import random
+import re
+import statistics
+import time
+
+from highlight import PhraseMatcher, highlight_phrases, quote_phrases
+
+WORDS = ('retrieval augmented generation model context chunk embedding vector index query answer '
+         'citation source document passage encoder decoder transformer attention token latency '
+         'throughput benchmark dataset evaluation recall precision dense sparse lexical hybrid').split()
+
+
+def legacy_highlight_text(context, quote):
+    quote = re.sub(r'\s+', ' ', quote).strip()
+    context = re.sub(r'\s+', ' ', context).strip()
+    phrases = [phrase.strip() for phrase in re.split(r'[.!?]', quote) if phrase.strip()]
+    highlighted_context = context
+    for phrase in phrases:
+        escaped_phrase = re.escape(phrase)
+        pattern = re.compile(r'\b' + escaped_phrase + r'\b', re.IGNORECASE)
+        highlighted_context = pattern.sub(lambda m: f"**{m.group(0)}**", highlighted_context)
+    return highlighted_context
+
+
+def legacy_highlight(context, quotes):
+    for quote in quotes:
+        context = legacy_highlight_text(context, quote)
+    return context
+
+
+def single_pass_highlight(context, quotes):
+    return highlight_phrases(context, [phrase for quote in quotes for phrase in quote_phrases(quote)])
+
+
+def make_chunk(rng, n_chars=3500):
+    sentences = []
+    length = 0
+    while length < n_chars:
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + '.'
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return sentences
+
+
+def make_case(rng, n_quotes, sentences_per_quote=3):
+    sentences = make_chunk(rng)
+    quotes = []
+    for _ in range(n_quotes):
+        start = rng.randrange(len(sentences) - sentences_per_quote)
+        quotes.append(' '.join(sentences[start:start + sentences_per_quote]))
+    return '\n'.join(sentences), quotes
+
+
+def timed(fn, cases, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for context, quotes in cases:
+            fn(context, quotes)
+        runs.append((time.perf_counter() - start) * 1000)
+    return statistics.median(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=20, help='cited chunks per answer')
+    parser.add_argument('--quotes', type=int, default=10, help='quotes per cited chunk')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = [make_case(rng, args.quotes) for _ in range(args.chunks)]
+    n_phrases = sum(len(quote_phrases(quote)) for _, quotes in cases for quote in quotes)
+    print(f'{args.chunks} chunks, {args.quotes} quotes each, {n_phrases} phrases')
+
+    # both must leave the chunk text itself untouched, only adding markers around it
+    agree = sum(
+        legacy_highlight(context, quotes).replace('**', '') == single_pass_highlight(context, quotes).replace('**', '')
+        for context, quotes in cases
+    )
+    print(f'text preserved in {agree}/{len(cases)} chunks')
+
+    legacy_ms = timed(legacy_highlight, cases, args.repeat)
+    single_ms = timed(single_pass_highlight, cases, args.repeat)
+    matcher_cases = [(context, PhraseMatcher([phrase for quote in quotes for phrase in quote_phrases(quote)]))
+                     for context, quotes in cases]
+    match_ms = timed(lambda context, matcher: matcher.find(context), matcher_cases, args.repeat)
+    print(f'  regex loop: {legacy_ms:8.2f} ms')
+    print(f' single pass: {single_ms:8.2f} ms  ({legacy_ms / single_ms:.1f}x, of which {match_ms:.2f} ms scanning)')
+
+
+if __name__ == '__main__':
+    main()
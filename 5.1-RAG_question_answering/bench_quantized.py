@@ -0,0 +1,116 @@
+"""
+Compare Chroma with the quantized index (int8 and binary first pass) on a collection:
+memory, query latency and recall@k against exact float32 search.
+
+Queries are questions from a JSONL file ({"question": ...} per line) or `--sample` stored chunk
+vectors. Memory is reported as the bytes each backend keeps resident for search (Chroma loads its
+whole HNSW index; the quantized index scans only its int8 codes or sign bits) and as the process
+RSS growth after opening and querying it. Builds the quantized index first if it is missing.
+
+    python bench_quantized.py test_collection --sample 200
+    python bench_quantized.py test_collection --queries eval_queries.jsonl --rescore-factor 20
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import statistics
+import time
+
+import numpy as np
+
+from embedding_cache import embed_queries
+from quantized_index import QuantizedIndex
+from rag import (CHROMA_DIR, RETRIEVAL_K, QUANTIZED_RESCORE_FACTOR, embedding_model, get_chroma_collection,
+                 build_quantized_index, quantized_index_path)
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        # peak rather than current RSS outside Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def file_mb(path, *names):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in names) / 2 ** 20
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return statistics.median(latencies), latencies[int(0.95 * (len(latencies) - 1))]
+
+
+def load_queries(args, index):
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            questions = [json.loads(line)['question'] for line in f if line.strip()]
+        return np.asarray(embed_queries(embedding_model, questions), dtype=np.float32)
+    rng = np.random.default_rng(args.seed)
+    rows = rng.choice(len(index), size=min(args.sample, len(index)), replace=False)
+    return np.array(index.vectors[np.sort(rows)])
+
+
+def run(name, search, queries, truth, k, resident_mb, rss_before):
+    search(queries[0])
+    latencies, recalls = [], []
+    for query, relevant in zip(queries, truth):
+        start = time.perf_counter()
+        found = search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(set(found) & relevant) / k)
+    p50, p95 = percentiles(latencies)
+    print(f'{name:>8} {statistics.mean(recalls):>9.3f} {p50:>8.2f} {p95:>8.2f} {resident_mb:>12.1f} '
+          f'{rss_mb() - rss_before:>9.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('collection')
+    parser.add_argument('--queries', help='JSONL file with a question per line')
+    parser.add_argument('--sample', type=int, default=200, help='stored chunks used as queries when --queries is not given')
+    parser.add_argument('--k', type=int, default=RETRIEVAL_K)
+    parser.add_argument('--rescore-factor', type=int, default=QUANTIZED_RESCORE_FACTOR)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    path = quantized_index_path(args.collection)
+    if not QuantizedIndex.exists(path):
+        build_quantized_index(args.collection)
+    exact = QuantizedIndex(path)
+    queries = load_queries(args, exact)
+    with open(os.path.join(path, 'ids.txt'), 'r', encoding='utf-8') as f:
+        ids = [line.rstrip('\n') for line in f]
+    truth = [{ids[row] for row, _ in exact.exact_search(query, args.k)} for query in queries]
+    exact.close()
+    # unmap the float32 pages the exact search touched so the RSS numbers below start clean
+    del exact
+    print(f'{args.collection}: {len(ids)} vectors of dim {queries.shape[1]}, {len(queries)} queries, '
+          f'float32 vectors {file_mb(path, "vectors.f32"):.1f} MB')
+    print(f"{'backend':>8} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p95 ms':>8} {'resident MB':>12} {'RSS +MB':>9}")
+
+    for mode, scanned in (('binary', ('bits.u8',)), ('int8', ('codes.i8', 'scales.f32'))):
+        rss_before = rss_mb()
+        index = QuantizedIndex(path, mode=mode, rescore_factor=args.rescore_factor)
+
+        def search(query):
+            return [ids[row] for row, _ in index.search(query, args.k)]
+
+        run(mode, search, queries, truth, args.k, file_mb(path, *scanned), rss_before)
+        index.close()
+
+    rss_before = rss_mb()
+    collection = get_chroma_collection(args.collection)._collection
+
+    def search(query):
+        return collection.query(query_embeddings=[query.tolist()], n_results=args.k, include=[])['ids'][0]
+
+    hnsw_files = glob.glob(os.path.join(CHROMA_DIR, args.collection, '*', '*.bin'))
+    run('chroma', search, queries, truth, args.k, sum(map(os.path.getsize, hnsw_files)) / 2 ** 20, rss_before)
+
+
+if __name__ == '__main__':
+    main()
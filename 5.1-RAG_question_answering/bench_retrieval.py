@@ -0,0 +1,78 @@
+"""
+Benchmark dense-only vs hybrid (BM25 + dense, reciprocal rank fusion) retrieval on a collection.
+
+Queries come either from a JSONL file with {"question": ..., "relevant_ids": [...]} per line,
+or are sampled from the collection itself: each sampled chunk becomes a query made of its
+rarest terms (the exact-term case dense search tends to miss), with that chunk as the answer.
+
+    python bench_retrieval.py test_collection --sample 200
+    python bench_retrieval.py test_collection --queries eval_queries.jsonl --k 5
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from lexical_index import HybridRetriever, tokenize
+from rag import embedding_model, get_chroma_collection, get_lexical_index, RETRIEVAL_K, HYBRID_FETCH_K
+
+
+def sample_queries(collection, n_queries, terms_per_query=3, seed=0):
+    index = get_lexical_index(collection)
+    vectorstore = get_chroma_collection(collection)
+    stored = vectorstore.get(include=['documents', 'metadatas'])
+    rng = random.Random(seed)
+    picks = rng.sample(range(len(stored['ids'])), min(n_queries, len(stored['ids'])))
+    queries = []
+    for i in picks:
+        terms = set(tokenize(stored['documents'][i]))
+        rarest = sorted(terms, key=lambda term: (index.document_frequency(term), term))[:terms_per_query]
+        queries.append({'question': ' '.join(rarest), 'relevant_ids': [stored['metadatas'][i]['id']]})
+    return queries
+
+
+def evaluate(name, retriever, queries, k):
+    latencies, recalls = [], []
+    for query in queries:
+        start = time.perf_counter()
+        docs = retriever.invoke(query['question'])
+        latencies.append((time.perf_counter() - start) * 1000)
+        found = {doc.metadata['id'] for doc in docs[:k]}
+        relevant = set(query['relevant_ids'])
+        recalls.append(len(found & relevant) / len(relevant))
+    latencies.sort()
+    print(f"{name:>8}: recall@{k}={statistics.mean(recalls):.3f}  "
+          f"p50={statistics.median(latencies):.1f}ms  "
+          f"p95={latencies[int(0.95 * (len(latencies) - 1))]:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('collection')
+    parser.add_argument('--queries', help='JSONL file with question and relevant_ids per line')
+    parser.add_argument('--sample', type=int, default=100, help='number of sampled queries when --queries is not given')
+    parser.add_argument('--k', type=int, default=RETRIEVAL_K)
+    args = parser.parse_args()
+
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            queries = [json.loads(line) for line in f if line.strip()]
+    else:
+        queries = sample_queries(args.collection, args.sample)
+    print(f'{len(queries)} queries against {args.collection}')
+
+    vectorstore = get_chroma_collection(args.collection)
+    dense = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": args.k})
+    hybrid = HybridRetriever(vectorstore=vectorstore, lexical_index=get_lexical_index(args.collection),
+                             k=args.k, fetch_k=HYBRID_FETCH_K)
+    # embed every query up front (they stay in the query LRU) so both modes time only the search itself
+    for query in queries:
+        embedding_model.embed_query(query['question'])
+    dense.invoke(queries[0]['question'])
+    evaluate('dense', dense, queries, args.k)
+    evaluate('hybrid', hybrid, queries, args.k)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Compare startup cost of the per-collection Chroma layout with the shared store.
+
+For each layout a fresh Python process imports chromadb, opens every collection and runs one query
+against each, as a server does when its first requests come in. It reports process wall time,
+the time spent opening and querying, open file descriptors and RSS. Both layouts must be on disk:
+run migrate_store.py without --remove-source first, or pass --synthetic N to benchmark N generated
+collections in a temporary directory.
+
+    python bench_store.py
+    python bench_store.py --synthetic 300 --chunks 200 --dim 1536
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SHARED_STORE_DIRNAME = '_shared_store'
+
+
+def open_and_query(layout, root, names):
+    # runs in the child process: everything a server pays before answering each collection once
+    import chromadb
+
+    start = time.perf_counter()
+    shared = chromadb.PersistentClient(path=os.path.join(root, SHARED_STORE_DIRNAME)) if layout == 'shared' else None
+    for name in names:
+        client = shared or chromadb.PersistentClient(path=os.path.join(root, name))
+        collection = client.get_collection(name)
+        probe = collection.get(limit=1, include=['embeddings'])
+        if probe['ids']:
+            collection.query(query_embeddings=[list(probe['embeddings'][0])], n_results=1)
+    elapsed = time.perf_counter() - start
+    with open('/proc/self/statm', 'r') as f:
+        rss_mb = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    print(json.dumps({'open_seconds': elapsed, 'fds': len(os.listdir('/proc/self/fd')), 'rss_mb': rss_mb}))
+
+
+def build_synthetic(root, n_collections, n_chunks, dim, seed=0):
+    import chromadb
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    shared = chromadb.PersistentClient(path=os.path.join(root, SHARED_STORE_DIRNAME))
+    names = [f'tenant_{n:04d}' for n in range(n_collections)]
+    for name in names:
+        vectors = rng.normal(size=(n_chunks, dim)).astype(np.float32).tolist()
+        ids = [f'{name}-{i}' for i in range(n_chunks)]
+        documents = [f'chunk {i} of {name}' for i in range(n_chunks)]
+        for client in (chromadb.PersistentClient(path=os.path.join(root, name)), shared):
+            collection = client.create_collection(name, metadata={'hnsw:space': 'cosine'})
+            collection.add(ids=ids, embeddings=vectors, documents=documents)
+    return names
+
+
+def run_child(layout, root, names):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, __file__, '--child', layout, '--root', root, *names],
+                            capture_output=True, text=True, check=True)
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    stats['process_seconds'] = time.perf_counter() - start
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('names', nargs='*', help=argparse.SUPPRESS)
+    parser.add_argument('--child', choices=['per_collection', 'shared'], help=argparse.SUPPRESS)
+    parser.add_argument('--root', help='directory holding both layouts (default: CHROMA_DIR)')
+    parser.add_argument('--synthetic', type=int, help='generate this many collections in a temporary directory')
+    parser.add_argument('--chunks', type=int, default=100, help='vectors per synthetic collection')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.child:
+        open_and_query(args.child, args.root, args.names)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.synthetic:
+            root = tmp_dir
+            names = build_synthetic(root, args.synthetic, args.chunks, args.dim)
+        else:
+            from rag import CHROMA_DIR
+            root = args.root or CHROMA_DIR
+            names = sorted(name for name in os.listdir(root)
+                           if os.path.exists(os.path.join(root, name, 'chroma.sqlite3')))
+            if not os.path.isdir(os.path.join(root, SHARED_STORE_DIRNAME)):
+                sys.exit('No shared store found: run migrate_store.py (without --remove-source) first')
+        print(f'{len(names)} collections under {root}, best of {args.repeat} cold starts')
+        print(f"{'layout':>15} {'process s':>10} {'open+query s':>13} {'open fds':>9} {'RSS MB':>8}")
+        for layout in ('per_collection', 'shared'):
+            runs = [run_child(layout, root, names) for _ in range(args.repeat)]
+            best = min(runs, key=lambda stats: stats['process_seconds'])
+            print(f"{layout:>15} {best['process_seconds']:>10.2f} {best['open_seconds']:>13.2f} "
+                  f"{best['fds']:>9} {best['rss_mb']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import json
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # no cross-process locking on Windows, where the app runs as a single process anyway
+    fcntl = None
+
+CONFIG_FILENAME = 'collection_config.json'
+LOCK_FILENAME = '.lock'
+
+
+@contextmanager
+def collection_lock(collection_dir):
+    """
+    Exclusive lock on a collection directory shared by every process using it, held while
+    its side files (config, BM25 index) are read, changed and written back.
+    """
+    os.makedirs(collection_dir, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(collection_dir, LOCK_FILENAME), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def load_collection_config(collection_dir, defaults=None):
+    """Per-collection settings persisted as JSON inside the collection directory"""
+    config = dict(defaults or {})
+    path = os.path.join(collection_dir, CONFIG_FILENAME)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            config.update(json.load(f))
+    return config
+
+
+def _write_collection_config(collection_dir, config):
+    path = os.path.join(collection_dir, CONFIG_FILENAME)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def update_collection_config(collection_dir, **updates):
+    with collection_lock(collection_dir):
+        config = load_collection_config(collection_dir)
+        config.update(updates)
+        _write_collection_config(collection_dir, config)
+    return config
+
+
+def bump_collection_generation(collection_dir):
+    """
+    Count a change to the collection's contents. Processes compare the generation with the one
+    they last saw to drop handles and cached answers that another process made stale.
+    """
+    with collection_lock(collection_dir):
+        config = load_collection_config(collection_dir)
+        config['generation'] = config.get('generation', 0) + 1
+        _write_collection_config(collection_dir, config)
+    return config['generation']
@@ -0,0 +1,75 @@
+import json
+import os
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# key of the snapshot description in the Parquet schema metadata
+SNAPSHOT_METADATA_KEY = b'rag_snapshot'
+SNAPSHOT_FORMAT_VERSION = 1
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise ImportError("Collection snapshots need pyarrow: pip install pyarrow")
+
+
+def _column(batch, name):
+    return batch.column(batch.schema.get_field_index(name))
+
+
+def write_snapshot(path, pages, dim, info, compression='zstd'):
+    """
+    Write a collection snapshot as a single Parquet file: one row per chunk with its id, text,
+    metadata (JSON) and embedding as a fixed-size list of float16, half the size of Chroma's float32.
+    `pages` is an iterable of (ids, embeddings, documents, metadatas) batches such as Chroma get() pages;
+    each becomes a row group, so readers can stream the file back in bounded memory.
+    `info` (collection name, settings, ...) is stored in the schema metadata. Returns the row count.
+    """
+    _require_pyarrow()
+    info = {**info, 'format_version': SNAPSHOT_FORMAT_VERSION, 'dim': dim}
+    schema = pa.schema(
+        [('id', pa.string()), ('document', pa.large_string()), ('metadata', pa.string()),
+         ('embedding', pa.list_(pa.float16(), dim))],
+        metadata={SNAPSHOT_METADATA_KEY: json.dumps(info)})
+    tmp_path = f'{path}.tmp'
+    rows = 0
+    with pq.ParquetWriter(tmp_path, schema, compression=compression) as writer:
+        for ids, embeddings, documents, metadatas in pages:
+            vectors = np.asarray(embeddings, dtype=np.float16).reshape(-1)
+            table = pa.Table.from_arrays(
+                [pa.array(ids, pa.string()),
+                 pa.array(documents, pa.large_string()),
+                 pa.array([json.dumps(metadata) for metadata in metadatas], pa.string()),
+                 pa.FixedSizeListArray.from_arrays(pa.array(vectors, pa.float16()), dim)],
+                schema=schema)
+            writer.write_table(table)
+            rows += len(ids)
+    os.replace(tmp_path, path)
+    return rows
+
+
+def read_snapshot_info(path):
+    _require_pyarrow()
+    parquet_file = pq.ParquetFile(path)
+    info = json.loads(parquet_file.schema_arrow.metadata[SNAPSHOT_METADATA_KEY])
+    info['rows'] = parquet_file.metadata.num_rows
+    return info
+
+
+def iter_snapshot(path, batch_size=5000):
+    """Yield (ids, float32 embeddings, documents, metadatas) batches of a snapshot"""
+    _require_pyarrow()
+    parquet_file = pq.ParquetFile(path)
+    dim = json.loads(parquet_file.schema_arrow.metadata[SNAPSHOT_METADATA_KEY])['dim']
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        vectors = _column(batch, 'embedding').flatten().to_numpy(zero_copy_only=False)
+        yield (_column(batch, 'id').to_pylist(),
+               vectors.reshape(batch.num_rows, dim).astype(np.float32),
+               _column(batch, 'document').to_pylist(),
+               [json.loads(metadata) for metadata in _column(batch, 'metadata').to_pylist()])
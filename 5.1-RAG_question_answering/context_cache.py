@@ -0,0 +1,111 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class ContextCache:
+    """
+    Persistent, content-addressed cache of generated chunk contexts.
+
+    Entries are keyed by a hash of the document, the chunk text, the prompt and the model,
+    so the same PDF ingested into another collection (or re-ingested after a crash)
+    reuses the contexts that were already paid for.
+    Eviction drops entries older than `max_age_days` and then the least recently used
+    entries beyond `max_entries`.
+    """
+
+    def __init__(self, path, max_entries=200_000, max_age_days=90):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS chunk_contexts (
+                   key TEXT PRIMARY KEY,
+                   context TEXT NOT NULL,
+                   created_at REAL NOT NULL,
+                   accessed_at REAL NOT NULL
+               )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_chunk_contexts_accessed ON chunk_contexts (accessed_at)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(document, chunk, prompt, model):
+        digest = hashlib.sha256()
+        for part in (hashlib.sha256(document.encode('utf-8')).hexdigest(), chunk, prompt, model):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\x00')
+        return digest.hexdigest()
+
+    def get_many(self, keys):
+        """Return {key: context} for the keys present in the cache"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, context, created_at FROM chunk_contexts WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, context, created_at in rows:
+                    if now - created_at <= self.max_age_seconds:
+                        found[key] = context
+            if found:
+                self._conn.executemany(
+                    "UPDATE chunk_contexts SET accessed_at = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def set_many(self, items):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunk_contexts (key, context, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                [(key, context, now, now) for key, context in items.items()],
+            )
+            self._conn.commit()
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM chunk_contexts WHERE created_at < ?",
+                (time.time() - self.max_age_seconds,),
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM chunk_contexts").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    """DELETE FROM chunk_contexts WHERE key IN (
+                           SELECT key FROM chunk_contexts ORDER BY accessed_at ASC LIMIT ?
+                       )""",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM chunk_contexts").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+        }
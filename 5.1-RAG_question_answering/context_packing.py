@@ -0,0 +1,83 @@
+import numpy as np
+import tiktoken
+
+from langchain_core.documents import Document
+
+
+class ContextPacker:
+    """
+    Assembles retrieved chunks into a prompt context that fits a token budget.
+
+    Chunks are re-ranked with maximal marginal relevance over their stored embeddings:
+    each step picks the chunk maximizing
+    lambda_mult * sim(query, chunk) - (1 - lambda_mult) * max sim(chunk, already picked).
+    A chunk whose similarity to an already picked one reaches `redundancy_threshold` is dropped
+    as a near-duplicate. Chunks are added in that order until the budget is used; the first
+    chunk that does not fit is cut to the remaining budget if at least `min_trim_tokens` are left.
+    """
+
+    def __init__(self, token_budget=6000, lambda_mult=0.7, redundancy_threshold=0.92,
+                 min_trim_tokens=200, encoding='o200k_base'):
+        self.token_budget = token_budget
+        self.lambda_mult = lambda_mult
+        self.redundancy_threshold = redundancy_threshold
+        self.min_trim_tokens = min_trim_tokens
+        self.encoding = tiktoken.get_encoding(encoding)
+
+    def mmr_order(self, query_embedding, doc_embeddings):
+        """Return (order, redundant): indices in MMR order and indices dropped as near-duplicates"""
+        query = np.array(query_embedding, dtype=np.float32)
+        matrix = np.array(doc_embeddings, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        relevance = matrix @ query
+        similarity = matrix @ matrix.T
+
+        order, redundant = [], []
+        remaining = list(range(len(matrix)))
+        max_similarity = np.full(len(matrix), -np.inf)
+        while remaining:
+            if order:
+                scores = self.lambda_mult * relevance[remaining] - (1 - self.lambda_mult) * max_similarity[remaining]
+            else:
+                scores = relevance[remaining]
+            best = remaining.pop(int(np.argmax(scores)))
+            if max_similarity[best] >= self.redundancy_threshold:
+                redundant.append(best)
+                continue
+            order.append(best)
+            max_similarity = np.maximum(max_similarity, similarity[best])
+        return order, redundant
+
+    def pack(self, query_embedding, docs, doc_embeddings):
+        """Return (packed_docs, report) where report counts the context tokens kept and saved"""
+        token_counts = [len(self.encoding.encode(doc.page_content)) for doc in docs]
+        tokens_before = sum(token_counts)
+        if not docs:
+            return [], {'retrieved': 0, 'kept': 0, 'redundant': 0, 'trimmed': 0, 'over_budget': 0,
+                        'tokens_before': 0, 'tokens_after': 0, 'tokens_saved': 0}
+        order, redundant = self.mmr_order(query_embedding, doc_embeddings)
+
+        packed, used, trimmed, over_budget = [], 0, 0, 0
+        for i in order:
+            remaining = self.token_budget - used
+            if token_counts[i] <= remaining:
+                packed.append(docs[i])
+                used += token_counts[i]
+            elif remaining >= self.min_trim_tokens:
+                tokens = self.encoding.encode(docs[i].page_content)[:remaining]
+                packed.append(Document(page_content=self.encoding.decode(tokens), metadata=dict(docs[i].metadata)))
+                used += remaining
+                trimmed += 1
+            else:
+                over_budget += 1
+        return packed, {
+            'retrieved': len(docs),
+            'kept': len(packed),
+            'redundant': len(redundant),
+            'trimmed': trimmed,
+            'over_budget': over_budget,
+            'tokens_before': tokens_before,
+            'tokens_after': used,
+            'tokens_saved': tokens_before - used,
+        }
@@ -0,0 +1,35 @@
+"""
+Gunicorn settings for serving app.py from several worker processes.
+
+Embedded Chroma must only be opened by one process, so multi-worker serving goes through one
+Chroma server that owns the shared store (migrate_store.py creates it from per-collection folders):
+
+    chroma run --path ./rag_chroma_db/_shared_store --port 8000
+    CHROMA_STORE_MODE=server gunicorn -c gunicorn.conf.py app:app
+
+Vector reads and writes from every worker go to the server. The files kept next to each collection
+(config, BM25 and quantized indexes) are written under a file lock, and a generation counter in the
+collection config tells the other workers to drop their cached handles and answers after an ingestion.
+Job status is shared through JOBS_DIR.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "127.0.0.1:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# threads keep SSE answer streams from tying up a whole worker
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", 4))
+# answers wait on the LLM; streamed ones keep the connection open for the whole answer
+timeout = 180
+graceful_timeout = 30
+# each worker opens its own Chroma client and thread pools after the fork
+preload_app = False
+
+
+def on_starting(server):
+    store_mode = os.getenv("CHROMA_STORE_MODE")
+    if server.cfg.workers > 1 and store_mode != "server":
+        raise RuntimeError(
+            f"{server.cfg.workers} workers need CHROMA_STORE_MODE=server (got {store_mode or 'unset'}): "
+            "embedded Chroma stores cannot be shared between processes")
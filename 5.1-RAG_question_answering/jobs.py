@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from log import logger
+
+
+class IngestionJobQueue:
+    """
+    Local background queue for document ingestion.
+
+    Jobs run on a bounded thread pool (ingestion is dominated by LLM and embedding I/O),
+    so an upload request only enqueues files and returns their job ids.
+    `ingest_fn(file_path, collection, on_progress)` does the work and reports its stage
+    through `on_progress(stage, **info)`.
+    With `state_dir`, every job is also written there as <job id>.json, so any worker process of
+    the app can report the status of a job another worker accepted.
+    """
+
+    def __init__(self, ingest_fn, max_workers=2, max_finished_jobs=500, state_dir=None):
+        self.ingest_fn = ingest_fn
+        self.max_finished_jobs = max_finished_jobs
+        self.state_dir = state_dir
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingest')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, file_path, collection):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                'id': job_id,
+                'file': file_path.split('/')[-1],
+                'collection': collection,
+                'status': 'queued',
+                'stage': 'queued',
+                'progress': {},
+                'error': None,
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+            }
+            self._save(self._jobs[job_id])
+            self._prune()
+        self._executor.submit(self._run, job_id, file_path, collection)
+        return job_id
+
+    def _run(self, job_id, file_path, collection):
+        self._update(job_id, status='running', stage='starting', started_at=time.time())
+
+        def on_progress(stage, **info):
+            self._update(job_id, stage=stage, progress=info)
+
+        try:
+            self.ingest_fn(file_path, collection, on_progress=on_progress)
+            self._update(job_id, status='done', stage='done', finished_at=time.time())
+        except Exception as e:
+            logger.error(f'Ingestion job {job_id} failed for {file_path}: {e}\n{traceback.format_exc()}')
+            self._update(job_id, status='failed', error=str(e), finished_at=time.time())
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+            self._save(self._jobs[job_id])
+
+    def _job_path(self, job_id):
+        return os.path.join(self.state_dir, f'{job_id}.json')
+
+    def _save(self, job):
+        if not self.state_dir:
+            return
+        tmp_path = f"{self._job_path(job['id'])}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._job_path(job['id']))
+
+    def _load(self, job_id):
+        try:
+            with open(self._job_path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job['status'] in ('done', 'failed')]
+        finished.sort(key=lambda job: job['finished_at'])
+        for job in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self._jobs[job['id']]
+            if self.state_dir:
+                os.remove(self._job_path(job['id']))
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                return dict(job)
+        # accepted by another worker process
+        return self._load(job_id) if self.state_dir and len(job_id) == 32 and job_id.isalnum() else None
+
+    def list_jobs(self, collection=None):
+        if self.state_dir:
+            job_ids = [name[:-len('.json')] for name in os.listdir(self.state_dir) if name.endswith('.json')]
+            jobs = [job for job in map(self.status, job_ids) if job is not None]
+        else:
+            with self._lock:
+                jobs = [dict(job) for job in self._jobs.values()]
+        jobs = [job for job in jobs if collection is None or job['collection'] == collection]
+        return sorted(jobs, key=lambda job: job['submitted_at'], reverse=True)
@@ -0,0 +1,96 @@
+import re
+from collections import Counter, defaultdict
+
+from schema import Citation, QuotedCitations
+
+SENTENCE_SPLIT_PATTERN = re.compile(r'(?<=[.!?])\s+|\n\s*\n|\n\s*(?=[-*•]|\d+\.\s)')
+WORD_PATTERN = re.compile(r'\w+')
+# markdown emphasis, headings and list markers the answer model likes to add
+MARKDOWN_PATTERN = re.compile(r'[*_`#>]+|^\s*(?:[-•]|\d+\.)\s+', re.MULTILINE)
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_SPLIT_PATTERN.split(text) if sentence and sentence.strip()]
+
+
+def shingles(text, size=3):
+    """Set of word n-grams of text; texts shorter than size give a single shingle of all their words"""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class CitationAligner:
+    """
+    Deterministic citation extraction without an LLM call.
+
+    Every sentence of the retrieved chunks is indexed by its word shingles. Each answer sentence
+    is matched to the chunk sentence sharing the largest fraction of shingles with it
+    (overlap / size of the smaller shingle set, so a short answer sentence can match inside a
+    longer source sentence and vice versa). Matches scoring at least `min_score` become
+    verbatim quotes, grouped per chunk into the same Citation schema the LLM path produces.
+    """
+
+    def __init__(self, shingle_size=3, min_score=0.5, min_overlap=2, max_quotes_per_chunk=5):
+        self.shingle_size = shingle_size
+        self.min_score = min_score
+        self.min_overlap = min_overlap
+        self.max_quotes_per_chunk = max_quotes_per_chunk
+
+    def _index(self, docs):
+        sentences = []
+        postings = defaultdict(list)
+        for doc_index, doc in enumerate(docs):
+            for sentence in split_sentences(doc.page_content):
+                sentence_shingles = shingles(sentence, self.shingle_size)
+                if not sentence_shingles:
+                    continue
+                sentence_id = len(sentences)
+                sentences.append((doc_index, sentence, len(sentence_shingles)))
+                for shingle in sentence_shingles:
+                    postings[shingle].append(sentence_id)
+        return sentences, postings
+
+    def align(self, answer, docs):
+        """Return {doc_index: [(score, sentence_id, sentence)]} for every supported answer sentence"""
+        sentences, postings = self._index(docs)
+        matches = defaultdict(dict)
+        for answer_sentence in split_sentences(MARKDOWN_PATTERN.sub('', answer)):
+            answer_shingles = shingles(answer_sentence, self.shingle_size)
+            overlaps = Counter()
+            for shingle in answer_shingles:
+                overlaps.update(postings.get(shingle, ()))
+            best = None
+            for sentence_id, overlap in overlaps.items():
+                _, _, n_shingles = sentences[sentence_id]
+                if overlap < min(self.min_overlap, len(answer_shingles)):
+                    continue
+                score = overlap / min(len(answer_shingles), n_shingles)
+                if score >= self.min_score and (best is None or score > best[0]):
+                    best = (score, sentence_id)
+            if best is not None:
+                score, sentence_id = best
+                doc_index, sentence, _ = sentences[sentence_id]
+                previous = matches[doc_index].get(sentence_id)
+                matches[doc_index][sentence_id] = max(score, previous or 0.0)
+        return {
+            doc_index: [(score, sentence_id, sentences[sentence_id][1]) for sentence_id, score in found.items()]
+            for doc_index, found in matches.items()
+        }
+
+    def extract(self, answer, docs):
+        citations = []
+        for doc_index, found in sorted(self.align(answer, docs).items()):
+            # keep the best supported sentences, quoted in their original order
+            found = sorted(found, reverse=True)[:self.max_quotes_per_chunk]
+            quotes = ' '.join(sentence for _, _, sentence in sorted(found, key=lambda match: match[1]))
+            metadata = docs[doc_index].metadata
+            citations.append(Citation(
+                id=metadata['id'],
+                source=metadata['source'],
+                title=metadata['title'],
+                page=metadata['page'],
+                quotes=quotes,
+            ))
+        return QuotedCitations(citations=citations)
@@ -0,0 +1,207 @@
+import contextlib
+import json
+import os
+import shutil
+import threading
+from typing import Any, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+# number of set bits of every byte value, for hamming distances over packed sign bits
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+class QuantizedIndex:
+    """
+    Read-only vector index over memory-mapped NumPy files, built from a Chroma collection.
+
+    Every vector is stored three times on disk: unit-normalized float32 for exact scoring,
+    int8 codes with a per-vector scale, and packed sign bits. A search scans only the int8
+    codes (4x smaller than float32) or the sign bits (32x smaller) to pick `rescore_factor * k`
+    candidates, then rescores those exactly against their float32 rows. Files are memory-mapped,
+    so only the pages a search touches are read into memory; documents are read lazily too.
+    Codes are scored `block_size` rows at a time, converted to float32 one block at a time, so
+    a query needs about block_size * dim * 4 bytes of scratch memory (24 MB for 4096 x 1536).
+
+    Layout of the index directory:
+        meta.json       {"count", "dim", "generation"}
+        vectors.f32     count x dim float32, normalized
+        codes.i8        count x dim int8
+        scales.f32      count float32, code * scale ~ normalized vector
+        bits.u8         count x ceil(dim / 8) packed sign bits
+        ids.txt         metadata id of every vector, one per line
+        docs.jsonl      one {"id", "text", "metadata"} per vector
+        offsets.i64     count + 1 byte offsets into docs.jsonl
+    """
+
+    def __init__(self, path, mode='int8', rescore_factor=10, block_size=4096):
+        if mode not in ('int8', 'binary'):
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.rescore_factor = rescore_factor
+        self.block_size = block_size
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.count, self.dim = meta['count'], meta['dim']
+        # collection generation the snapshot was read at (None for indexes built before it was recorded)
+        self.generation = meta.get('generation')
+        shape = (self.count, self.dim)
+        self.vectors = np.memmap(os.path.join(path, 'vectors.f32'), dtype=np.float32, mode='r', shape=shape)
+        self.codes = np.memmap(os.path.join(path, 'codes.i8'), dtype=np.int8, mode='r', shape=shape)
+        self.scales = np.memmap(os.path.join(path, 'scales.f32'), dtype=np.float32, mode='r', shape=(self.count,))
+        self.bits = np.memmap(os.path.join(path, 'bits.u8'), dtype=np.uint8, mode='r',
+                              shape=(self.count, (self.dim + 7) // 8))
+        self.offsets = np.memmap(os.path.join(path, 'offsets.i64'), dtype=np.int64, mode='r', shape=(self.count + 1,))
+        self._docs_file = open(os.path.join(path, 'docs.jsonl'), 'rb')
+        self._docs_lock = threading.Lock()
+        self._positions = None
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, 'meta.json'))
+
+    @staticmethod
+    def stored_generation(path):
+        """Generation of the index at `path` without opening it, None if there is none or it predates generations"""
+        if not QuantizedIndex.exists(path):
+            return None
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            return json.load(f).get('generation')
+
+    @staticmethod
+    def build(path, dim, pages, generation=0, swap_lock=None):
+        """
+        Write an index of `dim`-dimensional vectors from `pages`, an iterable of
+        (ids, embeddings, documents, metadatas) batches such as Chroma get() pages,
+        read at collection `generation`.
+        Files are appended to batch by batch, so the index holds exactly the rows the pages
+        yielded even when the collection changes while it is read.
+        The index is written next to `path` (one build directory per process) and moved into
+        place once complete, holding `swap_lock` only for the move; if an index of a newer
+        generation was moved in meanwhile, that one is kept.
+        """
+        tmp_path = f'{path}.{os.getpid()}.building'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        names = ('vectors.f32', 'codes.i8', 'scales.f32', 'bits.u8', 'offsets.i64')
+        files = {name: open(os.path.join(tmp_path, name), 'wb') for name in names}
+
+        row = 0
+        try:
+            with open(os.path.join(tmp_path, 'docs.jsonl'), 'wb') as docs_file, \
+                    open(os.path.join(tmp_path, 'ids.txt'), 'w', encoding='utf-8') as ids_file:
+                for ids, embeddings, documents, metadatas in pages:
+                    batch = np.asarray(embeddings, dtype=np.float32).reshape(-1, dim)
+                    batch /= np.maximum(np.linalg.norm(batch, axis=1, keepdims=True), 1e-12)
+                    batch_scales = np.maximum(np.abs(batch).max(axis=1), 1e-12) / 127
+                    files['vectors.f32'].write(batch.tobytes())
+                    files['codes.i8'].write(np.round(batch / batch_scales[:, None]).astype(np.int8).tobytes())
+                    files['scales.f32'].write(batch_scales.astype(np.float32).tobytes())
+                    files['bits.u8'].write(np.packbits(batch > 0, axis=1).tobytes())
+                    offsets = np.empty(len(batch), dtype=np.int64)
+                    for i, (chunk_id, text, metadata) in enumerate(zip(ids, documents, metadatas)):
+                        offsets[i] = docs_file.tell()
+                        docs_file.write(json.dumps({'id': chunk_id, 'text': text, 'metadata': metadata}).encode('utf-8'))
+                        docs_file.write(b'\n')
+                        ids_file.write(f"{metadata['id']}\n")
+                    files['offsets.i64'].write(offsets.tobytes())
+                    row += len(batch)
+                files['offsets.i64'].write(np.array([docs_file.tell()], dtype=np.int64).tobytes())
+            if not row:
+                # memory-mapping an empty file fails; an empty index keeps one unused zero row
+                files['vectors.f32'].write(np.zeros(dim, dtype=np.float32).tobytes())
+                files['codes.i8'].write(np.zeros(dim, dtype=np.int8).tobytes())
+                files['scales.f32'].write(np.zeros(1, dtype=np.float32).tobytes())
+                files['bits.u8'].write(np.zeros((dim + 7) // 8, dtype=np.uint8).tobytes())
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        finally:
+            for f in files.values():
+                f.close()
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'count': row, 'dim': dim, 'generation': generation}, f)
+
+        with swap_lock or contextlib.nullcontext():
+            current = QuantizedIndex.stored_generation(path)
+            if current is not None and current > generation:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+                os.replace(tmp_path, path)
+        return row
+
+    def _first_pass(self, query, n_candidates):
+        scores = np.empty(self.count, dtype=np.float32)
+        if self.mode == 'int8':
+            for start in range(0, self.count, self.block_size):
+                block = self.codes[start:start + self.block_size].astype(np.float32)
+                scores[start:start + len(block)] = (block @ query) * self.scales[start:start + len(block)]
+        else:
+            query_bits = np.packbits(query > 0)
+            for start in range(0, self.count, self.block_size):
+                block = self.bits[start:start + self.block_size]
+                # fewer differing sign bits = closer; negate so higher is better like the int8 scores
+                scores[start:start + len(block)] = -POPCOUNT[np.bitwise_xor(block, query_bits)].sum(axis=1, dtype=np.int32)
+        if n_candidates >= self.count:
+            return np.arange(self.count)
+        return np.argpartition(-scores, n_candidates)[:n_candidates]
+
+    def search(self, query_embedding, k=5):
+        """Return [(row, cosine similarity)] of the top k vectors"""
+        if not self.count:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        candidates = np.sort(self._first_pass(query, k * self.rescore_factor))
+        exact = self.vectors[candidates] @ query
+        top = np.argsort(-exact)[:k]
+        return [(int(candidates[i]), float(exact[i])) for i in top]
+
+    def exact_search(self, query_embedding, k=5):
+        """Brute-force top k over the float32 vectors, for measuring recall"""
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = np.concatenate([self.vectors[start:start + self.block_size] @ query
+                                 for start in range(0, self.count, self.block_size)])
+        top = np.argsort(-scores)[:k]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def document(self, row):
+        with self._docs_lock:
+            self._docs_file.seek(int(self.offsets[row]))
+            record = json.loads(self._docs_file.read(int(self.offsets[row + 1] - self.offsets[row])))
+        return Document(page_content=record['text'], metadata=record['metadata'])
+
+    def vectors_by_id(self, chunk_ids):
+        """Stored (normalized) vectors of chunks by their metadata id; unknown ids are left out"""
+        if self._positions is None:
+            with open(os.path.join(self.path, 'ids.txt'), 'r', encoding='utf-8') as f:
+                self._positions = {line.rstrip('\n'): row for row, line in enumerate(f)}
+        return {chunk_id: np.array(self.vectors[self._positions[chunk_id]])
+                for chunk_id in chunk_ids if chunk_id in self._positions}
+
+    def close(self):
+        self._docs_file.close()
+
+
+class QuantizedRetriever(BaseRetriever):
+    """Dense retriever over a QuantizedIndex, with the same interface as a Chroma similarity retriever"""
+
+    index: Any
+    embeddings: Any
+    k: int = 5
+
+    def get_scored_documents(self, query: str) -> List[Tuple[Document, float]]:
+        """Top k documents with their cosine similarity, the relevance score Chroma reports for cosine collections"""
+        hits = self.index.search(self.embeddings.embed_query(query), k=self.k)
+        return [(self.index.document(row), score) for row, score in hits]
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return [doc for doc, _ in self.get_scored_documents(query)]
@@ -1,7 +1,14 @@
 import os
 import uuid
+import contextlib
+import hashlib
+import threading
+import json
+import asyncio
+import shutil
+from collections import deque
+import chromadb
 from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnablePassthrough
@@ -11,13 +18,25 @@ from langchain.document_loaders import PyMuPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document
 from langchain_chroma import Chroma
+from langchain_core.rate_limiters import InMemoryRateLimiter
 from operator import itemgetter
 from typing import List
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from sqlalchemy.orm import query_expression
 
 from log import logger
+from context_cache import ContextCache
+from embedding_cache import build_cached_embeddings, embed_queries
+from collection_registry import CollectionRegistry
+from answer_cache import SemanticAnswerCache
+from lexical_index import BM25Index, HybridRetriever
+from local_citations import CitationAligner
+from context_packing import ContextPacker
+from quantized_index import QuantizedIndex, QuantizedRetriever
+from collection_snapshot import write_snapshot, read_snapshot_info, iter_snapshot
+from collection_config import load_collection_config, update_collection_config, bump_collection_generation, collection_lock
 from schema import QuotedCitations
 
 #load environment variable
@@ -28,31 +47,156 @@ UPLOAD_DIR = "uploads"
 CHROMA_DIR =  "./rag_chroma_db"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+#limits for contextual chunk generation during ingestion
+CONTEXT_MAX_CONCURRENCY = int(os.getenv("CONTEXT_MAX_CONCURRENCY", 8))
+CONTEXT_REQUESTS_PER_SECOND = float(os.getenv("CONTEXT_REQUESTS_PER_SECOND", 5))
+CONTEXT_MAX_RETRIES = int(os.getenv("CONTEXT_MAX_RETRIES", 4))
+#what each chunk prompt sees as the paper: full | window | outline
+#full holds the whole document text in memory while it is ingested; window streams it, so prefer it for very large files
+CONTEXT_STRATEGY = os.getenv("CONTEXT_STRATEGY", "full")
+CONTEXT_WINDOW = int(os.getenv("CONTEXT_WINDOW", 2))
+OUTLINE_HEAD_CHARS = 300
+#chunks contextualized, embedded and committed together while streaming a document in
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 64))
+#persistent cache of generated chunk contexts
+CACHE_DIR = "./rag_cache"
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", 200_000))
+CONTEXT_CACHE_MAX_AGE_DAYS = int(os.getenv("CONTEXT_CACHE_MAX_AGE_DAYS", 90))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 10_000))
+#open collection handles are dropped after this many idle seconds
+COLLECTION_IDLE_SECONDS = int(os.getenv("COLLECTION_IDLE_SECONDS", 900))
+#questions at least this similar to an answered one reuse its answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+#default retrieval mode for collections without their own setting: dense | hybrid
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+RETRIEVAL_K = 5
+HYBRID_FETCH_K = 20
+LEXICAL_INDEX_FILENAME = 'bm25_index.sqlite'
+#HNSW parameters of collections without their own setting (Chroma's defaults); see tune_hnsw.py
+HNSW_DEFAULTS = {'space': 'cosine', 'construction_ef': 100, 'search_ef': 10, 'M': 16}
+#citations: "local" aligns answer sentences to the retrieved chunks without an LLM call,
+#"llm" asks the model for them, "auto" is local with the LLM as fallback when nothing aligns
+CITATION_MODE = os.getenv("CITATION_MODE", "auto")
+#retrieved chunks are re-ranked with MMR and packed into this many context tokens (0 sends them all)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 6000))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", 0.7))
+#dense retrieval backend of collections without their own setting: chroma | quantized (see migrate_quantized.py)
+#quantized collections are searched from a memory-mapped int8/binary snapshot; chroma stays the store ingestion writes to
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "chroma")
+QUANTIZED_DIRNAME = 'quantized'
+QUANTIZED_RESCORE_FACTOR = int(os.getenv("QUANTIZED_RESCORE_FACTOR", 10))
+#chroma layout: "per_collection" is one database per collection directory, "shared" keeps every collection in one
+#persistent client under CHROMA_DIR/_shared_store (see migrate_store.py); defaults to whichever layout is on disk.
+#"server" reaches that store through a chroma server process, so several web workers can share it (see gunicorn.conf.py).
+#collection directories hold the side files (config, BM25 and quantized indexes, checkpoints) in every layout
+SHARED_STORE_DIRNAME = '_shared_store'
+CHROMA_STORE_MODE = os.getenv("CHROMA_STORE_MODE") or \
+    ('shared' if os.path.isdir(os.path.join(CHROMA_DIR, SHARED_STORE_DIRNAME)) else 'per_collection')
+CHROMA_SERVER_HOST = os.getenv("CHROMA_SERVER_HOST", "localhost")
+CHROMA_SERVER_PORT = int(os.getenv("CHROMA_SERVER_PORT", 8000))
 
-embedding_model = OpenAIEmbeddings(model='text-embedding-3-small')
+
+# embeddings are cached by text hash: documents on disk, queries in an in-process LRU
+embedding_model = build_cached_embeddings(model='text-embedding-3-small',
+                                          cache_dir=CACHE_DIR,
+                                          query_cache_size=QUERY_EMBEDDING_CACHE_SIZE)
 chatgpt = ChatOpenAI(model="gpt-4o-mini", temperature=0)
 structured_chatgpt = chatgpt.with_structured_output(QuotedCitations)
 
-def save_uploaded_file(file_storage) :
-    filename = f"{file_storage.filename}"
-    path = os.path.join(UPLOAD_DIR, filename)
-    file_storage.save(path)
+# Ingestion gets its own client so that a large upload cannot starve the query path.
+# InMemoryRateLimiter is a token bucket shared by every concurrent context request.
+context_rate_limiter = InMemoryRateLimiter(requests_per_second=CONTEXT_REQUESTS_PER_SECOND,
+                                           check_every_n_seconds=0.1,
+                                           max_bucket_size=CONTEXT_MAX_CONCURRENCY)
+context_chatgpt = ChatOpenAI(model="gpt-4o-mini", temperature=0,
+                             rate_limiter=context_rate_limiter)
+context_cache = ContextCache(os.path.join(CACHE_DIR, 'chunk_contexts.sqlite'),
+                             max_entries=CONTEXT_CACHE_MAX_ENTRIES,
+                             max_age_days=CONTEXT_CACHE_MAX_AGE_DAYS)
+
+def save_uploaded_file(file_storage, filename=None) :
+    # uploads are stored under their content hash so different files with the same name never overwrite
+    filename = filename or f"{file_storage.filename}"
+    data = file_storage.read()
+    upload_path = os.path.join(UPLOAD_DIR, hashlib.sha256(data).hexdigest()[:16])
+    os.makedirs(upload_path, exist_ok=True)
+    path = os.path.join(upload_path, filename)
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(data)
     return path
 
-def get_chroma_collection(collection_name):
+def file_content_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def hnsw_collection_metadata(hnsw):
+    return {f'hnsw:{name}': value for name, value in hnsw.items()}
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+def get_shared_chroma_client():
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            if CHROMA_STORE_MODE == 'server':
+                #started with: chroma run --path ./rag_chroma_db/_shared_store --port 8000
+                _shared_client = chromadb.HttpClient(host=CHROMA_SERVER_HOST, port=CHROMA_SERVER_PORT)
+            else:
+                _shared_client = chromadb.PersistentClient(path=os.path.join(CHROMA_DIR, SHARED_STORE_DIRNAME))
+        return _shared_client
+
+def get_chroma_client(collection_name):
+    if CHROMA_STORE_MODE in ('shared', 'server'):
+        return get_shared_chroma_client()
+    return chromadb.PersistentClient(path=os.path.join(CHROMA_DIR, collection_name))
+
+def open_chroma_collection(collection_name):
+    # HNSW parameters take effect when the collection is created; set_hnsw_config rebuilds existing ones
+    client = get_chroma_client(collection_name)
+    #before opening: a collection moved aside by an interrupted rebuild would otherwise be recreated empty
+    recover_hnsw_rebuild(client, collection_name)
     return Chroma(
         collection_name=collection_name,
         embedding_function=embedding_model,
-        collection_metadata={"hnsw:space": "cosine"},
-        persist_directory=os.path.join(CHROMA_DIR, collection_name)
+        collection_metadata=hnsw_collection_metadata(get_hnsw_config(collection_name)),
+        client=client
     )
 
-def list_collections():
-    return os.listdir(CHROMA_DIR)
+def release_chroma_collection(vectorstore):
+    #a per-collection PersistentClient stays cached (with its HNSW segments) in chromadb's system cache
+    #until its system is stopped; the shared/server client serves every collection and stays open
+    if CHROMA_STORE_MODE in ('shared', 'server'):
+        return
+    client = vectorstore._client
+    systems = getattr(chromadb.api.client.SharedSystemClient, '_identifer_to_system', {})
+    system = systems.pop(getattr(client, '_identifier', None), None)
+    if system is not None:
+        system.stop()
 
-def generate_chunk_context(document, chunk):
+collection_registry = CollectionRegistry(open_chroma_collection, idle_seconds=COLLECTION_IDLE_SECONDS,
+                                         release=release_chroma_collection)
+citation_aligner = CitationAligner()
+context_packer = ContextPacker(token_budget=CONTEXT_TOKEN_BUDGET, lambda_mult=CONTEXT_MMR_LAMBDA)
+answer_cache = SemanticAnswerCache(threshold=ANSWER_CACHE_THRESHOLD)
 
-    chunk_process_prompt = """You are an AI assistant specializing in research paper analysis.
+def get_chroma_collection(collection_name):
+    return collection_registry.get(collection_name)
+
+def collection_names(client):
+    #chroma < 0.6 lists Collection objects, later versions list names
+    return [collection if isinstance(collection, str) else collection.name for collection in client.list_collections()]
+
+def list_collections():
+    if CHROMA_STORE_MODE in ('shared', 'server'):
+        return [name for name in collection_names(get_shared_chroma_client()) if not name.endswith(('__rebuild', '__old', '__migrate'))]
+    return [name for name in os.listdir(CHROMA_DIR) if name != SHARED_STORE_DIRNAME]
+
+CHUNK_CONTEXT_PROMPT = """You are an AI assistant specializing in research paper analysis.
                             Your task is to provide brief, relevant context for a chunk of text
                             based on the following research paper.
 
@@ -78,47 +222,198 @@ def generate_chunk_context(document, chunk):
                             Context:
                         """
 
-    prompt_template = ChatPromptTemplate.from_template(chunk_process_prompt)
+def get_chunk_context_chain():
+
+    prompt_template = ChatPromptTemplate.from_template(CHUNK_CONTEXT_PROMPT)
 
     agentic_chunk_chain = (prompt_template
                                 |
-                            chatgpt
+                            context_chatgpt
                                 |
                             StrOutputParser())
 
-    context = agentic_chunk_chain.invoke({'paper': document, 'chunk': chunk})
+    # retry transient failures (rate limits, timeouts) with exponential backoff and jitter
+    return agentic_chunk_chain.with_retry(stop_after_attempt=CONTEXT_MAX_RETRIES,
+                                          wait_exponential_jitter=True)
+
+def generate_document_outline(chunk_texts):
+
+    outline_prompt = """You are an AI assistant specializing in research paper analysis.
+                        Below are the opening lines of every consecutive chunk of a research paper.
 
-    return context
+                        <chunk_openings>
+                        {openings}
+                        </chunk_openings>
 
-def create_contextual_chunks(file_path, chunk_size=3500, chunk_overlap=0):
+                        Write a compact outline of the paper: its title, the problem it addresses,
+                        its main sections in order and its key contributions.
+                        Answer only with the outline and nothing else.
 
-    logger.info(f'Loading pages: {file_path}')
-    loader = PyMuPDFLoader(file_path)
-    doc_pages = loader.load()
+                        Outline:
+                    """
 
-    logger.info(f'Chunking pages: {file_path}')
+    prompt_template = ChatPromptTemplate.from_template(outline_prompt)
+    outline_chain = (prompt_template
+                        |
+                     context_chatgpt
+                        |
+                     StrOutputParser()).with_retry(stop_after_attempt=CONTEXT_MAX_RETRIES,
+                                                   wait_exponential_jitter=True)
+
+    openings = '\n...\n'.join(text[:OUTLINE_HEAD_CHARS] for text in chunk_texts)
+    # the outline is cached like chunk contexts, so re-ingesting a document reuses it
+    key = ContextCache.make_key(openings, '', outline_prompt, context_chatgpt.model_name)
+    cached = context_cache.get_many([key])
+    if key in cached:
+        return cached[key]
+    outline = outline_chain.invoke({'openings': openings})
+    context_cache.set_many({key: outline})
+    return outline
+
+def iter_document_chunks(file_path, chunk_size=3500, chunk_overlap=0, pages=None):
+    """
+    Yield (chunk, chunk_id) page by page, without holding the whole document in memory.
+    `pages` can hold the already parsed pages of file_path (e.g. parsed in another process).
+    """
     splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size,
                                               chunk_overlap=chunk_overlap)
-    doc_chunks = splitter.split_documents(doc_pages)
+    occurrences = {}
+    for page in (PyMuPDFLoader(file_path).lazy_load() if pages is None else pages):
+        # the splitter works on each page separately, so this yields the same chunks as splitting the whole document
+        chunks = splitter.split_documents([page])
+        yield from zip(chunks, assign_chunk_ids(chunks, occurrences))
 
-    logger.info(f'Generating contextual chunks: {file_path}')
-    original_doc = '\n'.join([doc.page_content for doc in doc_chunks])
-    contextual_chunks = []
+def iter_context_inputs(file_path, chunk_size=3500, chunk_overlap=0,
+                        strategy=CONTEXT_STRATEGY, window=CONTEXT_WINDOW, pages=None, usage=None):
+    """
+    Yield (chunk, chunk_id, {paper, chunk}), the context prompt inputs of every chunk, streaming the document.
+    full: the whole document for every chunk (original behaviour); its text is held in memory until the last chunk
+    window: only the `window` neighbouring chunks on each side of the chunk, with a lookahead of `window` chunks
+    outline: one document outline, generated once and shared by every chunk
+    full and outline need one cheap text-only pass first, for the document text and the chunk openings.
+    `usage`, if given, is filled with the chunk and paper token counts (see log_context_savings).
+    """
+    if usage is not None:
+        usage.update(strategy=strategy, chunks=0, chunk_tokens=0, paper_tokens=0)
+
+    def count_tokens(text):
+        return context_chatgpt.get_num_tokens(text) if usage is not None else 0
+
+    def record(chunk_tokens, paper_tokens):
+        if usage is not None:
+            usage['chunks'] += 1
+            usage['chunk_tokens'] += chunk_tokens
+            usage['paper_tokens'] += paper_tokens
+
+    chunks = iter_document_chunks(file_path, chunk_size, chunk_overlap, pages)
+    if strategy == 'full':
+        texts = [chunk.page_content for chunk, _ in chunks]
+        paper = '\n'.join(texts)
+        chunk_tokens = [count_tokens(text) for text in texts]
+        del texts
+        for i, (chunk, chunk_id) in enumerate(iter_document_chunks(file_path, chunk_size, chunk_overlap, pages)):
+            record(chunk_tokens[i], sum(chunk_tokens))
+            yield chunk, chunk_id, {'paper': paper, 'chunk': chunk.page_content}
+    elif strategy == 'outline':
+        outline = generate_document_outline([chunk.page_content[:OUTLINE_HEAD_CHARS] for chunk, _ in chunks])
+        outline_tokens = count_tokens(outline)
+        for chunk, chunk_id in iter_document_chunks(file_path, chunk_size, chunk_overlap, pages):
+            record(count_tokens(chunk.page_content), outline_tokens)
+            yield chunk, chunk_id, {'paper': outline, 'chunk': chunk.page_content}
+    elif strategy == 'window':
+        #(text, tokens) of the chunks before the next one to emit, and (chunk, chunk_id, tokens) from it on
+        before = deque(maxlen=window)
+        ahead = deque()
+
+        def emit():
+            chunk, chunk_id, tokens = ahead[0]
+            neighbours = list(before) + [(item.page_content, item_tokens)
+                                         for item, _, item_tokens in list(ahead)[:window + 1]]
+            record(tokens, sum(item_tokens for _, item_tokens in neighbours))
+            before.append((chunk.page_content, tokens))
+            ahead.popleft()
+            return chunk, chunk_id, {'paper': '\n'.join(text for text, _ in neighbours), 'chunk': chunk.page_content}
+
+        for chunk, chunk_id in chunks:
+            ahead.append((chunk, chunk_id, count_tokens(chunk.page_content)))
+            if len(ahead) > window:
+                yield emit()
+        while ahead:
+            yield emit()
+    else:
+        raise ValueError(f"Unknown context strategy: {strategy}")
+
+def log_context_savings(file_path, usage):
+    #every chunk prompt of the full strategy carries the whole document
+    full_tokens = usage['chunk_tokens'] * usage['chunks']
+    used_tokens = usage['paper_tokens']
+    logger.info(f'Context strategy "{usage["strategy"]}": {used_tokens} paper tokens sent '
+                f'instead of {full_tokens} ({full_tokens - used_tokens} saved): {file_path}')
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def assign_chunk_ids(doc_chunks, occurrences=None):
+    """
+    Deterministic chunk ids derived from the document title, page and chunk text,
+    so re-ingesting a file produces the same ids for unchanged chunks.
+    Pass the same `occurrences` dict when assigning ids to a document piece by piece.
+    """
+    occurrences = {} if occurrences is None else occurrences
+    chunk_ids = []
     for chunk in doc_chunks:
+        title = chunk.metadata['source'].split('/')[-1]
+        key = f"{title}\x00{chunk.metadata['page']}\x00{chunk.page_content}"
+        n = occurrences.get(key, 0)
+        occurrences[key] = n + 1
+        chunk_ids.append(str(uuid.uuid5(uuid.NAMESPACE_URL, f"{key}\x00{n}")))
+    return chunk_ids
+
+def build_contextual_chunks(doc_chunks, contexts, chunk_ids, file_hash=None):
+    contextual_chunks = []
+    for chunk, context, chunk_id in zip(doc_chunks, contexts, chunk_ids):
         chunk_content = chunk.page_content
         chunk_metadata = chunk.metadata
         chunk_metadata_upd = {
-            'id': str(uuid.uuid4()),
+            'id': chunk_id,
             'page': chunk_metadata['page'],
             'source': chunk_metadata['source'],
             'title': chunk_metadata['source'].split('/')[-1]
         }
-        context = generate_chunk_context(original_doc, chunk_content)
+        if file_hash:
+            chunk_metadata_upd['file_hash'] = file_hash
         contextual_chunks.append(Document(page_content=context+'\n'+chunk_content,
                                           metadata=chunk_metadata_upd))
-    logger.info(f'Finished processing: {file_path}')
     return contextual_chunks
 
+def lookup_cached_contexts(inputs):
+    keys = [ContextCache.make_key(item['paper'], item['chunk'], CHUNK_CONTEXT_PROMPT, context_chatgpt.model_name)
+            for item in inputs]
+    cached = context_cache.get_many(keys)
+    contexts = [cached.get(key) for key in keys]
+    missing = [i for i, context in enumerate(contexts) if context is None]
+    logger.info(f'Context cache: {len(inputs) - len(missing)} hits, {len(missing)} misses '
+                f'(lifetime hit rate {context_cache.stats()["hit_rate"]:.0%})')
+    return keys, contexts, missing
+
+def store_generated_contexts(keys, contexts, missing, generated):
+    for i, context in zip(missing, generated):
+        contexts[i] = context
+    if missing:
+        context_cache.set_many({keys[i]: contexts[i] for i in missing})
+    return contexts
+
+def log_throughput(file_path, n_chunks, elapsed):
+    logger.info(f'Finished processing: {file_path} '
+                f'({n_chunks} chunks in {elapsed:.1f}s, {n_chunks / max(elapsed, 1e-9):.2f} chunks/s)')
+
 def format_docs(docs):
     return "\n\n".join(doc.page_content for doc in docs)
 
@@ -134,21 +429,561 @@ def format_docs_with_metadata(docs: List[Document]) -> str:
     ]
     return "\n\n" + "\n\n".join(formatted_docs)
 
-def add_document(file_path, collection):
+def ingest_checkpoint_path(collection, file_hash):
+    return os.path.join(CHROMA_DIR, collection, 'ingest_checkpoints', f'{file_hash}.json')
+
+def save_ingest_checkpoint(path, **state):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({**state, 'updated_at': time.time()}, f)
+    os.replace(tmp_path, path)
+
+def plan_document_update(vectorstore, collection, file_path):
+    """
+    Compare file_path against what the collection already holds for the same title.
+    Returns None when this exact file content is already fully ingested, otherwise the file hash,
+    its checkpoint path and the ids and metadata the collection holds for the title.
+    Chunks committed by an interrupted run are among the existing ids, so they are skipped.
+    """
+    file_hash = file_content_hash(file_path)
+    checkpoint_path = ingest_checkpoint_path(collection, file_hash)
+    if os.path.exists(checkpoint_path):
+        logger.info(f'Resuming interrupted ingestion of {file_path}')
+    elif vectorstore.get(where={'file_hash': file_hash}, limit=1, include=[])['ids']:
+        logger.info(f'Skipping {file_path}: already ingested')
+        return None
+
+    title = file_path.split('/')[-1]
+    existing = vectorstore.get(where={'title': title}, include=['metadatas'])
+    return {
+        'file_hash': file_hash,
+        'checkpoint_path': checkpoint_path,
+        'existing': dict(zip(existing['ids'], existing['metadatas'])),
+        'seen_ids': set(),
+        'committed': 0,
+    }
+
+def select_new_chunks(plan, batch):
+    plan['seen_ids'].update(chunk_id for _, chunk_id, _ in batch)
+    return [item for item in batch if item[1] not in plan['existing']]
+
+def commit_chunk_batch(vectorstore, collection, plan, file_path, docs):
+    """Upsert one batch of contextual chunks and record it in the file's checkpoint"""
+    if docs:
+        vectorstore.add_documents(docs, ids=[doc.metadata['id'] for doc in docs])
+        update_lexical_index(collection, docs, [])
+    plan['committed'] += len(docs)
+    save_ingest_checkpoint(plan['checkpoint_path'], file=file_path, file_hash=plan['file_hash'],
+                           committed_chunks=plan['committed'], seen_chunks=len(plan['seen_ids']))
+
+def finish_document_update(vectorstore, collection, plan, file_path):
+    unchanged = [(chunk_id, metadata) for chunk_id, metadata in plan['existing'].items()
+                 if chunk_id in plan['seen_ids']]
+    stale = [(chunk_id, metadata) for chunk_id, metadata in plan['existing'].items()
+             if chunk_id not in plan['seen_ids']]
+    if unchanged:
+        # unchanged chunks now belong to the new file version as well
+        vectorstore._collection.update(
+            ids=[chunk_id for chunk_id, _ in unchanged],
+            metadatas=[{**metadata, 'file_hash': plan['file_hash']} for _, metadata in unchanged])
+    if stale:
+        vectorstore.delete(ids=[chunk_id for chunk_id, _ in stale])
+        update_lexical_index(collection, [], [metadata['id'] for _, metadata in stale])
+    #a concurrent job ingesting identical content shares this checkpoint and may have removed it already
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(plan['checkpoint_path'])
+    logger.info(f'Ingested {file_path}: {plan["committed"]} chunks embedded, {len(unchanged)} unchanged, '
+                f'{len(stale)} stale removed')
+
+def contextualize_batch(batch, plan, max_concurrency):
+    keys, contexts, missing = lookup_cached_contexts([inputs for _, _, inputs in batch])
+    generated = get_chunk_context_chain().batch([batch[i][2] for i in missing], {"max_concurrency": max_concurrency})
+    contexts = store_generated_contexts(keys, contexts, missing, generated)
+    return build_contextual_chunks([chunk for chunk, _, _ in batch], contexts,
+                                   [chunk_id for _, chunk_id, _ in batch], plan['file_hash'])
+
+async def acontextualize_batch(batch, plan, max_concurrency):
+    #the context cache is sqlite: lookups and writes run in worker threads like the other blocking steps
+    keys, contexts, missing = await asyncio.to_thread(lookup_cached_contexts, [inputs for _, _, inputs in batch])
+    generated = await get_chunk_context_chain().abatch([batch[i][2] for i in missing],
+                                                       {"max_concurrency": max_concurrency})
+    contexts = await asyncio.to_thread(store_generated_contexts, keys, contexts, missing, generated)
+    return build_contextual_chunks([chunk for chunk, _, _ in batch], contexts,
+                                   [chunk_id for _, chunk_id, _ in batch], plan['file_hash'])
+
+def add_document(file_path, collection, on_progress=None,
+                 max_concurrency=CONTEXT_MAX_CONCURRENCY, batch_size=INGEST_BATCH_SIZE):
+    """
+    Stream file_path into the collection: page -> chunk -> context -> embed -> upsert, `batch_size`
+    chunks at a time, so memory stays bounded and every committed batch survives an interruption.
+    Re-running an interrupted ingestion resumes after the last committed batch.
+    """
+    # on_progress(stage, **info) lets background jobs report where ingestion is
+    report = on_progress or (lambda stage, **info: None)
     chroma_path = os.path.join(CHROMA_DIR, collection)
     os.makedirs(chroma_path, exist_ok=True)
     vectorstore = get_chroma_collection(collection)
-    docs = create_contextual_chunks(file_path=file_path, chunk_size=3500)
-    vectorstore.add_documents(docs)
+    report('parsing')
+    plan = plan_document_update(vectorstore, collection, file_path)
+    if plan is None:
+        report('skipped', reason='already ingested')
+        return True
+    save_ingest_checkpoint(plan['checkpoint_path'], file=file_path, file_hash=plan['file_hash'], committed_chunks=0)
+    start = time.perf_counter()
+    usage = {}
+    for batch in iter_batches(iter_context_inputs(file_path, chunk_size=3500, usage=usage), batch_size):
+        batch = select_new_chunks(plan, batch)
+        docs = contextualize_batch(batch, plan, max_concurrency) if batch else []
+        commit_chunk_batch(vectorstore, collection, plan, file_path, docs)
+        report('ingesting', chunks=len(plan['seen_ids']), new_chunks=plan['committed'])
+    log_context_savings(file_path, usage)
+    log_throughput(file_path, len(plan['seen_ids']), time.perf_counter() - start)
+    finish_document_update(vectorstore, collection, plan, file_path)
+    publish_collection_change(collection)
     return True
 
-def get_retriever(collection):
+async def aadd_document(file_path, collection, max_concurrency=CONTEXT_MAX_CONCURRENCY, batch_size=INGEST_BATCH_SIZE,
+                        pages=None):
+    """
+    Async add_document, for ingesting many files on one event loop.
+    Everything that blocks (chunking and token counting, the outline call, context cache lookups, embedding and
+    chroma writes) runs in worker threads so it does not stall other files' LLM calls.
+    Returns the number of chunks in the document (0 when it was already ingested).
+    """
+    chroma_path = os.path.join(CHROMA_DIR, collection)
+    os.makedirs(chroma_path, exist_ok=True)
+    vectorstore = await asyncio.to_thread(get_chroma_collection, collection)
+    plan = await asyncio.to_thread(plan_document_update, vectorstore, collection, file_path)
+    if plan is None:
+        return 0
+    await asyncio.to_thread(save_ingest_checkpoint, plan['checkpoint_path'], file=file_path,
+                            file_hash=plan['file_hash'], committed_chunks=0)
+    start = time.perf_counter()
+    usage = {}
+    batches = iter_batches(iter_context_inputs(file_path, chunk_size=3500, pages=pages, usage=usage), batch_size)
+    #the generator is advanced in a worker thread: the outline strategy makes a blocking LLM call inside it
+    while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+        batch = select_new_chunks(plan, batch)
+        docs = await acontextualize_batch(batch, plan, max_concurrency) if batch else []
+        await asyncio.to_thread(commit_chunk_batch, vectorstore, collection, plan, file_path, docs)
+    log_context_savings(file_path, usage)
+    log_throughput(file_path, len(plan['seen_ids']), time.perf_counter() - start)
+    await asyncio.to_thread(finish_document_update, vectorstore, collection, plan, file_path)
+    await asyncio.to_thread(publish_collection_change, collection)
+    return len(plan['seen_ids'])
+
+def get_collection_config(collection):
+    return load_collection_config(os.path.join(CHROMA_DIR, collection),
+                                  defaults={'retrieval': RETRIEVAL_MODE, 'backend': RETRIEVAL_BACKEND,
+                                            'quantization': 'int8'})
+
+#generation of each collection this process last saw; see sync_collection
+_seen_generations = {}
+
+def publish_collection_change(collection):
+    #other worker processes see the new generation on their next query and drop what they cached
+    _seen_generations[collection] = bump_collection_generation(os.path.join(CHROMA_DIR, collection))
+    collection_registry.invalidate(collection)
+
+def sync_collection(collection):
+    """Drop this process's handles and cached answers if another process changed the collection"""
+    generation = get_collection_config(collection).get('generation', 0)
+    if _seen_generations.setdefault(collection, generation) != generation:
+        _seen_generations[collection] = generation
+        collection_registry.invalidate(collection)
+
+def set_retrieval_mode(collection, mode):
+    if mode not in ('dense', 'hybrid'):
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+    previous = get_collection_config(collection)['retrieval']
+    update_collection_config(os.path.join(CHROMA_DIR, collection), retrieval=mode)
+    if mode == 'hybrid' and previous != 'hybrid':
+        #commits did not maintain the BM25 index while the collection was dense
+        rebuild_lexical_index(collection)
+    elif mode != 'hybrid':
+        open_lexical_index(collection).clear()
+    #answers cached under the previous mode were retrieved differently, here and in other processes
+    publish_collection_change(collection)
+    return get_collection_config(collection)
+
+def get_hnsw_config(collection):
+    return {**HNSW_DEFAULTS, **get_collection_config(collection).get('hnsw', {})}
+
+def set_hnsw_config(collection, **params):
+    """
+    Persist HNSW parameters (construction_ef, search_ef, M) for a collection and rebuild its index with them.
+    Chroma fixes them when a collection is created, so every vector is copied into a new collection.
+    """
+    unknown = set(params) - {'construction_ef', 'search_ef', 'M'}
+    if unknown:
+        raise ValueError(f"Unknown HNSW parameters: {sorted(unknown)}")
+    hnsw = {**get_hnsw_config(collection), **params}
+    #the config is written by the rebuild once the new collection has replaced the old one
+    rebuild_chroma_collection(collection, hnsw)
+    return hnsw
+
+def recover_hnsw_rebuild(client, collection):
+    """Finish or roll back a rebuild_chroma_collection swap that was interrupted"""
+    names = collection_names(client)
+    old_name = f'{collection}__old'
+    if old_name not in names:
+        return
+    if collection in names:
+        #the rebuilt collection holds the name: record its parameters and drop the old one
+        metadata = client.get_collection(collection).metadata or {}
+        hnsw = {key[len('hnsw:'):]: value for key, value in metadata.items() if key.startswith('hnsw:')}
+        update_collection_config(os.path.join(CHROMA_DIR, collection), hnsw={**get_hnsw_config(collection), **hnsw})
+        try:
+            client.delete_collection(old_name)
+        except Exception:
+            #another process finished the swap first
+            pass
+        logger.warning(f'Completed an interrupted HNSW rebuild of {collection}')
+    else:
+        #interrupted after moving the old collection aside: put it back, the rebuild copy is dropped on the next rebuild
+        client.get_collection(old_name).modify(name=collection)
+        logger.warning(f'Rolled back an interrupted HNSW rebuild of {collection}')
+
+def rebuild_chroma_collection(collection, hnsw, page_size=5000):
+    """
+    Copy every vector into a new collection created with `hnsw` and swap it in. The old collection is renamed
+    aside and only deleted once the new one holds its name, so no interruption loses it (see recover_hnsw_rebuild).
+    """
+    vectorstore = get_chroma_collection(collection)
+    client = vectorstore._client
+    rebuild_name = f'{collection}__rebuild'
+    old_name = f'{collection}__old'
+    try:
+        # left over from an interrupted rebuild
+        client.delete_collection(rebuild_name)
+    except Exception:
+        pass
+    rebuilt = client.create_collection(rebuild_name, metadata=hnsw_collection_metadata(hnsw))
+    offset = 0
+    while True:
+        page = vectorstore._collection.get(include=['embeddings', 'documents', 'metadatas'],
+                                           limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        rebuilt.add(ids=page['ids'], embeddings=page['embeddings'],
+                    documents=page['documents'], metadatas=page['metadatas'])
+        offset += len(page['ids'])
+    vectorstore._collection.modify(name=old_name)
+    try:
+        rebuilt.modify(name=collection)
+    except Exception:
+        if collection not in collection_names(client):
+            client.get_collection(old_name).modify(name=collection)
+        raise
+    update_collection_config(os.path.join(CHROMA_DIR, collection), hnsw=hnsw)
+    try:
+        client.delete_collection(old_name)
+    except Exception:
+        #already dropped by recover_hnsw_rebuild in another process
+        pass
+    publish_collection_change(collection)
+    logger.info(f'Rebuilt {collection} ({offset} vectors) with HNSW {hnsw}')
+
+def iter_collection_pages(vectorstore, page_size=5000, include=('embeddings', 'documents', 'metadatas')):
+    """Yield (ids, embeddings, documents, metadatas) for every chunk in the collection, page_size at a time"""
+    offset = 0
+    while True:
+        page = vectorstore.get(include=list(include), limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        yield page['ids'], page['embeddings'], page['documents'], page['metadatas']
+        offset += len(page['ids'])
+
+#settings that describe this node's copy of a collection rather than the collection itself
+LOCAL_CONFIG_KEYS = ('generation',)
+
+def export_collection(collection, path, page_size=5000):
+    """
+    Write a collection's vectors (as float16), chunk texts, metadata and settings to a Parquet snapshot,
+    so another node can serve it with import_collection instead of re-ingesting the PDFs.
+    """
+    vectorstore = get_chroma_collection(collection)
+    first = vectorstore.get(include=['embeddings'], limit=1)
+    if not first['ids']:
+        raise ValueError(f"Collection {collection} is empty")
+    dim = len(first['embeddings'][0])
+    config = {key: value for key, value in get_collection_config(collection).items() if key not in LOCAL_CONFIG_KEYS}
+    info = {'collection': collection, 'embedding_model': embedding_model.underlying_embeddings.model, 'config': config}
+    start = time.perf_counter()
+    rows = write_snapshot(path, iter_collection_pages(vectorstore, page_size), dim, info)
+    logger.info(f'Exported {collection} ({rows} chunks) to {path} in {time.perf_counter() - start:.1f}s')
+    return rows
+
+def import_collection(path, collection=None, batch_size=5000, resume=False):
+    """
+    Bulk-load a snapshot written by export_collection into a new collection (by default the exported name).
+    Vectors are added as stored, nothing is re-embedded; the settings (retrieval mode, HNSW, backend) come along
+    and the BM25 or quantized index the collection uses is built before returning.
+    With resume an interrupted import is completed: chunks are upserted by id.
+    """
+    info = read_snapshot_info(path)
+    collection = collection or info['collection']
+    if collection in list_collections() and not resume:
+        raise ValueError(f"Collection {collection} already exists")
+    model = embedding_model.underlying_embeddings.model
+    if info['embedding_model'] != model:
+        raise ValueError(f"Snapshot embedded with {info['embedding_model']}, this node queries with {model}")
+    #settings first: the chroma collection is created with the snapshot's HNSW parameters
+    update_collection_config(os.path.join(CHROMA_DIR, collection), **info['config'])
     vectorstore = get_chroma_collection(collection)
-    similarity_retriever = vectorstore.as_retriever(search_type="similarity",
-                                                  search_kwargs={"k": 5})
+    client = vectorstore._client
+    #chroma caps how many records one call may write (sqlite variable limit)
+    max_batch_size = client.get_max_batch_size() if hasattr(client, 'get_max_batch_size') else \
+        getattr(client, 'max_batch_size', batch_size)
+    batch_size = min(batch_size, max_batch_size)
+    start = time.perf_counter()
+    rows = 0
+    for ids, embeddings, documents, metadatas in iter_snapshot(path, batch_size):
+        vectorstore._collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+        rows += len(ids)
+    publish_collection_change(collection)
+    config = get_collection_config(collection)
+    if config['retrieval'] == 'hybrid':
+        get_lexical_index(collection)
+    elif config['backend'] == 'quantized':
+        build_quantized_index(collection)
+    logger.info(f'Imported {rows} chunks from {path} into {collection} in {time.perf_counter() - start:.1f}s')
+    return rows
+
+def migrate_collection_to_shared_store(collection, remove_source=False, page_size=5000):
+    """
+    Copy a collection from its own chroma database (CHROMA_DIR/<collection>) into the shared store.
+    Collections already in the shared store are left alone; returns the number of vectors copied.
+    With remove_source the old database files are deleted, the side files in the directory are kept.
+    """
+    source_dir = os.path.join(CHROMA_DIR, collection)
+    client = get_shared_chroma_client()
+    if collection in collection_names(client):
+        logger.info(f'{collection} is already in the shared store')
+        return 0
+    source = chromadb.PersistentClient(path=source_dir).get_collection(collection)
+    migrate_name = f'{collection}__migrate'
+    try:
+        # left over from an interrupted migration
+        client.delete_collection(migrate_name)
+    except Exception:
+        pass
+    target = client.create_collection(migrate_name, metadata=hnsw_collection_metadata(get_hnsw_config(collection)))
+    offset = 0
+    while True:
+        page = source.get(include=['embeddings', 'documents', 'metadatas'], limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        target.add(ids=page['ids'], embeddings=page['embeddings'],
+                   documents=page['documents'], metadatas=page['metadatas'])
+        offset += len(page['ids'])
+    target.modify(name=collection)
+    if remove_source:
+        os.remove(os.path.join(source_dir, 'chroma.sqlite3'))
+        for name in os.listdir(source_dir):
+            #vector segments are directories named by their uuid
+            try:
+                uuid.UUID(name)
+            except ValueError:
+                continue
+            shutil.rmtree(os.path.join(source_dir, name))
+    publish_collection_change(collection)
+    logger.info(f'Migrated {collection} ({offset} vectors) into the shared store')
+    return offset
+
+_lexical_indexes = {}
+_lexical_indexes_lock = threading.Lock()
+
+def open_lexical_index(collection):
+    # the BM25 index lives in SQLite next to the Chroma files
+    with _lexical_indexes_lock:
+        index = _lexical_indexes.get(collection)
+        if index is None:
+            index = BM25Index(os.path.join(CHROMA_DIR, collection, LEXICAL_INDEX_FILENAME))
+            _lexical_indexes[collection] = index
+        return index
+
+def lexical_index_stale(collection, index):
+    #hybrid collections keep their index current on every commit; for any other collection it is a
+    #snapshot (e.g. built by bench_retrieval.py) that is stale once the collection changed
+    config = get_collection_config(collection)
+    return index.generation is None or \
+        (config['retrieval'] != 'hybrid' and index.generation != config.get('generation', 0))
+
+def rebuild_lexical_index(collection, if_stale=False):
+    """Index every chunk of the chroma collection; collections ingested while dense are backfilled this way"""
+    index = open_lexical_index(collection)
+    #under the lock update_lexical_index takes, so a committed batch is either in the snapshot or applied after it
+    with collection_lock(os.path.join(CHROMA_DIR, collection)):
+        if if_stale and not lexical_index_stale(collection, index):
+            return index
+        generation = get_collection_config(collection).get('generation', 0)
+        pages = iter_collection_pages(get_chroma_collection(collection), include=['documents', 'metadatas'])
+        index.rebuild((([metadata['id'] for metadata in metadatas], documents)
+                       for _, _, documents, metadatas in pages), generation)
+    logger.info(f'Built lexical index for {collection}: {len(index)} chunks')
+    return index
+
+def get_lexical_index(collection):
+    index = open_lexical_index(collection)
+    if lexical_index_stale(collection, index):
+        rebuild_lexical_index(collection, if_stale=True)
+    return index
+
+def update_lexical_index(collection, docs, removed_ids):
+    #only hybrid collections maintain a BM25 index; a batch writes just its own rows
+    with collection_lock(os.path.join(CHROMA_DIR, collection)):
+        if get_collection_config(collection)['retrieval'] != 'hybrid':
+            return
+        index = open_lexical_index(collection)
+        if index.generation is None:
+            #never built: the first hybrid query backfills it from chroma
+            return
+        index.remove(removed_ids)
+        index.add([doc.metadata['id'] for doc in docs], [doc.page_content for doc in docs])
+
+_quantized_indexes = {}
+_quantized_indexes_lock = threading.Lock()
+#per-collection locks for building and loading an index: a cold collection only holds up its own queries
+_quantized_build_locks = {}
+#collections with a background rebuild running in this process
+_quantized_rebuilds = set()
+
+def quantized_build_lock(collection):
+    with _quantized_indexes_lock:
+        return _quantized_build_locks.setdefault(collection, threading.RLock())
+
+def quantized_index_path(collection):
+    return os.path.join(CHROMA_DIR, collection, QUANTIZED_DIRNAME)
+
+def build_quantized_index(collection, page_size=5000):
+    """Snapshot every vector, document and metadata of the chroma collection into its quantized index"""
+    vectorstore = get_chroma_collection(collection)
+    first = vectorstore.get(include=['embeddings'], limit=1)
+    dim = len(first['embeddings'][0]) if first['ids'] else 1
+    #read before the snapshot: chunks committed while it is built show up as a newer generation
+    generation = get_collection_config(collection).get('generation', 0)
+    start = time.perf_counter()
+    #the read runs unlocked, writers only wait for the finished index to be moved into place
+    with quantized_build_lock(collection):
+        n_vectors = QuantizedIndex.build(quantized_index_path(collection), dim, iter_collection_pages(vectorstore, page_size),
+                                         generation=generation,
+                                         swap_lock=collection_lock(os.path.join(CHROMA_DIR, collection)))
+    #quantized queries never touch chroma, so its HNSW index loaded by the read is released once idle
+    collection_registry.expire(collection)
+    logger.info(f'Built quantized index for {collection}: {n_vectors} vectors of dim {dim} '
+                f'in {time.perf_counter() - start:.1f}s')
+    return n_vectors
+
+def load_quantized_index(collection):
+    index = QuantizedIndex(quantized_index_path(collection), mode=get_collection_config(collection)['quantization'],
+                           rescore_factor=QUANTIZED_RESCORE_FACTOR)
+    with _quantized_indexes_lock:
+        _quantized_indexes[collection] = index
+    return index
+
+def drop_quantized_index(collection):
+    #requests still holding the old index keep reading its (unlinked) files until they finish
+    with _quantized_indexes_lock:
+        _quantized_indexes.pop(collection, None)
+
+def rebuild_quantized_index_in_background(collection):
+    with _quantized_indexes_lock:
+        if collection in _quantized_rebuilds:
+            return
+        _quantized_rebuilds.add(collection)
+
+    def rebuild():
+        try:
+            generation = get_collection_config(collection).get('generation', 0)
+            #another process may already have moved a current snapshot into place
+            if QuantizedIndex.stored_generation(quantized_index_path(collection)) != generation:
+                build_quantized_index(collection)
+            load_quantized_index(collection)
+            #answers cached while the previous snapshot was served miss the chunks it lacked
+            collection_registry.bump_version(collection)
+        except Exception:
+            logger.exception(f'Rebuilding the quantized index of {collection} failed')
+        finally:
+            with _quantized_indexes_lock:
+                _quantized_rebuilds.discard(collection)
+
+    threading.Thread(target=rebuild, name=f'quantized-rebuild-{collection}', daemon=True).start()
+
+def get_quantized_index(collection):
+    #a snapshot older than the collection's generation keeps serving while a newer one is built
+    #in the background, so a bulk ingestion neither blocks queries nor rebuilds once per file
+    with _quantized_indexes_lock:
+        index = _quantized_indexes.get(collection)
+    if index is None:
+        with quantized_build_lock(collection):
+            with _quantized_indexes_lock:
+                index = _quantized_indexes.get(collection)
+            if index is None:
+                if not QuantizedIndex.exists(quantized_index_path(collection)):
+                    #nothing to serve yet
+                    build_quantized_index(collection)
+                index = load_quantized_index(collection)
+    if index.generation != get_collection_config(collection).get('generation', 0):
+        rebuild_quantized_index_in_background(collection)
+    return index
+
+def set_retrieval_backend(collection, backend, quantization='int8'):
+    """
+    Switch a collection between chroma and the quantized index (int8 or binary first pass) for dense retrieval.
+    Switching to quantized builds the index from the chroma collection, which is left in place.
+    """
+    if backend not in ('chroma', 'quantized'):
+        raise ValueError(f"Unknown retrieval backend: {backend}")
+    if quantization not in ('int8', 'binary'):
+        raise ValueError(f"Unknown quantization mode: {quantization}")
+    drop_quantized_index(collection)
+    if backend == 'quantized':
+        build_quantized_index(collection)
+    config = update_collection_config(os.path.join(CHROMA_DIR, collection), backend=backend, quantization=quantization)
+    #contents are unchanged, other processes pick the backend up from the config on their next query
+    collection_registry.invalidate(collection)
+    return config
+
+def get_retriever(collection):
+    config = get_collection_config(collection)
+    if config['retrieval'] == 'hybrid':
+        return HybridRetriever(vectorstore=get_chroma_collection(collection),
+                               lexical_index=get_lexical_index(collection),
+                               k=RETRIEVAL_K,
+                               fetch_k=HYBRID_FETCH_K)
+    if config['backend'] == 'quantized':
+        return QuantizedRetriever(index=get_quantized_index(collection), embeddings=embedding_model, k=RETRIEVAL_K)
+    similarity_retriever = get_chroma_collection(collection).as_retriever(search_type="similarity",
+                                                                          search_kwargs={"k": RETRIEVAL_K})
     return similarity_retriever
 
-def answer_query(query, collection):
+def get_stored_embeddings(collection, docs):
+    #vectors come from the quantized index or chroma; anything missing is re-embedded through the on-disk document cache
+    ids = [doc.metadata['id'] for doc in docs]
+    if get_collection_config(collection)['backend'] == 'quantized':
+        by_id = get_quantized_index(collection).vectors_by_id(ids)
+    else:
+        stored = get_chroma_collection(collection).get(where={'id': {'$in': ids}}, include=['embeddings', 'metadatas'])
+        by_id = {metadata['id']: embedding for metadata, embedding in zip(stored['metadatas'], stored['embeddings'])}
+    missing = [doc for doc in docs if doc.metadata['id'] not in by_id]
+    if missing:
+        by_id.update(zip([doc.metadata['id'] for doc in missing],
+                         embedding_model.embed_documents([doc.page_content for doc in missing])))
+    return [by_id[chunk_id] for chunk_id in ids]
+
+def pack_context(collection, docs, query_embedding):
+    """Return (docs, report): the retrieved docs MMR-ranked, de-duplicated and trimmed to CONTEXT_TOKEN_BUDGET"""
+    if not CONTEXT_TOKEN_BUDGET or not docs:
+        return docs, None
+    packed, report = context_packer.pack(query_embedding, docs, get_stored_embeddings(collection, docs))
+    logger.info(f"Context packing: kept {report['kept']}/{report['retrieved']} chunks "
+                f"({report['redundant']} redundant, {report['trimmed']} trimmed), "
+                f"{report['tokens_after']} tokens, saved {report['tokens_saved']}")
+    return packed, report
+
+def get_rag_response_chain():
     rag_prompt = """You are an assistant who is an expert in question-answering tasks.
                     Answer the following question using only the following pieces of retrieved context.
                     If the answer is not in the context, do not make up answers, just say that you don't know.
@@ -163,6 +998,23 @@ def answer_query(query, collection):
                     Answer:
                 """
     rag_prompt_template = ChatPromptTemplate.from_template(rag_prompt)
+    rag_response_chain = (
+            {
+                "context": (itemgetter('context')
+                            |
+                            RunnableLambda(format_docs_with_metadata)),
+                "question": itemgetter("question")
+            }
+            |
+            rag_prompt_template
+            |
+            chatgpt
+            |
+            StrOutputParser()
+    )
+    return rag_response_chain
+
+def get_llm_cite_response_chain():
     citations_prompt = """You are an assistant who is an expert in analyzing answers to questions
                               and finding out referenced citations from context articles.
 
@@ -180,20 +1032,6 @@ def answer_query(query, collection):
                               {answer}
                           """
     cite_prompt_template = ChatPromptTemplate.from_template(citations_prompt)
-    rag_response_chain = (
-            {
-                "context": (itemgetter('context')
-                            |
-                            RunnableLambda(format_docs_with_metadata)),
-                "question": itemgetter("question")
-            }
-            |
-            rag_prompt_template
-            |
-            chatgpt
-            |
-            StrOutputParser()
-    )
     cite_response_chain = (
             {
                 "context": itemgetter('context'),
@@ -205,6 +1043,44 @@ def answer_query(query, collection):
             |
             structured_chatgpt
     )
+    return cite_response_chain
+
+def cite_answer(inputs, mode=CITATION_MODE):
+    if mode not in ('local', 'llm', 'auto'):
+        raise ValueError(f"Unknown citation mode: {mode}")
+    if mode != 'llm':
+        citations = citation_aligner.extract(inputs['answer'], inputs['context'])
+        if citations.citations or mode == 'local':
+            return citations
+        logger.info('No local citation alignment found, falling back to LLM citations')
+    return get_llm_cite_response_chain().invoke(inputs)
+
+def get_cite_response_chain(mode=CITATION_MODE):
+    return RunnableLambda(lambda inputs: cite_answer(inputs, mode))
+
+def cache_stats():
+    return {
+        'answers': answer_cache.stats(),
+        'chunk_contexts': context_cache.stats(),
+    }
+
+def retrieve(query, collection):
+    """Retrieval only, without packing or an LLM call"""
+    sync_collection(collection)
+    return get_retriever(collection).invoke(query)
+
+def answer_query(query, collection):
+    # the query embedding is cached, so the retriever below reuses it without another API call
+    query_embedding = embedding_model.embed_query(query)
+    sync_collection(collection)
+    version = collection_registry.version(collection)
+    cached = answer_cache.lookup(collection, version, query_embedding)
+    if cached is not None:
+        return {'question': query, **cached}
+
+    def pack(inputs):
+        docs, report = pack_context(collection, inputs['context'], query_embedding)
+        return {**inputs, 'context': docs, 'context_tokens': report}
 
     rag_chain_w_citations = (
             {
@@ -212,19 +1088,136 @@ def answer_query(query, collection):
                 "question": RunnablePassthrough()
             }
             |
-            RunnablePassthrough.assign(answer=rag_response_chain)
+            RunnableLambda(pack)
+            |
+            RunnablePassthrough.assign(answer=get_rag_response_chain())
             |
-            RunnablePassthrough.assign(citations=cite_response_chain)
+            RunnablePassthrough.assign(citations=get_cite_response_chain())
 
     )
-    return rag_chain_w_citations.invoke(query)
+    result = rag_chain_w_citations.invoke(query)
+    #the packing report is cached with the answer, so a hit returns the same keys as a miss
+    answer_cache.store(collection, version, query, query_embedding,
+                       {key: result[key] for key in ('context', 'answer', 'citations', 'context_tokens')})
+    return result
+
+def stream_answer_query(query, collection):
+    """
+    Same pipeline as answer_query, but yields (event, payload) pairs as soon as each part is ready:
+    ('context', docs), then ('token', text) for every answer token, then ('citations', QuotedCitations)
+    """
+    query_embedding = embedding_model.embed_query(query)
+    sync_collection(collection)
+    version = collection_registry.version(collection)
+    cached = answer_cache.lookup(collection, version, query_embedding)
+    if cached is not None:
+        yield 'context', cached['context']
+        yield 'token', cached['answer']
+        yield 'citations', cached['citations']
+        return
+
+    docs = get_retriever(collection).invoke(query)
+    docs, context_tokens = pack_context(collection, docs, query_embedding)
+    yield 'context', docs
+
+    answer_parts = []
+    for token in get_rag_response_chain().stream({'context': docs, 'question': query}):
+        answer_parts.append(token)
+        yield 'token', token
+
+    answer = ''.join(answer_parts)
+    citations = get_cite_response_chain().invoke({'context': docs,
+                                                  'question': query,
+                                                  'answer': answer})
+    answer_cache.store(collection, version, query, query_embedding,
+                       {'context': docs, 'answer': answer, 'citations': citations,
+                        'context_tokens': context_tokens})
+    yield 'citations', citations
+
+def retrieve_batch(collection, questions, query_embeddings):
+    #dense collections answer all questions with one chroma query; hybrid ones go through the retriever
+    config = get_collection_config(collection)
+    if config['retrieval'] == 'hybrid':
+        return get_retriever(collection).batch(questions, config={'max_concurrency': CONTEXT_MAX_CONCURRENCY})
+    if config['backend'] == 'quantized':
+        index = get_quantized_index(collection)
+        return [[index.document(row) for row, _ in index.search(query_embedding, k=RETRIEVAL_K)]
+                for query_embedding in query_embeddings]
+    found = get_chroma_collection(collection)._collection.query(query_embeddings=query_embeddings,
+                                                               n_results=RETRIEVAL_K,
+                                                               include=['documents', 'metadatas'])
+    return [[Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+            for texts, metadatas in zip(found['documents'], found['metadatas'])]
+
+def answer_queries(questions, collection, max_concurrency=CONTEXT_MAX_CONCURRENCY, batch_size=100):
+    """
+    Answer many questions against one collection, yielding results as they complete (not in input order).
+
+    Each batch of `batch_size` questions is embedded in bulk and retrieved with a single Chroma query,
+    then answers and citations run on `max_concurrency` threads.
+    Every result is the answer_query dict plus 'index' (position in questions), 'cached', 'error'
+    and 'timings' in ms: embed and retrieve are the question's share of its batch, pack, answer and
+    cite its own steps, total the time from the start of its batch until it finished.
+    """
+    rag_chain = get_rag_response_chain()
+    cite_chain = get_cite_response_chain()
+    sync_collection(collection)
+    version = collection_registry.version(collection)
+
+    def answer_one(question, docs, query_embedding):
+        start = time.perf_counter()
+        docs, context_tokens = pack_context(collection, docs, query_embedding)
+        packed = time.perf_counter()
+        answer = rag_chain.invoke({'context': docs, 'question': question})
+        answered = time.perf_counter()
+        citations = cite_chain.invoke({'context': docs, 'question': question, 'answer': answer})
+        result = {'context': docs, 'answer': answer, 'citations': citations, 'context_tokens': context_tokens}
+        answer_cache.store(collection, version, question, query_embedding, result)
+        return result, {'pack': (packed - start) * 1000,
+                                                             'answer': (answered - packed) * 1000,
+                                                             'cite': (time.perf_counter() - answered) * 1000}
+
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='answer') as pool:
+        for offset in range(0, len(questions), batch_size):
+            batch = questions[offset:offset + batch_size]
+            batch_start = time.perf_counter()
+            query_embeddings = embed_queries(embedding_model, batch)
+            embedded = time.perf_counter()
+
+            pending = []
+            for i, (question, query_embedding) in enumerate(zip(batch, query_embeddings)):
+                cached = answer_cache.lookup(collection, version, query_embedding)
+                if cached is None:
+                    pending.append(i)
+                else:
+                    yield {'index': offset + i, 'question': question, **cached, 'cached': True, 'error': None,
+                           'timings': {'total': (time.perf_counter() - batch_start) * 1000}}
+            if not pending:
+                continue
+
+            contexts = retrieve_batch(collection, [batch[i] for i in pending], [query_embeddings[i] for i in pending])
+            retrieved = time.perf_counter()
+            shared = {'embed': (embedded - batch_start) * 1000 / len(batch),
+                      'retrieve': (retrieved - embedded) * 1000 / len(pending)}
+
+            futures = {pool.submit(answer_one, batch[i], docs, query_embeddings[i]): i
+                       for i, docs in zip(pending, contexts)}
+            for future in as_completed(futures):
+                i = futures[future]
+                record = {'index': offset + i, 'question': batch[i], 'cached': False, 'error': None}
+                try:
+                    result, timings = future.result()
+                    record.update(result)
+                except Exception as e:
+                    logger.error(f'Failed to answer question {offset + i}: {e}')
+                    record.update({'context': [], 'answer': None, 'citations': None, 'context_tokens': None,
+                                   'error': str(e)})
+                    timings = {}
+                record['timings'] = {**shared, **timings, 'total': (time.perf_counter() - batch_start) * 1000}
+                yield record
 
 if __name__ == "__main__":
-    # import glob
-    # from schema import Citation
-    # pdf_files = glob.glob('/media/athul/CAD3-F0DD/courses/analytics vidya/5. RAG Systems Essentials/RAG Project Dataset/*.pdf')
-    # for fp in pdf_files:
-    #     add_document(fp,'test_collection')
+    # to load a folder of PDFs: python ingest_dir.py <folder> test_collection
     query = "What are the main components of a RAG model, and how do they interact?"
     answer = answer_query(query,'test_collection')
     print(answer.keys())
@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    In-process cache of answered questions, keyed by query embedding, per collection.
+
+    A question whose embedding has cosine similarity >= `threshold` with a cached question
+    of the same collection reuses the stored {context, answer, citations, context_tokens}.
+    Every entry is tagged with the collection version it was computed against; when the
+    collection changes (add_document bumps the version) its entries are dropped.
+    """
+
+    def __init__(self, threshold=0.95, max_entries_per_collection=1000):
+        self.threshold = threshold
+        self.max_entries_per_collection = max_entries_per_collection
+        self.hits = 0
+        self.misses = 0
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _entries(self, collection, version):
+        entries = self._collections.get(collection)
+        if entries is None or entries['version'] != version:
+            entries = {'version': version, 'items': OrderedDict(), 'keys': [], 'matrix': None}
+            self._collections[collection] = entries
+        return entries
+
+    def lookup(self, collection, version, query_embedding):
+        query = self._normalize(query_embedding)
+        with self._lock:
+            entries = self._entries(collection, version)
+            if entries['items']:
+                if entries['matrix'] is None:
+                    entries['keys'] = list(entries['items'])
+                    entries['matrix'] = np.stack([vector for vector, _ in entries['items'].values()])
+                scores = entries['matrix'] @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self.hits += 1
+                    return dict(entries['items'][entries['keys'][best]][1])
+            self.misses += 1
+            return None
+
+    def store(self, collection, version, query, query_embedding, result):
+        with self._lock:
+            entries = self._entries(collection, version)
+            entries['items'][query] = (self._normalize(query_embedding), dict(result))
+            while len(entries['items']) > self.max_entries_per_collection:
+                entries['items'].popitem(last=False)
+            entries['matrix'] = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': sum(len(entries['items']) for entries in self._collections.values()),
+                'threshold': self.threshold,
+            }
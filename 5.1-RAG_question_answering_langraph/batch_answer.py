@@ -0,0 +1,89 @@
+"""
+Answer an evaluation set of questions against a collection and stream the results to JSONL.
+
+Input is a JSONL file with {"question": ..., "id": ...} per line (id defaults to the line number)
+or a plain text file with one question per line. Each output line holds the id, question, answer,
+citations, retrieved chunk ids and per-question timings in ms. Re-running with the same output
+file resumes: questions already answered without error are skipped.
+
+    python batch_answer.py test_collection eval_questions.jsonl --output eval_answers.jsonl
+"""
+import argparse
+import json
+import os
+import time
+
+from rag import answer_queries, CONTEXT_MAX_CONCURRENCY
+
+
+def load_questions(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if path.endswith('.jsonl'):
+        items = [json.loads(line) for line in lines]
+        return [{'id': str(item.get('id', n)), 'question': item['question']} for n, item in enumerate(items)]
+    return [{'id': str(n), 'question': line} for n, line in enumerate(lines)]
+
+
+def load_done_ids(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # last line of an interrupted run
+                continue
+            if not record.get('error'):
+                done.add(record['id'])
+    return done
+
+
+def to_record(item, result):
+    citations = result['citations']
+    return {
+        'id': item['id'],
+        'question': item['question'],
+        'answer': result['answer'],
+        'citations': citations.dict()['citations'] if citations is not None else [],
+        'context_ids': [doc.metadata['id'] for doc in result['context']],
+        'context_tokens': result.get('context_tokens'),
+        'cached': result['cached'],
+        'error': result['error'],
+        'timings_ms': {name: round(value, 1) for name, value in result['timings'].items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('collection', nargs='+', help='one or more collections')
+    parser.add_argument('questions', help='JSONL with question (and optional id) per line, or one question per line')
+    parser.add_argument('--output', default='answers.jsonl')
+    parser.add_argument('--max-concurrency', type=int, default=CONTEXT_MAX_CONCURRENCY)
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+
+    items = load_questions(args.questions)
+    done = load_done_ids(args.output)
+    todo = [item for item in items if item['id'] not in done]
+    print(f'{len(items)} questions, {len(items) - len(todo)} already answered, {len(todo)} to go')
+
+    start = time.perf_counter()
+    failed = 0
+    with open(args.output, 'a', encoding='utf-8') as f:
+        results = answer_queries([item['question'] for item in todo], args.collection,
+                                 max_concurrency=args.max_concurrency, batch_size=args.batch_size)
+        for n, result in enumerate(results, 1):
+            record = to_record(todo[result['index']], result)
+            failed += bool(record['error'])
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            if n % 50 == 0 or n == len(todo):
+                elapsed = time.perf_counter() - start
+                print(f'{n}/{len(todo)} answered, {n / elapsed:.2f} questions/s, {failed} failed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import threading
+import time
+
+
+class CollectionRegistry:
+    """
+    Process-wide registry of open vector store handles.
+
+    Opening a persistent Chroma collection reloads its SQLite/HNSW state, so handles are
+    created once by `factory(name)` and reused by every request. Each name is opened under
+    its own lock, so a cold collection only holds up requests for that collection.
+    Handles unused for `idle_seconds` are dropped and passed to `release(handle)`, which is
+    what actually frees the store's memory (dropping the handle alone does not).
+    `invalidate(name)` drops a handle after a write and bumps the collection version so
+    dependent caches can tell the collection changed.
+    """
+
+    def __init__(self, factory, idle_seconds=900, release=None):
+        self.factory = factory
+        self.idle_seconds = idle_seconds
+        self.release = release
+        self._handles = {}
+        self._last_used = {}
+        self._versions = {}
+        self._open_locks = {}
+        self._lock = threading.RLock()
+
+    def get(self, name):
+        self.evict_idle(exclude=name)
+        with self._lock:
+            handle = self._handles.get(name)
+            if handle is not None:
+                self._last_used[name] = time.monotonic()
+                return handle
+            open_lock = self._open_locks.setdefault(name, threading.Lock())
+        with open_lock:
+            with self._lock:
+                handle = self._handles.get(name)
+                version = self._versions.get(name, 0)
+            if handle is None:
+                handle = self.factory(name)
+                with self._lock:
+                    # invalidated while it was opening: serve this request, open afresh next time
+                    if self._versions.get(name, 0) == version:
+                        self._handles[name] = handle
+            with self._lock:
+                self._last_used[name] = time.monotonic()
+            return handle
+
+    def invalidate(self, name):
+        with self._lock:
+            self._handles.pop(name, None)
+            self._last_used.pop(name, None)
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+    def bump_version(self, name):
+        """Tell dependent caches that what the collection serves changed, keeping its handle open"""
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+    def expire(self, name):
+        """Mark a handle as idle now, so the next eviction releases it unless it is used again first"""
+        with self._lock:
+            if name in self._last_used:
+                self._last_used[name] = float('-inf')
+
+    def version(self, name):
+        with self._lock:
+            return self._versions.get(name, 0)
+
+    def evict_idle(self, exclude=None):
+        with self._lock:
+            cutoff = time.monotonic() - self.idle_seconds
+            evicted = []
+            for name in [n for n, used in self._last_used.items() if used < cutoff and n != exclude]:
+                handle = self._handles.pop(name, None)
+                self._last_used.pop(name, None)
+                if handle is not None:
+                    evicted.append((name, handle, self._open_locks.setdefault(name, threading.Lock())))
+        if self.release is None:
+            return
+        for name, handle, open_lock in evicted:
+            # a reopen of the same store can pick up the client being released, so it waits for the
+            # release, and a handle reopened before it keeps the client
+            with open_lock:
+                with self._lock:
+                    reopened = name in self._handles
+                if not reopened:
+                    self.release(handle)
+
+    def open_collections(self):
+        with self._lock:
+            return list(self._handles)
@@ -0,0 +1,113 @@
+import re
+from collections import deque
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+PHRASE_SPLIT_PATTERN = re.compile(r'[.!?]')
+
+
+def normalize_whitespace(text):
+    return WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+def quote_phrases(quote):
+    return [phrase.strip() for phrase in PHRASE_SPLIT_PATTERN.split(normalize_whitespace(quote)) if phrase.strip()]
+
+
+def _is_word(char):
+    return char.isalnum() or char == '_'
+
+
+def _lower_same_length(text):
+    # a few characters change length when lowercased ('İ' -> 'i̇'), which would shift match offsets
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return ''.join(char if len(char.lower()) != 1 else char.lower() for char in text)
+
+
+class PhraseMatcher:
+    """
+    Aho-Corasick automaton over a set of phrases, matched case-insensitively on word boundaries.
+
+    `find` returns the merged (start, end) spans of every phrase occurrence in a single pass
+    over the text, however many phrases there are. Boundaries follow regex `\\b` semantics,
+    so results agree with matching `\\bphrase\\b` for each phrase separately.
+    """
+
+    def __init__(self, phrases):
+        self.phrases = sorted({_lower_same_length(phrase) for phrase in phrases if phrase})
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for phrase in self.phrases:
+            self._insert(phrase)
+        self._link()
+
+    def __bool__(self):
+        return bool(self.phrases)
+
+    def _insert(self, phrase):
+        state = 0
+        for char in phrase:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = next_state
+        self._out[state].append(phrase)
+
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def find(self, text):
+        lowered = _lower_same_length(text)
+        goto, fail, out = self._goto, self._fail, self._out
+        spans = []
+        state = 0
+        for end, char in enumerate(lowered, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for phrase in out[state]:
+                start = end - len(phrase)
+                if start > 0 and _is_word(text[start - 1]) == _is_word(phrase[0]):
+                    continue
+                if end < len(text) and _is_word(text[end]) == _is_word(phrase[-1]):
+                    continue
+                spans.append((start, end))
+        spans.sort()
+        merged = []
+        for start, end in spans:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+
+def highlight_phrases(context, phrases, marker='**'):
+    """Wrap every occurrence of any of phrases in context with marker, in one pass over context"""
+    context = normalize_whitespace(context)
+    matcher = phrases if isinstance(phrases, PhraseMatcher) else PhraseMatcher(phrases)
+    if not matcher:
+        return context
+    parts = []
+    position = 0
+    for start, end in matcher.find(context):
+        parts.append(context[position:start])
+        parts.append(f'{marker}{context[start:end]}{marker}')
+        position = end
+    parts.append(context[position:])
+    return ''.join(parts)
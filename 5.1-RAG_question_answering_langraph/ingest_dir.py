@@ -0,0 +1,136 @@
+"""
+Bulk-ingest a folder of PDFs into a collection.
+
+PDFs are parsed in a process pool (parsing is CPU bound), while chunk contexts, embeddings and
+Chroma writes for up to `--files-in-flight` documents run together on one event loop. LLM calls
+are bounded per document by `--max-concurrency` and globally by the context rate limiter.
+Parsed pages of every file in flight stay in memory until it is ingested; with the default `full`
+context strategy its text is held once more, so set CONTEXT_STRATEGY=window for very large PDFs.
+Finished files are appended to a manifest (default: ingest_manifest.jsonl in the collection folder),
+so re-running the same command skips them and picks up where an interrupted run stopped.
+
+    python ingest_dir.py papers/ test_collection --parse-workers 4 --files-in-flight 8
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_community.document_loaders import PyMuPDFLoader
+
+
+def parse_pdf_pages(file_path):
+    # runs in a worker process; pages are parsed one at a time, but the whole list pickles back to the
+    # parent, so every page of a file in flight is held in memory whatever the context strategy
+    return list(PyMuPDFLoader(file_path).lazy_load())
+
+
+def find_pdfs(directory, pattern, recursive):
+    search = os.path.join(directory, '**', pattern) if recursive else os.path.join(directory, pattern)
+    return sorted(glob.glob(search, recursive=recursive))
+
+
+def load_manifest(path):
+    done = set()
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry['status'] == 'done':
+                    done.add(entry['file'])
+    return done
+
+
+class Progress:
+    def __init__(self, total):
+        self.total = total
+        self.finished = 0
+        self.failed = 0
+        self.pages = 0
+        self.chunks = 0
+        self.start = time.perf_counter()
+
+    def update(self, entry):
+        self.finished += 1
+        self.failed += entry['status'] == 'failed'
+        self.pages += entry.get('pages', 0)
+        self.chunks += entry.get('chunks', 0)
+        elapsed = time.perf_counter() - self.start
+        rate = self.finished / elapsed
+        eta = (self.total - self.finished) / rate if rate else float('inf')
+        print(f"[{self.finished}/{self.total}] {entry['status']:>6} {os.path.basename(entry['file'])} | "
+              f"{rate * 60:.1f} files/min, {self.pages / elapsed:.1f} pages/s, {self.chunks / elapsed:.1f} chunks/s, "
+              f"{self.failed} failed | ETA {eta / 60:.1f} min", flush=True)
+
+
+async def ingest_all(files, collection, manifest_path, parse_workers, files_in_flight, max_concurrency):
+    from rag import aadd_document
+
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(files_in_flight)
+    progress = Progress(len(files))
+
+    with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool, \
+            open(manifest_path, 'a', encoding='utf-8') as manifest:
+
+        async def ingest(file_path):
+            async with slots:
+                start = time.perf_counter()
+                entry = {'file': file_path}
+                try:
+                    pages = await loop.run_in_executor(parse_pool, parse_pdf_pages, file_path)
+                    chunks = await aadd_document(file_path, collection, max_concurrency=max_concurrency, pages=pages)
+                    entry.update(status='done', pages=len(pages), chunks=chunks)
+                except Exception as e:
+                    traceback.print_exc()
+                    entry.update(status='failed', error=str(e))
+                entry['seconds'] = round(time.perf_counter() - start, 2)
+                manifest.write(json.dumps(entry) + '\n')
+                manifest.flush()
+                progress.update(entry)
+
+        await asyncio.gather(*(ingest(file_path) for file_path in files))
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory')
+    parser.add_argument('collection')
+    parser.add_argument('--pattern', default='*.pdf')
+    parser.add_argument('--recursive', action='store_true')
+    parser.add_argument('--manifest', help='checkpoint manifest path')
+    parser.add_argument('--parse-workers', type=int, default=os.cpu_count())
+    parser.add_argument('--files-in-flight', type=int, default=8)
+    parser.add_argument('--max-concurrency', type=int, default=None, help='context LLM calls in flight per document')
+    args = parser.parse_args()
+
+    from rag import CHROMA_DIR, CONTEXT_MAX_CONCURRENCY
+
+    manifest_path = args.manifest or os.path.join(CHROMA_DIR, args.collection, 'ingest_manifest.jsonl')
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    files = find_pdfs(args.directory, args.pattern, args.recursive)
+    done = load_manifest(manifest_path)
+    todo = [file_path for file_path in files if file_path not in done]
+    print(f'{len(files)} files found, {len(files) - len(todo)} already in the manifest, {len(todo)} to ingest')
+    if not todo:
+        return
+
+    progress = asyncio.run(ingest_all(todo, args.collection, manifest_path,
+                                      parse_workers=args.parse_workers,
+                                      files_in_flight=args.files_in_flight,
+                                      max_concurrency=args.max_concurrency or CONTEXT_MAX_CONCURRENCY))
+    elapsed = time.perf_counter() - progress.start
+    print(f'Done: {progress.finished - progress.failed} ingested, {progress.failed} failed, '
+          f'{progress.pages} pages, {progress.chunks} chunks in {elapsed / 60:.1f} min')
+
+
+if __name__ == '__main__':
+    main()
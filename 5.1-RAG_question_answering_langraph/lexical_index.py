@@ -0,0 +1,197 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Any, List, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+# keeps model names, versions and acronyms like "gpt-4o", "3.5" or "rag-fusion" as single terms
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-_][a-z0-9]+)*")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over chunk texts, persisted in SQLite next to a Chroma collection.
+
+    Postings are rows of (term, chunk_id, term_frequency), so adding or removing a batch of chunks
+    writes only that batch's rows, and every process sees the others' changes on its next query.
+    `generation` records the collection generation the index was last built from (see rebuild).
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS postings (
+                       term TEXT NOT NULL,
+                       chunk_id TEXT NOT NULL,
+                       tf INTEGER NOT NULL,
+                       PRIMARY KEY (term, chunk_id)
+                   ) WITHOUT ROWID"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings (chunk_id)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks (chunk_id TEXT PRIMARY KEY, length INTEGER NOT NULL) WITHOUT ROWID"
+            )
+            # n_docs and total_length are kept up to date so queries never scan the chunks table
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+
+    def __len__(self):
+        with self._lock:
+            return self._get_meta('n_docs', 0)
+
+    @property
+    def generation(self):
+        with self._lock:
+            return self._get_meta('generation')
+
+    def _get_meta(self, key, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_meta(self, **values):
+        self._conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", list(values.items()))
+
+    def _remove(self, ids):
+        removed = removed_length = 0
+        ids = list(dict.fromkeys(ids))
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            count, length = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks WHERE chunk_id IN ({placeholders})", batch
+            ).fetchone()
+            if not count:
+                continue
+            self._conn.execute(f"DELETE FROM postings WHERE chunk_id IN ({placeholders})", batch)
+            self._conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", batch)
+            removed += count
+            removed_length += length
+        return removed, removed_length
+
+    def _add(self, ids, texts):
+        removed, removed_length = self._remove(ids)
+        added = added_length = 0
+        for chunk_id, text in dict(zip(ids, texts)).items():
+            terms = Counter(tokenize(text))
+            self._conn.executemany("INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                                   [(term, chunk_id, tf) for term, tf in terms.items()])
+            length = sum(terms.values())
+            self._conn.execute("INSERT INTO chunks (chunk_id, length) VALUES (?, ?)", (chunk_id, length))
+            added += 1
+            added_length += length
+        return added - removed, added_length - removed_length
+
+    def _update_totals(self, n_docs, length):
+        self._set_meta(n_docs=self._get_meta('n_docs', 0) + n_docs,
+                       total_length=self._get_meta('total_length', 0) + length)
+
+    def add(self, ids, texts):
+        """Index chunks, replacing any already indexed under the same id"""
+        with self._lock, self._conn:
+            self._update_totals(*self._add(ids, texts))
+
+    def remove(self, ids):
+        with self._lock, self._conn:
+            removed, removed_length = self._remove(ids)
+            self._update_totals(-removed, -removed_length)
+
+    def clear(self):
+        with self._lock, self._conn:
+            for table in ('postings', 'chunks', 'meta'):
+                self._conn.execute(f"DELETE FROM {table}")
+
+    def rebuild(self, pages, generation):
+        """
+        Replace the index with the chunks of `pages`, an iterable of (ids, texts) batches, in one transaction:
+        other processes keep searching the previous index until it commits.
+        """
+        with self._lock, self._conn:
+            for table in ('postings', 'chunks', 'meta'):
+                self._conn.execute(f"DELETE FROM {table}")
+            n_docs = total_length = 0
+            for ids, texts in pages:
+                added, length = self._add(ids, texts)
+                n_docs += added
+                total_length += length
+            self._set_meta(n_docs=n_docs, total_length=total_length, generation=generation)
+
+    def document_frequency(self, term):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (term,)).fetchone()
+            return count
+
+    def search(self, query, k=20):
+        """Return the top k (chunk_id, score) pairs for query"""
+        with self._lock:
+            n_docs = self._get_meta('n_docs', 0)
+            if not n_docs:
+                return []
+            avg_length = self._get_meta('total_length', 0) / n_docs or 1
+            scores = Counter()
+            for term in set(tokenize(query)):
+                posting = self._conn.execute(
+                    """SELECT p.chunk_id, p.tf, c.length FROM postings p
+                       JOIN chunks c ON c.chunk_id = p.chunk_id WHERE p.term = ?""",
+                    (term,),
+                ).fetchall()
+                if not posting:
+                    continue
+                idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+                for chunk_id, tf, length in posting:
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+            return scores.most_common(k)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses dense similarity search with BM25 using reciprocal rank fusion:
+    score(chunk) = sum over both rankings of 1 / (rrf_k + rank)
+    """
+
+    vectorstore: Any
+    lexical_index: Any
+    k: int = 5
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return [doc for doc, _ in self.get_scored_documents(query)]
+
+    def get_scored_documents(self, query: str) -> List[Tuple[Document, float]]:
+        """Top k documents with their fused score, scaled to [0, 1] by the best possible score"""
+        dense_docs = self.vectorstore.similarity_search(query, k=self.fetch_k)
+        lexical_hits = self.lexical_index.search(query, k=self.fetch_k)
+
+        docs_by_id = {doc.metadata['id']: doc for doc in dense_docs}
+        fused = Counter()
+        for rank, doc in enumerate(dense_docs):
+            fused[doc.metadata['id']] += 1 / (self.rrf_k + rank + 1)
+        for rank, (chunk_id, _) in enumerate(lexical_hits):
+            fused[chunk_id] += 1 / (self.rrf_k + rank + 1)
+
+        top = fused.most_common(self.k)
+        top_ids = [chunk_id for chunk_id, _ in top]
+        missing = [chunk_id for chunk_id in top_ids if chunk_id not in docs_by_id]
+        if missing:
+            # chunks are addressed by their metadata id, which older collections did not use as the store id
+            stored = self.vectorstore.get(where={'id': {'$in': missing}}, include=['documents', 'metadatas'])
+            for text, metadata in zip(stored['documents'], stored['metadatas']):
+                docs_by_id[metadata['id']] = Document(page_content=text, metadata=metadata)
+        best_possible = 2 / (self.rrf_k + 1)
+        return [(docs_by_id[chunk_id], score / best_possible) for chunk_id, score in top if chunk_id in docs_by_id]
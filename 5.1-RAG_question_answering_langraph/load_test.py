@@ -0,0 +1,125 @@
+"""
+Load-test query throughput against the app served by gunicorn with a growing number of workers.
+
+For each worker count a gunicorn server is started (gunicorn.conf.py, CHROMA_STORE_MODE=server, so
+a Chroma server must already be running), warmed up, then hit by `--concurrency` client threads
+for `--duration` seconds. The default endpoint, /search, runs embedding lookup and retrieval without
+an LLM call, so the numbers show how the serving path scales rather than how fast the LLM is;
+--endpoint stream sends full questions (answers repeat from the semantic answer cache after warm-up).
+
+    chroma run --path ./rag_chroma_db/_shared_store --port 8000 &
+    python load_test.py test_collection questions.txt --workers 1 2 4 8 --concurrency 32
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+def load_questions(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if path.endswith('.jsonl'):
+        return [json.loads(line)['question'] for line in lines]
+    return lines
+
+
+def request_url(base_url, endpoint, collection, question):
+    return f"{base_url}/{endpoint}?{urllib.parse.urlencode({'collection_name': collection, 'query': question})}"
+
+
+def fetch(url, timeout=300):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        response.read()
+
+
+def start_server(workers, port):
+    env = {**os.environ, 'CHROMA_STORE_MODE': 'server', 'WEB_CONCURRENCY': str(workers), 'BIND': f'127.0.0.1:{port}'}
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                              env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            fetch(f'http://127.0.0.1:{port}/cache/stats', timeout=5)
+            return server
+        except (urllib.error.URLError, ConnectionError):
+            if server.poll() is not None:
+                raise RuntimeError(f'gunicorn exited with code {server.returncode}')
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError('gunicorn did not come up within 120s')
+
+
+def run_load(urls, concurrency, duration):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(offset):
+        n = offset
+        while time.perf_counter() < stop_at:
+            start = time.perf_counter()
+            try:
+                fetch(urls[n % len(urls)])
+                with lock:
+                    latencies.append((time.perf_counter() - start) * 1000)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+            n += concurrency
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('collection')
+    parser.add_argument('questions', help='text file with a question per line, or JSONL with a question field')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--concurrency', type=int, default=32, help='client threads')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load per worker count')
+    parser.add_argument('--endpoint', choices=['search', 'stream'], default='search')
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    base_url = f'http://127.0.0.1:{args.port}'
+    urls = [request_url(base_url, args.endpoint, args.collection, question) for question in questions]
+    print(f'{len(questions)} questions, /{args.endpoint}, {args.concurrency} clients, {args.duration:.0f}s per run')
+    print(f"{'workers':>7} {'req/s':>8} {'speedup':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+
+    baseline = None
+    for workers in args.workers:
+        server = start_server(workers, args.port)
+        try:
+            # every worker keeps its own query-embedding and answer caches; warm them all
+            run_load(urls, args.concurrency, min(args.duration, 10))
+            latencies, errors, elapsed = run_load(urls, args.concurrency, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+        throughput = len(latencies) / elapsed
+        baseline = baseline or throughput
+        speedup = throughput / baseline if baseline else float('nan')
+        latencies.sort()
+        p50 = statistics.median(latencies) if latencies else float('nan')
+        p95 = latencies[int(0.95 * (len(latencies) - 1))] if latencies else float('nan')
+        print(f'{workers:>7} {throughput:>8.1f} {speedup:>7.2f}x {p50:>8.1f} {p95:>8.1f} {len(errors):>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Move collections to the quantized retrieval backend, or back to Chroma.
+
+Migrating snapshots a collection's vectors, documents and metadata from its Chroma directory into
+memory-mapped files under <CHROMA_DIR>/<collection>/quantized and switches dense retrieval to them.
+The Chroma collection is kept: ingestion still writes there and the snapshot is rebuilt in the
+background once a query finds it older than the collection (the previous one serves until then),
+so reverting is only a config change.
+
+    python migrate_quantized.py test_collection --mode int8
+    python migrate_quantized.py --all --mode binary
+    python migrate_quantized.py test_collection --revert
+"""
+import argparse
+import os
+
+
+def directory_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('collections', nargs='*')
+    parser.add_argument('--all', action='store_true', help='migrate every collection in CHROMA_DIR')
+    parser.add_argument('--mode', choices=['int8', 'binary'], default='int8', help='first-pass quantization')
+    parser.add_argument('--revert', action='store_true', help='switch back to searching Chroma')
+    args = parser.parse_args()
+
+    from rag import list_collections, quantized_index_path, set_retrieval_backend
+
+    collections = list_collections() if args.all else args.collections
+    if not collections:
+        parser.error('name at least one collection or pass --all')
+    for collection in collections:
+        if args.revert:
+            set_retrieval_backend(collection, 'chroma')
+            print(f'{collection}: dense retrieval uses Chroma')
+            continue
+        set_retrieval_backend(collection, 'quantized', quantization=args.mode)
+        index_path = quantized_index_path(collection)
+        print(f'{collection}: dense retrieval uses the {args.mode} index at {index_path} '
+              f'({directory_mb(index_path):.1f} MB on disk)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+Move collections from one Chroma database per collection directory into the shared store
+(CHROMA_DIR/_shared_store), where every collection lives in one persistent client.
+
+Vectors, documents, metadata and the collection's HNSW settings are copied page by page. The
+collection directories keep their side files (collection_config.json, BM25 and quantized indexes,
+ingest checkpoints and manifests). The old Chroma files stay in place, as a fallback, unless
+--remove-source is given. Restart the app afterwards: it uses the shared store once it exists,
+or when CHROMA_STORE_MODE=shared is set.
+
+    python migrate_store.py
+    python migrate_store.py tenant_a tenant_b --remove-source
+"""
+import argparse
+import os
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('collections', nargs='*', help='defaults to every collection directory in CHROMA_DIR')
+    parser.add_argument('--remove-source', action='store_true', help='delete the per-collection Chroma files once copied')
+    args = parser.parse_args()
+
+    from rag import CHROMA_DIR, migrate_collection_to_shared_store
+
+    collections = args.collections or sorted(
+        name for name in os.listdir(CHROMA_DIR)
+        if os.path.exists(os.path.join(CHROMA_DIR, name, 'chroma.sqlite3')))
+    start = time.perf_counter()
+    for n, collection in enumerate(collections, 1):
+        copied = migrate_collection_to_shared_store(collection, remove_source=args.remove_source)
+        print(f'[{n}/{len(collections)}] {collection}: {copied} vectors copied')
+    print(f'Migrated {len(collections)} collections in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
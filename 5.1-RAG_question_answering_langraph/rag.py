@@ -1,21 +1,42 @@
 import os
+import time
 import uuid
+import contextlib
+import hashlib
+import threading
+import json
+import asyncio
+import shutil
+from collections import deque
 from dotenv import load_dotenv
-from typing import List, TypedDict, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, TypedDict, Union
 
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_community.document_loaders import PyMuPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document
 from langchain_chroma import Chroma
+from langchain_core.rate_limiters import InMemoryRateLimiter
+import chromadb
 
 from langgraph.graph import StateGraph, START, END
 
 from operator import itemgetter
 
 from log import logger
+from context_cache import ContextCache
+from embedding_cache import build_cached_embeddings, embed_queries
+from collection_registry import CollectionRegistry
+from answer_cache import SemanticAnswerCache
+from lexical_index import BM25Index, HybridRetriever
+from local_citations import CitationAligner
+from context_packing import ContextPacker
+from quantized_index import QuantizedIndex, QuantizedRetriever
+from collection_snapshot import write_snapshot, read_snapshot_info, iter_snapshot
+from collection_config import load_collection_config, update_collection_config, bump_collection_generation, collection_lock
 from schema import QuotedCitations
 
 # Load environment variables
@@ -26,16 +47,85 @@ UPLOAD_DIR = "uploads"
 CHROMA_DIR = "./rag_chroma_db"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Limits for contextual chunk generation during ingestion
+CONTEXT_MAX_CONCURRENCY = int(os.getenv("CONTEXT_MAX_CONCURRENCY", 8))
+CONTEXT_REQUESTS_PER_SECOND = float(os.getenv("CONTEXT_REQUESTS_PER_SECOND", 5))
+CONTEXT_MAX_RETRIES = int(os.getenv("CONTEXT_MAX_RETRIES", 4))
+# What each chunk prompt sees as the paper: full | window | outline
+# full holds the whole document text in memory while it is ingested; window streams it, so prefer it for very large files
+CONTEXT_STRATEGY = os.getenv("CONTEXT_STRATEGY", "full")
+CONTEXT_WINDOW = int(os.getenv("CONTEXT_WINDOW", 2))
+OUTLINE_HEAD_CHARS = 300
+# Chunks contextualized, embedded and committed together while streaming a document in
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 64))
+
+# Persistent cache of generated chunk contexts
+CACHE_DIR = "./rag_cache"
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", 200_000))
+CONTEXT_CACHE_MAX_AGE_DAYS = int(os.getenv("CONTEXT_CACHE_MAX_AGE_DAYS", 90))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 10_000))
+# Open collection handles are dropped after this many idle seconds
+COLLECTION_IDLE_SECONDS = int(os.getenv("COLLECTION_IDLE_SECONDS", 900))
+# Questions at least this similar to an answered one reuse its answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+
+# Retrieval: default mode for collections without their own setting (dense | hybrid)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+RETRIEVAL_K = 5
+HYBRID_FETCH_K = 20
+# Rank constant of the reciprocal rank fusion that merges results of several collections when one is hybrid
+COLLECTION_RRF_K = 60
+LEXICAL_INDEX_FILENAME = 'bm25_index.sqlite'
+# HNSW parameters of collections without their own setting (Chroma's defaults); see tune_hnsw.py
+HNSW_DEFAULTS = {'space': 'cosine', 'construction_ef': 100, 'search_ef': 10, 'M': 16}
+# Collections queried concurrently when a question spans several of them
+RETRIEVAL_MAX_WORKERS = int(os.getenv("RETRIEVAL_MAX_WORKERS", 8))
+
+# Citations: "local" aligns answer sentences to the retrieved chunks without an LLM call,
+# "llm" asks the model for them, "auto" is local with the LLM as fallback when nothing aligns
+CITATION_MODE = os.getenv("CITATION_MODE", "auto")
+
+# Retrieved chunks are re-ranked with MMR and packed into this many context tokens (0 sends them all)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 6000))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", 0.7))
+
+# Dense retrieval backend of collections without their own setting: chroma | quantized (see migrate_quantized.py).
+# Quantized collections are searched from a memory-mapped int8/binary snapshot; Chroma stays the store ingestion writes to
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "chroma")
+QUANTIZED_DIRNAME = 'quantized'
+QUANTIZED_RESCORE_FACTOR = int(os.getenv("QUANTIZED_RESCORE_FACTOR", 10))
+
+# Chroma layout: "per_collection" is one database per collection directory, "shared" keeps every collection in one
+# persistent client under CHROMA_DIR/_shared_store (see migrate_store.py); defaults to whichever layout is on disk.
+# "server" reaches that store through a Chroma server process, so several web workers can share it (see gunicorn.conf.py).
+# Collection directories hold the side files (config, BM25 and quantized indexes, checkpoints) in every layout
+SHARED_STORE_DIRNAME = '_shared_store'
+CHROMA_STORE_MODE = os.getenv("CHROMA_STORE_MODE") or (
+    'shared' if os.path.isdir(os.path.join(CHROMA_DIR, SHARED_STORE_DIRNAME)) else 'per_collection'
+)
+CHROMA_SERVER_HOST = os.getenv("CHROMA_SERVER_HOST", "localhost")
+CHROMA_SERVER_PORT = int(os.getenv("CHROMA_SERVER_PORT", 8000))
+
 # Lazy-initialized models
 _embedding_model = None
 _chatgpt = None
 _structured_chatgpt = None
+_context_chatgpt = None
+_context_cache = None
+_retrieval_pool = None
+_shared_client = None
+_shared_client_lock = threading.Lock()
 
 
 def get_embedding_model():
     global _embedding_model
     if _embedding_model is None:
-        _embedding_model = OpenAIEmbeddings(model='text-embedding-3-small')
+        # Embeddings are cached by text hash: documents on disk, queries in an in-process LRU
+        _embedding_model = build_cached_embeddings(
+            model='text-embedding-3-small',
+            cache_dir=CACHE_DIR,
+            query_cache_size=QUERY_EMBEDDING_CACHE_SIZE,
+        )
     return _embedding_model
 
 
@@ -53,25 +143,136 @@ def get_structured_chat_model():
     return _structured_chatgpt
 
 
-def get_chroma_collection(collection_name: str) -> Chroma:
+def get_context_chat_model():
+    """Chat model used for ingestion, throttled by a token-bucket rate limiter.
+
+    Kept separate from get_chat_model() so a large upload cannot starve the query path.
+    """
+    global _context_chatgpt
+    if _context_chatgpt is None:
+        rate_limiter = InMemoryRateLimiter(
+            requests_per_second=CONTEXT_REQUESTS_PER_SECOND,
+            check_every_n_seconds=0.1,
+            max_bucket_size=CONTEXT_MAX_CONCURRENCY,
+        )
+        _context_chatgpt = ChatOpenAI(model="gpt-4o-mini", temperature=0, rate_limiter=rate_limiter)
+    return _context_chatgpt
+
+
+def get_context_cache() -> ContextCache:
+    global _context_cache
+    if _context_cache is None:
+        _context_cache = ContextCache(
+            os.path.join(CACHE_DIR, 'chunk_contexts.sqlite'),
+            max_entries=CONTEXT_CACHE_MAX_ENTRIES,
+            max_age_days=CONTEXT_CACHE_MAX_AGE_DAYS,
+        )
+    return _context_cache
+
+
+def save_uploaded_file(file_storage, filename: Optional[str] = None) -> str:
+    """Store an upload under its content hash so different files with the same name never overwrite."""
+    filename = filename or file_storage.filename
+    data = file_storage.read()
+    upload_path = os.path.join(UPLOAD_DIR, hashlib.sha256(data).hexdigest()[:16])
+    os.makedirs(upload_path, exist_ok=True)
+    path = os.path.join(upload_path, filename)
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+    return path
+
+
+def file_content_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hnsw_collection_metadata(hnsw: dict) -> dict:
+    return {f"hnsw:{name}": value for name, value in hnsw.items()}
+
+
+def get_shared_chroma_client():
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            if CHROMA_STORE_MODE == 'server':
+                # Started with: chroma run --path ./rag_chroma_db/_shared_store --port 8000
+                _shared_client = chromadb.HttpClient(host=CHROMA_SERVER_HOST, port=CHROMA_SERVER_PORT)
+            else:
+                _shared_client = chromadb.PersistentClient(path=os.path.join(CHROMA_DIR, SHARED_STORE_DIRNAME))
+        return _shared_client
+
+
+def get_chroma_client(collection_name: str):
+    if CHROMA_STORE_MODE in ('shared', 'server'):
+        return get_shared_chroma_client()
+    return chromadb.PersistentClient(path=os.path.join(CHROMA_DIR, collection_name))
+
+
+def open_chroma_collection(collection_name: str) -> Chroma:
+    # HNSW parameters take effect when the collection is created; set_hnsw_config rebuilds existing ones
+    client = get_chroma_client(collection_name)
+    # Before opening: a collection moved aside by an interrupted rebuild would otherwise be recreated empty
+    recover_hnsw_rebuild(client, collection_name)
     return Chroma(
         collection_name=collection_name,
         embedding_function=get_embedding_model(),
-        collection_metadata={"hnsw:space": "cosine"},
-        persist_directory=os.path.join(CHROMA_DIR, collection_name),
+        collection_metadata=hnsw_collection_metadata(get_hnsw_config(collection_name)),
+        client=client,
     )
 
 
+def release_chroma_collection(vectorstore: Chroma) -> None:
+    # A per-collection PersistentClient stays cached (with its HNSW segments) in chromadb's system
+    # cache until its system is stopped; the shared/server client serves every collection and stays open
+    if CHROMA_STORE_MODE in ('shared', 'server'):
+        return
+    client = vectorstore._client
+    systems = getattr(chromadb.api.client.SharedSystemClient, "_identifer_to_system", {})
+    system = systems.pop(getattr(client, "_identifier", None), None)
+    if system is not None:
+        system.stop()
+
+
+collection_registry = CollectionRegistry(
+    open_chroma_collection, idle_seconds=COLLECTION_IDLE_SECONDS, release=release_chroma_collection
+)
+citation_aligner = CitationAligner()
+context_packer = ContextPacker(token_budget=CONTEXT_TOKEN_BUDGET, lambda_mult=CONTEXT_MMR_LAMBDA)
+answer_cache = SemanticAnswerCache(threshold=ANSWER_CACHE_THRESHOLD)
+
+
+def get_chroma_collection(collection_name: str) -> Chroma:
+    """Return the shared handle for a collection, opening it on first use."""
+    return collection_registry.get(collection_name)
+
+
+def collection_names(client) -> List[str]:
+    # Chroma < 0.6 lists Collection objects, later versions list names
+    return [collection if isinstance(collection, str) else collection.name for collection in client.list_collections()]
+
+
 def list_collections() -> List[str]:
+    if CHROMA_STORE_MODE in ('shared', 'server'):
+        return [
+            name for name in collection_names(get_shared_chroma_client())
+            if not name.endswith(('__rebuild', '__old', '__migrate'))
+        ]
     if not os.path.exists(CHROMA_DIR):
         return []
-    return [name for name in os.listdir(CHROMA_DIR) if os.path.isdir(os.path.join(CHROMA_DIR, name))]
+    return [
+        name for name in os.listdir(CHROMA_DIR)
+        if os.path.isdir(os.path.join(CHROMA_DIR, name)) and name != SHARED_STORE_DIRNAME
+    ]
 
 
 # ---------- Chunking with generated context ----------
 
-def generate_chunk_context(document: str, chunk: str) -> str:
-    chunk_process_prompt = """You are an AI assistant specializing in research paper analysis.
+CHUNK_CONTEXT_PROMPT = """You are an AI assistant specializing in research paper analysis.
                             Your task is to provide brief, relevant context for a chunk of text
                             based on the following research paper.
 
@@ -97,62 +298,921 @@ def generate_chunk_context(document: str, chunk: str) -> str:
                             Context:
                         """
 
-    prompt_template = ChatPromptTemplate.from_template(chunk_process_prompt)
+
+def get_chunk_context_chain():
+    prompt_template = ChatPromptTemplate.from_template(CHUNK_CONTEXT_PROMPT)
 
     agentic_chunk_chain = (
         prompt_template
-        | get_chat_model()
+        | get_context_chat_model()
         | StrOutputParser()
     )
 
-    context = agentic_chunk_chain.invoke({'paper': document, 'chunk': chunk})
-    return context
+    # Retry transient failures (rate limits, timeouts) with exponential backoff and jitter
+    return agentic_chunk_chain.with_retry(
+        stop_after_attempt=CONTEXT_MAX_RETRIES,
+        wait_exponential_jitter=True,
+    )
+
+
+def generate_document_outline(chunk_texts: List[str]) -> str:
+    outline_prompt = """You are an AI assistant specializing in research paper analysis.
+                        Below are the opening lines of every consecutive chunk of a research paper.
 
+                        <chunk_openings>
+                        {openings}
+                        </chunk_openings>
 
-def create_contextual_chunks(file_path: str, chunk_size: int = 3500, chunk_overlap: int = 0) -> List[Document]:
-    logger.info(f'Loading pages: {file_path}')
-    loader = PyMuPDFLoader(file_path)
-    doc_pages = loader.load()
+                        Write a compact outline of the paper: its title, the problem it addresses,
+                        its main sections in order and its key contributions.
+                        Answer only with the outline and nothing else.
 
-    logger.info(f'Chunking pages: {file_path}')
+                        Outline:
+                    """
+
+    prompt_template = ChatPromptTemplate.from_template(outline_prompt)
+    outline_chain = (
+        prompt_template
+        | get_context_chat_model()
+        | StrOutputParser()
+    ).with_retry(stop_after_attempt=CONTEXT_MAX_RETRIES, wait_exponential_jitter=True)
+
+    openings = '\n...\n'.join(text[:OUTLINE_HEAD_CHARS] for text in chunk_texts)
+    # The outline is cached like chunk contexts, so re-ingesting a document reuses it
+    cache = get_context_cache()
+    key = ContextCache.make_key(openings, '', outline_prompt, get_context_chat_model().model_name)
+    cached = cache.get_many([key])
+    if key in cached:
+        return cached[key]
+    outline = outline_chain.invoke({'openings': openings})
+    cache.set_many({key: outline})
+    return outline
+
+
+def iter_document_chunks(
+    file_path: str,
+    chunk_size: int = 3500,
+    chunk_overlap: int = 0,
+    pages: Optional[List[Document]] = None,
+) -> Iterator[Tuple[Document, str]]:
+    """Yield (chunk, chunk_id) page by page, without holding the whole document in memory.
+
+    `pages` can hold the already parsed pages of file_path (e.g. parsed in another process).
+    """
     splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    doc_chunks = splitter.split_documents(doc_pages)
+    occurrences = {}
+    for page in (PyMuPDFLoader(file_path).lazy_load() if pages is None else pages):
+        # The splitter works on each page separately, so this yields the same chunks as splitting the whole document
+        chunks = splitter.split_documents([page])
+        yield from zip(chunks, assign_chunk_ids(chunks, occurrences))
+
+
+def iter_context_inputs(
+    file_path: str,
+    chunk_size: int = 3500,
+    chunk_overlap: int = 0,
+    strategy: str = CONTEXT_STRATEGY,
+    window: int = CONTEXT_WINDOW,
+    pages: Optional[List[Document]] = None,
+    usage: Optional[dict] = None,
+) -> Iterator[Tuple[Document, str, dict]]:
+    """Yield (chunk, chunk_id, {paper, chunk}), the context prompt inputs of every chunk, streaming the document.
+
+    full: the whole document for every chunk (original behaviour); its text is held in memory until the last chunk
+    window: only the `window` neighbouring chunks on each side of the chunk, with a lookahead of `window` chunks
+    outline: one document outline, generated once and shared by every chunk
+    full and outline need one cheap text-only pass first, for the document text and the chunk openings.
+    `usage`, if given, is filled with the chunk and paper token counts (see log_context_savings).
+    """
+    if usage is not None:
+        usage.update(strategy=strategy, chunks=0, chunk_tokens=0, paper_tokens=0)
+
+    def count_tokens(text: str) -> int:
+        return get_context_chat_model().get_num_tokens(text) if usage is not None else 0
+
+    def record(chunk_tokens: int, paper_tokens: int) -> None:
+        if usage is not None:
+            usage["chunks"] += 1
+            usage["chunk_tokens"] += chunk_tokens
+            usage["paper_tokens"] += paper_tokens
+
+    chunks = iter_document_chunks(file_path, chunk_size, chunk_overlap, pages)
+    if strategy == "full":
+        texts = [chunk.page_content for chunk, _ in chunks]
+        paper = "\n".join(texts)
+        chunk_tokens = [count_tokens(text) for text in texts]
+        del texts
+        for i, (chunk, chunk_id) in enumerate(iter_document_chunks(file_path, chunk_size, chunk_overlap, pages)):
+            record(chunk_tokens[i], sum(chunk_tokens))
+            yield chunk, chunk_id, {"paper": paper, "chunk": chunk.page_content}
+    elif strategy == "outline":
+        outline = generate_document_outline([chunk.page_content[:OUTLINE_HEAD_CHARS] for chunk, _ in chunks])
+        outline_tokens = count_tokens(outline)
+        for chunk, chunk_id in iter_document_chunks(file_path, chunk_size, chunk_overlap, pages):
+            record(count_tokens(chunk.page_content), outline_tokens)
+            yield chunk, chunk_id, {"paper": outline, "chunk": chunk.page_content}
+    elif strategy == "window":
+        # (text, tokens) of the chunks before the next one to emit, and (chunk, chunk_id, tokens) from it on
+        before = deque(maxlen=window)
+        ahead = deque()
+
+        def emit() -> Tuple[Document, str, dict]:
+            chunk, chunk_id, tokens = ahead[0]
+            neighbours = list(before) + [
+                (item.page_content, item_tokens) for item, _, item_tokens in list(ahead)[:window + 1]
+            ]
+            record(tokens, sum(item_tokens for _, item_tokens in neighbours))
+            before.append((chunk.page_content, tokens))
+            ahead.popleft()
+            return chunk, chunk_id, {"paper": "\n".join(text for text, _ in neighbours), "chunk": chunk.page_content}
+
+        for chunk, chunk_id in chunks:
+            ahead.append((chunk, chunk_id, count_tokens(chunk.page_content)))
+            if len(ahead) > window:
+                yield emit()
+        while ahead:
+            yield emit()
+    else:
+        raise ValueError(f"Unknown context strategy: {strategy}")
+
+
+def log_context_savings(file_path: str, usage: dict) -> None:
+    # Every chunk prompt of the full strategy carries the whole document
+    full_tokens = usage["chunk_tokens"] * usage["chunks"]
+    used_tokens = usage["paper_tokens"]
+    logger.info(
+        f'Context strategy "{usage["strategy"]}": {used_tokens} paper tokens sent '
+        f'instead of {full_tokens} ({full_tokens - used_tokens} saved): {file_path}'
+    )
 
-    logger.info(f'Generating contextual chunks: {file_path}')
-    original_doc = '\n'.join([doc.page_content for doc in doc_chunks])
-    contextual_chunks: List[Document] = []
+
+def iter_batches(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def assign_chunk_ids(doc_chunks: List[Document], occurrences: Optional[dict] = None) -> List[str]:
+    """Deterministic chunk ids derived from the document title, page and chunk text.
+
+    Re-ingesting a file produces the same ids for unchanged chunks. Pass the same
+    `occurrences` dict when assigning ids to a document piece by piece.
+    """
+    occurrences = {} if occurrences is None else occurrences
+    chunk_ids = []
     for chunk in doc_chunks:
+        title = chunk.metadata['source'].split('/')[-1]
+        key = f"{title}\x00{chunk.metadata['page']}\x00{chunk.page_content}"
+        n = occurrences.get(key, 0)
+        occurrences[key] = n + 1
+        chunk_ids.append(str(uuid.uuid5(uuid.NAMESPACE_URL, f"{key}\x00{n}")))
+    return chunk_ids
+
+
+def build_contextual_chunks(
+    doc_chunks: List[Document],
+    contexts: List[str],
+    chunk_ids: List[str],
+    file_hash: Optional[str] = None,
+) -> List[Document]:
+    contextual_chunks: List[Document] = []
+    for chunk, context, chunk_id in zip(doc_chunks, contexts, chunk_ids):
         chunk_content = chunk.page_content
         chunk_metadata = chunk.metadata
         chunk_metadata_upd = {
-            'id': str(uuid.uuid4()),
+            'id': chunk_id,
             'page': chunk_metadata['page'],
             'source': chunk_metadata['source'],
             'title': chunk_metadata['source'].split('/')[-1],
         }
-        context = generate_chunk_context(original_doc, chunk_content)
+        if file_hash:
+            chunk_metadata_upd['file_hash'] = file_hash
         contextual_chunks.append(
             Document(page_content=context + '\n' + chunk_content, metadata=chunk_metadata_upd)
         )
-    logger.info(f'Finished processing: {file_path}')
     return contextual_chunks
 
 
-def add_document(file_path: str, collection: str) -> bool:
+def lookup_cached_contexts(inputs: List[dict]):
+    """Split prompt inputs into cached contexts and the indices still to be generated."""
+    cache = get_context_cache()
+    model_name = get_context_chat_model().model_name
+    keys = [ContextCache.make_key(item['paper'], item['chunk'], CHUNK_CONTEXT_PROMPT, model_name) for item in inputs]
+    cached = cache.get_many(keys)
+    contexts = [cached.get(key) for key in keys]
+    missing = [i for i, context in enumerate(contexts) if context is None]
+    logger.info(
+        f'Context cache: {len(inputs) - len(missing)} hits, {len(missing)} misses '
+        f'(lifetime hit rate {cache.stats()["hit_rate"]:.0%})'
+    )
+    return keys, contexts, missing
+
+
+def store_generated_contexts(keys: List[str], contexts: List[Optional[str]], missing: List[int], generated: List[str]) -> List[str]:
+    for i, context in zip(missing, generated):
+        contexts[i] = context
+    if missing:
+        get_context_cache().set_many({keys[i]: contexts[i] for i in missing})
+    return contexts
+
+
+def log_throughput(file_path: str, n_chunks: int, elapsed: float) -> None:
+    logger.info(
+        f'Finished processing: {file_path} '
+        f'({n_chunks} chunks in {elapsed:.1f}s, {n_chunks / max(elapsed, 1e-9):.2f} chunks/s)'
+    )
+
+
+def ingest_checkpoint_path(collection: str, file_hash: str) -> str:
+    return os.path.join(CHROMA_DIR, collection, 'ingest_checkpoints', f'{file_hash}.json')
+
+
+def save_ingest_checkpoint(path: str, **state: Any) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({**state, 'updated_at': time.time()}, f)
+    os.replace(tmp_path, path)
+
+
+def plan_document_update(vectorstore: Chroma, collection: str, file_path: str) -> Optional[dict]:
+    """Compare file_path against what the collection already holds for the same title.
+
+    Returns None when this exact file content is already fully ingested, otherwise the file hash,
+    its checkpoint path and the ids and metadata the collection holds for the title.
+    Chunks committed by an interrupted run are among the existing ids, so they are skipped.
+    """
+    file_hash = file_content_hash(file_path)
+    checkpoint_path = ingest_checkpoint_path(collection, file_hash)
+    if os.path.exists(checkpoint_path):
+        logger.info(f'Resuming interrupted ingestion of {file_path}')
+    elif vectorstore.get(where={'file_hash': file_hash}, limit=1, include=[])['ids']:
+        logger.info(f'Skipping {file_path}: already ingested')
+        return None
+
+    title = file_path.split('/')[-1]
+    existing = vectorstore.get(where={'title': title}, include=['metadatas'])
+    return {
+        'file_hash': file_hash,
+        'checkpoint_path': checkpoint_path,
+        'existing': dict(zip(existing['ids'], existing['metadatas'])),
+        'seen_ids': set(),
+        'committed': 0,
+    }
+
+
+def select_new_chunks(plan: dict, batch: List[Tuple[Document, str, dict]]) -> List[Tuple[Document, str, dict]]:
+    plan['seen_ids'].update(chunk_id for _, chunk_id, _ in batch)
+    return [item for item in batch if item[1] not in plan['existing']]
+
+
+def commit_chunk_batch(vectorstore: Chroma, collection: str, plan: dict, file_path: str, docs: List[Document]) -> None:
+    """Upsert one batch of contextual chunks and record it in the file's checkpoint."""
+    if docs:
+        vectorstore.add_documents(docs, ids=[doc.metadata['id'] for doc in docs])
+        update_lexical_index(collection, docs, [])
+    plan['committed'] += len(docs)
+    save_ingest_checkpoint(
+        plan['checkpoint_path'],
+        file=file_path,
+        file_hash=plan['file_hash'],
+        committed_chunks=plan['committed'],
+        seen_chunks=len(plan['seen_ids']),
+    )
+
+
+def finish_document_update(vectorstore: Chroma, collection: str, plan: dict, file_path: str) -> None:
+    unchanged = [(chunk_id, metadata) for chunk_id, metadata in plan['existing'].items() if chunk_id in plan['seen_ids']]
+    stale = [(chunk_id, metadata) for chunk_id, metadata in plan['existing'].items() if chunk_id not in plan['seen_ids']]
+    if unchanged:
+        # Unchanged chunks now belong to the new file version as well
+        vectorstore._collection.update(
+            ids=[chunk_id for chunk_id, _ in unchanged],
+            metadatas=[{**metadata, 'file_hash': plan['file_hash']} for _, metadata in unchanged],
+        )
+    if stale:
+        vectorstore.delete(ids=[chunk_id for chunk_id, _ in stale])
+        update_lexical_index(collection, [], [metadata['id'] for _, metadata in stale])
+    # A concurrent job ingesting identical content shares this checkpoint and may have removed it already
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(plan['checkpoint_path'])
+    logger.info(
+        f'Ingested {file_path}: {plan["committed"]} chunks embedded, {len(unchanged)} unchanged, '
+        f'{len(stale)} stale removed'
+    )
+
+
+def contextualize_batch(batch: List[Tuple[Document, str, dict]], plan: dict, max_concurrency: int) -> List[Document]:
+    keys, contexts, missing = lookup_cached_contexts([inputs for _, _, inputs in batch])
+    generated = get_chunk_context_chain().batch([batch[i][2] for i in missing], {"max_concurrency": max_concurrency})
+    contexts = store_generated_contexts(keys, contexts, missing, generated)
+    return build_contextual_chunks(
+        [chunk for chunk, _, _ in batch], contexts, [chunk_id for _, chunk_id, _ in batch], plan['file_hash']
+    )
+
+
+async def acontextualize_batch(batch: List[Tuple[Document, str, dict]], plan: dict, max_concurrency: int) -> List[Document]:
+    # The context cache is SQLite: lookups and writes run in worker threads like the other blocking steps
+    keys, contexts, missing = await asyncio.to_thread(lookup_cached_contexts, [inputs for _, _, inputs in batch])
+    generated = await get_chunk_context_chain().abatch(
+        [batch[i][2] for i in missing], {"max_concurrency": max_concurrency}
+    )
+    contexts = await asyncio.to_thread(store_generated_contexts, keys, contexts, missing, generated)
+    return build_contextual_chunks(
+        [chunk for chunk, _, _ in batch], contexts, [chunk_id for _, chunk_id, _ in batch], plan['file_hash']
+    )
+
+
+def add_document(
+    file_path: str,
+    collection: str,
+    on_progress: Optional[Callable[..., None]] = None,
+    max_concurrency: int = CONTEXT_MAX_CONCURRENCY,
+    batch_size: int = INGEST_BATCH_SIZE,
+) -> bool:
+    """Stream file_path into collection: page -> chunk -> context -> embed -> upsert.
+
+    Chunks are processed `batch_size` at a time, so memory stays bounded and every committed
+    batch survives an interruption; re-running an interrupted ingestion resumes after the last
+    committed batch. on_progress(stage, **info) is called as ingestion moves through its stages,
+    which lets background jobs report progress.
+    """
+    report = on_progress or (lambda stage, **info: None)
     chroma_path = os.path.join(CHROMA_DIR, collection)
     os.makedirs(chroma_path, exist_ok=True)
     vectorstore = get_chroma_collection(collection)
-    docs = create_contextual_chunks(file_path=file_path, chunk_size=3500)
-    vectorstore.add_documents(docs)
+    report('parsing')
+    plan = plan_document_update(vectorstore, collection, file_path)
+    if plan is None:
+        report('skipped', reason='already ingested')
+        return True
+    save_ingest_checkpoint(plan['checkpoint_path'], file=file_path, file_hash=plan['file_hash'], committed_chunks=0)
+    start = time.perf_counter()
+    usage = {}
+    for batch in iter_batches(iter_context_inputs(file_path, chunk_size=3500, usage=usage), batch_size):
+        batch = select_new_chunks(plan, batch)
+        docs = contextualize_batch(batch, plan, max_concurrency) if batch else []
+        commit_chunk_batch(vectorstore, collection, plan, file_path, docs)
+        report('ingesting', chunks=len(plan['seen_ids']), new_chunks=plan['committed'])
+    log_context_savings(file_path, usage)
+    log_throughput(file_path, len(plan['seen_ids']), time.perf_counter() - start)
+    finish_document_update(vectorstore, collection, plan, file_path)
+    publish_collection_change(collection)
     return True
 
 
-def get_retriever(collection: str):
+async def aadd_document(
+    file_path: str,
+    collection: str,
+    max_concurrency: int = CONTEXT_MAX_CONCURRENCY,
+    batch_size: int = INGEST_BATCH_SIZE,
+    pages: Optional[List[Document]] = None,
+) -> int:
+    """Async add_document, for ingesting many files on one event loop.
+
+    Everything that blocks (chunking and token counting, the outline call, context cache lookups, embedding
+    and Chroma writes) runs in worker threads so it does not stall other files' LLM calls.
+    Returns the number of chunks in the document (0 when it was already ingested).
+    """
+    chroma_path = os.path.join(CHROMA_DIR, collection)
+    os.makedirs(chroma_path, exist_ok=True)
+    vectorstore = await asyncio.to_thread(get_chroma_collection, collection)
+    plan = await asyncio.to_thread(plan_document_update, vectorstore, collection, file_path)
+    if plan is None:
+        return 0
+    await asyncio.to_thread(
+        save_ingest_checkpoint, plan['checkpoint_path'], file=file_path, file_hash=plan['file_hash'], committed_chunks=0
+    )
+    start = time.perf_counter()
+    usage = {}
+    batches = iter_batches(iter_context_inputs(file_path, chunk_size=3500, pages=pages, usage=usage), batch_size)
+    # The generator is advanced in a worker thread: the outline strategy makes a blocking LLM call inside it
+    while (batch := await asyncio.to_thread(next, batches, None)) is not None:
+        batch = select_new_chunks(plan, batch)
+        docs = await acontextualize_batch(batch, plan, max_concurrency) if batch else []
+        await asyncio.to_thread(commit_chunk_batch, vectorstore, collection, plan, file_path, docs)
+    log_context_savings(file_path, usage)
+    log_throughput(file_path, len(plan['seen_ids']), time.perf_counter() - start)
+    await asyncio.to_thread(finish_document_update, vectorstore, collection, plan, file_path)
+    await asyncio.to_thread(publish_collection_change, collection)
+    return len(plan['seen_ids'])
+
+
+def get_collection_config(collection: str) -> dict:
+    return load_collection_config(
+        os.path.join(CHROMA_DIR, collection),
+        defaults={'retrieval': RETRIEVAL_MODE, 'backend': RETRIEVAL_BACKEND, 'quantization': 'int8'},
+    )
+
+
+# Generation of each collection this process last saw; see sync_collection
+_seen_generations = {}
+
+
+def publish_collection_change(collection: str) -> None:
+    # Other worker processes see the new generation on their next query and drop what they cached
+    _seen_generations[collection] = bump_collection_generation(os.path.join(CHROMA_DIR, collection))
+    collection_registry.invalidate(collection)
+
+
+def sync_collection(collection: str) -> None:
+    """Drop this process's handles and cached answers if another process changed the collection."""
+    generation = get_collection_config(collection).get('generation', 0)
+    if _seen_generations.setdefault(collection, generation) != generation:
+        _seen_generations[collection] = generation
+        collection_registry.invalidate(collection)
+
+
+def set_retrieval_mode(collection: str, mode: str) -> dict:
+    if mode not in ('dense', 'hybrid'):
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+    previous = get_collection_config(collection)['retrieval']
+    update_collection_config(os.path.join(CHROMA_DIR, collection), retrieval=mode)
+    if mode == 'hybrid' and previous != 'hybrid':
+        # Commits did not maintain the BM25 index while the collection was dense
+        rebuild_lexical_index(collection)
+    elif mode != 'hybrid':
+        open_lexical_index(collection).clear()
+    # Answers cached under the previous mode were retrieved differently, here and in other processes
+    publish_collection_change(collection)
+    return get_collection_config(collection)
+
+
+def get_hnsw_config(collection: str) -> dict:
+    return {**HNSW_DEFAULTS, **get_collection_config(collection).get('hnsw', {})}
+
+
+def set_hnsw_config(collection: str, **params: int) -> dict:
+    """Persist HNSW parameters (construction_ef, search_ef, M) for a collection and rebuild its index with them.
+
+    Chroma fixes them when a collection is created, so every vector is copied into a new collection.
+    """
+    unknown = set(params) - {'construction_ef', 'search_ef', 'M'}
+    if unknown:
+        raise ValueError(f"Unknown HNSW parameters: {sorted(unknown)}")
+    hnsw = {**get_hnsw_config(collection), **params}
+    # The config is written by the rebuild once the new collection has replaced the old one
+    rebuild_chroma_collection(collection, hnsw)
+    return hnsw
+
+
+def recover_hnsw_rebuild(client, collection: str) -> None:
+    """Finish or roll back a rebuild_chroma_collection swap that was interrupted."""
+    names = collection_names(client)
+    old_name = f'{collection}__old'
+    if old_name not in names:
+        return
+    if collection in names:
+        # The rebuilt collection holds the name: record its parameters and drop the old one
+        metadata = client.get_collection(collection).metadata or {}
+        hnsw = {key[len('hnsw:'):]: value for key, value in metadata.items() if key.startswith('hnsw:')}
+        update_collection_config(os.path.join(CHROMA_DIR, collection), hnsw={**get_hnsw_config(collection), **hnsw})
+        try:
+            client.delete_collection(old_name)
+        except Exception:
+            # Another process finished the swap first
+            pass
+        logger.warning(f'Completed an interrupted HNSW rebuild of {collection}')
+    else:
+        # Interrupted after moving the old collection aside: put it back, the rebuild copy is dropped on the next rebuild
+        client.get_collection(old_name).modify(name=collection)
+        logger.warning(f'Rolled back an interrupted HNSW rebuild of {collection}')
+
+
+def rebuild_chroma_collection(collection: str, hnsw: dict, page_size: int = 5000) -> None:
+    """Copy every vector into a new collection created with `hnsw` and swap it in.
+
+    The old collection is renamed aside and only deleted once the new one holds its name,
+    so no interruption loses it (see recover_hnsw_rebuild).
+    """
+    vectorstore = get_chroma_collection(collection)
+    client = vectorstore._client
+    rebuild_name = f'{collection}__rebuild'
+    old_name = f'{collection}__old'
+    try:
+        # Left over from an interrupted rebuild
+        client.delete_collection(rebuild_name)
+    except Exception:
+        pass
+    rebuilt = client.create_collection(rebuild_name, metadata=hnsw_collection_metadata(hnsw))
+    offset = 0
+    while True:
+        page = vectorstore._collection.get(
+            include=['embeddings', 'documents', 'metadatas'], limit=page_size, offset=offset
+        )
+        if not page['ids']:
+            break
+        rebuilt.add(
+            ids=page['ids'], embeddings=page['embeddings'], documents=page['documents'], metadatas=page['metadatas']
+        )
+        offset += len(page['ids'])
+    vectorstore._collection.modify(name=old_name)
+    try:
+        rebuilt.modify(name=collection)
+    except Exception:
+        if collection not in collection_names(client):
+            client.get_collection(old_name).modify(name=collection)
+        raise
+    update_collection_config(os.path.join(CHROMA_DIR, collection), hnsw=hnsw)
+    try:
+        client.delete_collection(old_name)
+    except Exception:
+        # Already dropped by recover_hnsw_rebuild in another process
+        pass
+    publish_collection_change(collection)
+    logger.info(f'Rebuilt {collection} ({offset} vectors) with HNSW {hnsw}')
+
+
+def iter_collection_pages(
+    vectorstore: Chroma, page_size: int = 5000, include: Sequence[str] = ('embeddings', 'documents', 'metadatas')
+) -> Iterator[Tuple[list, list, list, list]]:
+    """Yield (ids, embeddings, documents, metadatas) for every chunk in the collection, page_size at a time."""
+    offset = 0
+    while True:
+        page = vectorstore.get(include=list(include), limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        yield page['ids'], page['embeddings'], page['documents'], page['metadatas']
+        offset += len(page['ids'])
+
+
+# Settings that describe this node's copy of a collection rather than the collection itself
+LOCAL_CONFIG_KEYS = ('generation',)
+
+
+def export_collection(collection: str, path: str, page_size: int = 5000) -> int:
+    """Write a collection's vectors (as float16), chunk texts, metadata and settings to a Parquet snapshot.
+
+    Another node can then serve the collection with import_collection instead of re-ingesting the PDFs.
+    """
+    vectorstore = get_chroma_collection(collection)
+    first = vectorstore.get(include=['embeddings'], limit=1)
+    if not first['ids']:
+        raise ValueError(f"Collection {collection} is empty")
+    dim = len(first['embeddings'][0])
+    config = {key: value for key, value in get_collection_config(collection).items() if key not in LOCAL_CONFIG_KEYS}
+    info = {
+        'collection': collection,
+        'embedding_model': get_embedding_model().underlying_embeddings.model,
+        'config': config,
+    }
+    start = time.perf_counter()
+    rows = write_snapshot(path, iter_collection_pages(vectorstore, page_size), dim, info)
+    logger.info(f'Exported {collection} ({rows} chunks) to {path} in {time.perf_counter() - start:.1f}s')
+    return rows
+
+
+def import_collection(
+    path: str, collection: Optional[str] = None, batch_size: int = 5000, resume: bool = False
+) -> int:
+    """Bulk-load a snapshot written by export_collection into a new collection (by default the exported name).
+
+    Vectors are added as stored, nothing is re-embedded; the settings (retrieval mode, HNSW, backend) come along
+    and the BM25 or quantized index the collection uses is built before returning.
+    With resume an interrupted import is completed: chunks are upserted by id.
+    """
+    info = read_snapshot_info(path)
+    collection = collection or info['collection']
+    if collection in list_collections() and not resume:
+        raise ValueError(f"Collection {collection} already exists")
+    model = get_embedding_model().underlying_embeddings.model
+    if info['embedding_model'] != model:
+        raise ValueError(f"Snapshot embedded with {info['embedding_model']}, this node queries with {model}")
+    # Settings first: the Chroma collection is created with the snapshot's HNSW parameters
+    update_collection_config(os.path.join(CHROMA_DIR, collection), **info['config'])
+    vectorstore = get_chroma_collection(collection)
+    client = vectorstore._client
+    # Chroma caps how many records one call may write (SQLite variable limit)
+    max_batch_size = (
+        client.get_max_batch_size() if hasattr(client, 'get_max_batch_size')
+        else getattr(client, 'max_batch_size', batch_size)
+    )
+    batch_size = min(batch_size, max_batch_size)
+    start = time.perf_counter()
+    rows = 0
+    for ids, embeddings, documents, metadatas in iter_snapshot(path, batch_size):
+        vectorstore._collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+        rows += len(ids)
+    publish_collection_change(collection)
+    config = get_collection_config(collection)
+    if config['retrieval'] == 'hybrid':
+        get_lexical_index(collection)
+    elif config['backend'] == 'quantized':
+        build_quantized_index(collection)
+    logger.info(f'Imported {rows} chunks from {path} into {collection} in {time.perf_counter() - start:.1f}s')
+    return rows
+
+
+def migrate_collection_to_shared_store(collection: str, remove_source: bool = False, page_size: int = 5000) -> int:
+    """Copy a collection from its own Chroma database (CHROMA_DIR/<collection>) into the shared store.
+
+    Collections already in the shared store are left alone; returns the number of vectors copied.
+    With remove_source the old database files are deleted, the side files in the directory are kept.
+    """
+    source_dir = os.path.join(CHROMA_DIR, collection)
+    client = get_shared_chroma_client()
+    if collection in collection_names(client):
+        logger.info(f'{collection} is already in the shared store')
+        return 0
+    source = chromadb.PersistentClient(path=source_dir).get_collection(collection)
+    migrate_name = f'{collection}__migrate'
+    try:
+        # Left over from an interrupted migration
+        client.delete_collection(migrate_name)
+    except Exception:
+        pass
+    target = client.create_collection(migrate_name, metadata=hnsw_collection_metadata(get_hnsw_config(collection)))
+    offset = 0
+    while True:
+        page = source.get(include=['embeddings', 'documents', 'metadatas'], limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        target.add(
+            ids=page['ids'], embeddings=page['embeddings'], documents=page['documents'], metadatas=page['metadatas']
+        )
+        offset += len(page['ids'])
+    target.modify(name=collection)
+    if remove_source:
+        os.remove(os.path.join(source_dir, 'chroma.sqlite3'))
+        for name in os.listdir(source_dir):
+            # Vector segments are directories named by their uuid
+            try:
+                uuid.UUID(name)
+            except ValueError:
+                continue
+            shutil.rmtree(os.path.join(source_dir, name))
+    publish_collection_change(collection)
+    logger.info(f'Migrated {collection} ({offset} vectors) into the shared store')
+    return offset
+
+
+_lexical_indexes = {}
+_lexical_indexes_lock = threading.Lock()
+
+
+def open_lexical_index(collection: str) -> BM25Index:
+    """Return the BM25 index stored in SQLite next to the collection's Chroma files."""
+    with _lexical_indexes_lock:
+        index = _lexical_indexes.get(collection)
+        if index is None:
+            index = BM25Index(os.path.join(CHROMA_DIR, collection, LEXICAL_INDEX_FILENAME))
+            _lexical_indexes[collection] = index
+        return index
+
+
+def lexical_index_stale(collection: str, index: BM25Index) -> bool:
+    # Hybrid collections keep their index current on every commit; for any other collection it is a
+    # snapshot (e.g. built by bench_retrieval.py) that is stale once the collection changed
+    config = get_collection_config(collection)
+    return index.generation is None or (
+        config['retrieval'] != 'hybrid' and index.generation != config.get('generation', 0)
+    )
+
+
+def rebuild_lexical_index(collection: str, if_stale: bool = False) -> BM25Index:
+    """Index every chunk of the Chroma collection; collections ingested while dense are backfilled this way."""
+    index = open_lexical_index(collection)
+    # Under the lock update_lexical_index takes, so a committed batch is either in the snapshot or applied after it
+    with collection_lock(os.path.join(CHROMA_DIR, collection)):
+        if if_stale and not lexical_index_stale(collection, index):
+            return index
+        generation = get_collection_config(collection).get('generation', 0)
+        pages = iter_collection_pages(get_chroma_collection(collection), include=['documents', 'metadatas'])
+        index.rebuild(
+            (([metadata['id'] for metadata in metadatas], documents) for _, _, documents, metadatas in pages),
+            generation,
+        )
+    logger.info(f'Built lexical index for {collection}: {len(index)} chunks')
+    return index
+
+
+def get_lexical_index(collection: str) -> BM25Index:
+    index = open_lexical_index(collection)
+    if lexical_index_stale(collection, index):
+        rebuild_lexical_index(collection, if_stale=True)
+    return index
+
+
+def update_lexical_index(collection: str, docs: List[Document], removed_ids: List[str]) -> None:
+    # Only hybrid collections maintain a BM25 index; a batch writes just its own rows
+    with collection_lock(os.path.join(CHROMA_DIR, collection)):
+        if get_collection_config(collection)['retrieval'] != 'hybrid':
+            return
+        index = open_lexical_index(collection)
+        if index.generation is None:
+            # Never built: the first hybrid query backfills it from Chroma
+            return
+        index.remove(removed_ids)
+        index.add([doc.metadata['id'] for doc in docs], [doc.page_content for doc in docs])
+
+
+_quantized_indexes = {}
+_quantized_indexes_lock = threading.Lock()
+# Per-collection locks for building and loading an index: a cold collection only holds up its own queries
+_quantized_build_locks = {}
+# Collections with a background rebuild running in this process
+_quantized_rebuilds = set()
+
+
+def quantized_build_lock(collection: str) -> threading.RLock:
+    with _quantized_indexes_lock:
+        return _quantized_build_locks.setdefault(collection, threading.RLock())
+
+
+def quantized_index_path(collection: str) -> str:
+    return os.path.join(CHROMA_DIR, collection, QUANTIZED_DIRNAME)
+
+
+def build_quantized_index(collection: str, page_size: int = 5000) -> int:
+    """Snapshot every vector, document and metadata of the Chroma collection into its quantized index."""
     vectorstore = get_chroma_collection(collection)
-    similarity_retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 5})
+    first = vectorstore.get(include=['embeddings'], limit=1)
+    dim = len(first['embeddings'][0]) if first['ids'] else 1
+    # Read before the snapshot: chunks committed while it is built show up as a newer generation
+    generation = get_collection_config(collection).get('generation', 0)
+    start = time.perf_counter()
+    # The read runs unlocked, writers only wait for the finished index to be moved into place
+    with quantized_build_lock(collection):
+        n_vectors = QuantizedIndex.build(
+            quantized_index_path(collection),
+            dim,
+            iter_collection_pages(vectorstore, page_size),
+            generation=generation,
+            swap_lock=collection_lock(os.path.join(CHROMA_DIR, collection)),
+        )
+    # Quantized queries never touch Chroma, so its HNSW index loaded by the read is released once idle
+    collection_registry.expire(collection)
+    logger.info(
+        f'Built quantized index for {collection}: {n_vectors} vectors of dim {dim} '
+        f'in {time.perf_counter() - start:.1f}s'
+    )
+    return n_vectors
+
+
+def load_quantized_index(collection: str) -> QuantizedIndex:
+    index = QuantizedIndex(
+        quantized_index_path(collection),
+        mode=get_collection_config(collection)['quantization'],
+        rescore_factor=QUANTIZED_RESCORE_FACTOR,
+    )
+    with _quantized_indexes_lock:
+        _quantized_indexes[collection] = index
+    return index
+
+
+def drop_quantized_index(collection: str) -> None:
+    # Requests still holding the old index keep reading its (unlinked) files until they finish
+    with _quantized_indexes_lock:
+        _quantized_indexes.pop(collection, None)
+
+
+def rebuild_quantized_index_in_background(collection: str) -> None:
+    with _quantized_indexes_lock:
+        if collection in _quantized_rebuilds:
+            return
+        _quantized_rebuilds.add(collection)
+
+    def rebuild() -> None:
+        try:
+            generation = get_collection_config(collection).get('generation', 0)
+            # Another process may already have moved a current snapshot into place
+            if QuantizedIndex.stored_generation(quantized_index_path(collection)) != generation:
+                build_quantized_index(collection)
+            load_quantized_index(collection)
+            # Answers cached while the previous snapshot was served miss the chunks it lacked
+            collection_registry.bump_version(collection)
+        except Exception:
+            logger.exception(f'Rebuilding the quantized index of {collection} failed')
+        finally:
+            with _quantized_indexes_lock:
+                _quantized_rebuilds.discard(collection)
+
+    threading.Thread(target=rebuild, name=f'quantized-rebuild-{collection}', daemon=True).start()
+
+
+def get_quantized_index(collection: str) -> QuantizedIndex:
+    """Return the collection's quantized index, building it if there is none yet.
+
+    A snapshot older than the collection's generation keeps serving while a newer one is built in
+    the background, so a bulk ingestion neither blocks queries nor rebuilds once per file.
+    """
+    with _quantized_indexes_lock:
+        index = _quantized_indexes.get(collection)
+    if index is None:
+        with quantized_build_lock(collection):
+            with _quantized_indexes_lock:
+                index = _quantized_indexes.get(collection)
+            if index is None:
+                if not QuantizedIndex.exists(quantized_index_path(collection)):
+                    # Nothing to serve yet
+                    build_quantized_index(collection)
+                index = load_quantized_index(collection)
+    if index.generation != get_collection_config(collection).get('generation', 0):
+        rebuild_quantized_index_in_background(collection)
+    return index
+
+
+def set_retrieval_backend(collection: str, backend: str, quantization: str = 'int8') -> dict:
+    """Switch a collection between Chroma and the quantized index (int8 or binary first pass) for dense retrieval.
+
+    Switching to quantized builds the index from the Chroma collection, which is left in place.
+    """
+    if backend not in ('chroma', 'quantized'):
+        raise ValueError(f"Unknown retrieval backend: {backend}")
+    if quantization not in ('int8', 'binary'):
+        raise ValueError(f"Unknown quantization mode: {quantization}")
+    drop_quantized_index(collection)
+    if backend == 'quantized':
+        build_quantized_index(collection)
+    config = update_collection_config(
+        os.path.join(CHROMA_DIR, collection), backend=backend, quantization=quantization
+    )
+    # Contents are unchanged, other processes pick the backend up from the config on their next query
+    collection_registry.invalidate(collection)
+    return config
+
+
+def get_retriever(collection: str):
+    config = get_collection_config(collection)
+    if config['retrieval'] == 'hybrid':
+        return HybridRetriever(
+            vectorstore=get_chroma_collection(collection),
+            lexical_index=get_lexical_index(collection),
+            k=RETRIEVAL_K,
+            fetch_k=HYBRID_FETCH_K,
+        )
+    if config['backend'] == 'quantized':
+        return QuantizedRetriever(index=get_quantized_index(collection), embeddings=get_embedding_model(), k=RETRIEVAL_K)
+    similarity_retriever = get_chroma_collection(collection).as_retriever(
+        search_type="similarity", search_kwargs={"k": RETRIEVAL_K}
+    )
     return similarity_retriever
 
 
+def get_retrieval_pool() -> ThreadPoolExecutor:
+    global _retrieval_pool
+    if _retrieval_pool is None:
+        _retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_MAX_WORKERS, thread_name_prefix="retrieve")
+    return _retrieval_pool
+
+
+def retrieve_scored(collection: str, question: str) -> List[Tuple[Document, float]]:
+    """Top-k documents of one collection with a relevance score in [0, 1] (cosine relevance, or scaled RRF for hybrid)"""
+    retriever = get_retriever(collection)
+    if isinstance(retriever, (HybridRetriever, QuantizedRetriever)):
+        return retriever.get_scored_documents(question)
+    return get_chroma_collection(collection).similarity_search_with_relevance_scores(question, k=RETRIEVAL_K)
+
+
+def retrieve_from_collections(collections: Sequence[str], question: str, k: int = RETRIEVAL_K) -> List[Document]:
+    """Query every collection concurrently and merge the results into a single top-k.
+
+    Dense collections (Chroma or quantized) all report cosine relevance, so their results are merged
+    by score. Once a hybrid collection is involved the scores are no longer comparable (scaled RRF
+    against cosine), so the per-collection rankings are fused by rank: 1 / (COLLECTION_RRF_K + rank).
+    A chunk present in several collections (same deterministic id) is kept once, with its best score.
+    """
+    pool = get_retrieval_pool()
+    results = pool.map(lambda collection: retrieve_scored(collection, question), collections)
+    by_rank = any(get_collection_config(collection)["retrieval"] == "hybrid" for collection in collections)
+    best = {}
+    for scored_docs in results:
+        for rank, (doc, relevance) in enumerate(scored_docs, start=1):
+            chunk_id = doc.metadata["id"]
+            score = 1 / (COLLECTION_RRF_K + rank) if by_rank else relevance
+            if chunk_id not in best or score > best[chunk_id][1]:
+                best[chunk_id] = (doc, score)
+    merged = sorted(best.values(), key=lambda item: item[1], reverse=True)
+    return [doc for doc, _ in merged[:k]]
+
+
+def get_stored_embeddings(collections: Sequence[str], docs: List[Document]) -> List[List[float]]:
+    """Vectors of docs as stored in the quantized index or Chroma; anything not found is re-embedded through the on-disk document cache."""
+    ids = [doc.metadata["id"] for doc in docs]
+    by_id = {}
+    for collection in collections:
+        missing_ids = [chunk_id for chunk_id in ids if chunk_id not in by_id]
+        if not missing_ids:
+            break
+        if get_collection_config(collection)["backend"] == "quantized":
+            by_id.update(get_quantized_index(collection).vectors_by_id(missing_ids))
+            continue
+        stored = get_chroma_collection(collection).get(
+            where={"id": {"$in": missing_ids}}, include=["embeddings", "metadatas"]
+        )
+        by_id.update((metadata["id"], embedding) for metadata, embedding in zip(stored["metadatas"], stored["embeddings"]))
+    missing = [doc for doc in docs if doc.metadata["id"] not in by_id]
+    if missing:
+        embeddings = get_embedding_model().embed_documents([doc.page_content for doc in missing])
+        by_id.update(zip([doc.metadata["id"] for doc in missing], embeddings))
+    return [by_id[chunk_id] for chunk_id in ids]
+
+
 def format_docs_with_metadata(docs: List[Document]) -> str:
     formatted_docs = [
         f"""Context Article ID: {doc.metadata['id']}
@@ -171,19 +1231,45 @@ def format_docs_with_metadata(docs: List[Document]) -> str:
 class RAGState(TypedDict, total=False):
     question: str
     collection: str
+    collections: List[str]
     context: List[Document]
     answer: str
     citations: QuotedCitations
+    citation_mode: str
+    context_tokens: Optional[dict]
+
+
+def state_collections(state: RAGState) -> List[str]:
+    return list(state.get("collections") or [state["collection"]])
 
 
 def retrieve_node(state: RAGState) -> RAGState:
     question = state["question"]
-    collection = state["collection"]
-    retriever = get_retriever(collection)
+    collections = state_collections(state)
+    if len(collections) > 1:
+        # Fan out: latency is that of the slowest collection rather than the sum
+        return {"context": retrieve_from_collections(collections, question)}
+    retriever = get_retriever(collections[0])
     docs = retriever.get_relevant_documents(question)
     return {"context": docs}
 
 
+def pack_node(state: RAGState) -> RAGState:
+    """MMR re-rank the retrieved chunks, drop near-duplicates and trim them to CONTEXT_TOKEN_BUDGET."""
+    docs = state.get("context", [])
+    if not CONTEXT_TOKEN_BUDGET or not docs:
+        return {"context_tokens": None}
+    query_embedding = get_embedding_model().embed_query(state["question"])
+    doc_embeddings = get_stored_embeddings(state_collections(state), docs)
+    packed, report = context_packer.pack(query_embedding, docs, doc_embeddings)
+    logger.info(
+        f"Context packing: kept {report['kept']}/{report['retrieved']} chunks "
+        f"({report['redundant']} redundant, {report['trimmed']} trimmed), "
+        f"{report['tokens_after']} tokens, saved {report['tokens_saved']}"
+    )
+    return {"context": packed, "context_tokens": report}
+
+
 def answer_node(state: RAGState) -> RAGState:
     rag_prompt = """You are an assistant who is an expert in question-answering tasks.
                     Answer the following question using only the following pieces of retrieved context.
@@ -217,6 +1303,18 @@ def answer_node(state: RAGState) -> RAGState:
 
 
 def cite_node(state: RAGState) -> RAGState:
+    mode = state.get("citation_mode", CITATION_MODE)
+    if mode not in ("local", "llm", "auto"):
+        raise ValueError(f"Unknown citation mode: {mode}")
+    if mode != "llm":
+        citations = citation_aligner.extract(state["answer"], state.get("context", []))
+        if citations.citations or mode == "local":
+            return {"citations": citations}
+        logger.info("No local citation alignment found, falling back to LLM citations")
+    return llm_cite_node(state)
+
+
+def llm_cite_node(state: RAGState) -> RAGState:
     citations_prompt = """You are an assistant who is an expert in analyzing answers to questions
                               and finding out referenced citations from context articles.
 
@@ -250,11 +1348,13 @@ def cite_node(state: RAGState) -> RAGState:
 def _build_graph():
     graph = StateGraph(RAGState)
     graph.add_node("retrieve", retrieve_node)
+    graph.add_node("pack", pack_node)
     graph.add_node("answer", answer_node)
     graph.add_node("cite", cite_node)
 
     graph.add_edge(START, "retrieve")
-    graph.add_edge("retrieve", "answer")
+    graph.add_edge("retrieve", "pack")
+    graph.add_edge("pack", "answer")
     graph.add_edge("answer", "cite")
     graph.add_edge("cite", END)
 
@@ -264,23 +1364,214 @@ def _build_graph():
 compiled_graph = _build_graph()
 
 
-def answer_query(query: str, collection: str):
+def cache_stats() -> dict:
+    return {
+        "answers": answer_cache.stats(),
+        "chunk_contexts": get_context_cache().stats(),
+    }
+
+
+def answer_cache_key(collections: List[str]) -> Tuple[str, Any]:
+    """Answer cache namespace and version for one collection or a set of them"""
+    for collection in collections:
+        sync_collection(collection)
+    if len(collections) == 1:
+        return collections[0], collection_registry.version(collections[0])
+    collections = sorted(set(collections))
+    return ",".join(collections), tuple(collection_registry.version(c) for c in collections)
+
+
+def build_state_input(query: str, collections: List[str]) -> RAGState:
+    if len(collections) == 1:
+        return {"question": query, "collection": collections[0]}
+    return {"question": query, "collection": collections[0], "collections": collections}
+
+
+def retrieve(query: str, collection: Union[str, List[str]]) -> List[Document]:
+    """Run only the retrieval step, without packing or an LLM call."""
+    collections = [collection] if isinstance(collection, str) else list(dict.fromkeys(collection))
+    for name in collections:
+        sync_collection(name)
+    return retrieve_node(build_state_input(query, collections))["context"]
+
+
+def answer_query(query: str, collection: Union[str, List[str]]):
     """Run the LangGraph RAG pipeline and return a result mirroring the original shape.
 
-    Returns a dict with keys: 'context' (List[Document]), 'answer' (str), 'citations' (QuotedCitations)
+    `collection` may be a list of collection names to retrieve from all of them at once.
+    Returns a dict with keys: 'question' (str), 'context' (List[Document]), 'answer' (str),
+    'citations' (QuotedCitations) and 'context_tokens' (the context packing report, cached with the answer)
     """
-    state_input: RAGState = {
-        "question": query,
-        "collection": collection,
-    }
+    collections = [collection] if isinstance(collection, str) else list(dict.fromkeys(collection))
+    # The query embedding is cached, so retrieve_node reuses it without another API call
+    query_embedding = get_embedding_model().embed_query(query)
+    cache_name, version = answer_cache_key(collections)
+    cached = answer_cache.lookup(cache_name, version, query_embedding)
+    if cached is not None:
+        return {"question": query, **cached}
+
+    state_input = build_state_input(query, collections)
     result_state = compiled_graph.invoke(state_input)
 
     # Ensure the return shape matches the original app expectations
-    return {
+    result = {
         "context": result_state.get("context", []),
         "answer": result_state.get("answer", ""),
         "citations": result_state.get("citations"),
+        "context_tokens": result_state.get("context_tokens"),
     }
+    answer_cache.store(cache_name, version, query, query_embedding, result)
+    return {"question": query, **result}
+
+
+def stream_answer_query(query: str, collection: Union[str, List[str]]) -> Iterator[Tuple[str, Any]]:
+    """Stream the LangGraph RAG pipeline as (event, payload) pairs.
+
+    Yields ('context', List[Document]) once retrieval finishes, ('token', str) for every
+    answer token produced by answer_node, and finally ('citations', QuotedCitations).
+    """
+    collections = [collection] if isinstance(collection, str) else list(dict.fromkeys(collection))
+    query_embedding = get_embedding_model().embed_query(query)
+    cache_name, version = answer_cache_key(collections)
+    cached = answer_cache.lookup(cache_name, version, query_embedding)
+    if cached is not None:
+        yield "context", cached["context"]
+        yield "token", cached["answer"]
+        yield "citations", cached["citations"]
+        return
+
+    state_input = build_state_input(query, collections)
+    result = {"context": [], "answer": "", "citations": None, "context_tokens": None}
+    for mode, payload in compiled_graph.stream(state_input, stream_mode=["messages", "updates"]):
+        if mode == "messages":
+            message_chunk, metadata = payload
+            # cite_node also emits (tool call) chunks; only answer tokens are streamed
+            if metadata.get("langgraph_node") == "answer" and message_chunk.content:
+                yield "token", message_chunk.content
+        else:
+            for node, update in payload.items():
+                if node == "retrieve":
+                    result["context"] = update.get("context", [])
+                elif node == "pack":
+                    # The answer is generated from the packed context, so that is what gets cited
+                    result["context"] = update.get("context", result["context"])
+                    result["context_tokens"] = update.get("context_tokens")
+                    yield "context", result["context"]
+                elif node == "answer":
+                    result["answer"] = update.get("answer", "")
+                elif node == "cite":
+                    result["citations"] = update.get("citations")
+                    yield "citations", result["citations"]
+    answer_cache.store(cache_name, version, query, query_embedding, result)
+
+
+# ---------- Batch answering ----------
+
+def retrieve_batch(collections: List[str], questions: List[str], query_embeddings: List[List[float]]) -> List[List[Document]]:
+    """Retrieve for many questions; a single dense collection is searched with one Chroma query."""
+    config = get_collection_config(collections[0])
+    if len(collections) > 1 or config["retrieval"] == "hybrid":
+        states = [build_state_input(question, collections) for question in questions]
+        # Not the shared retrieval pool: retrieve_node fans out to it per collection, and workers
+        # blocking on tasks queued behind them in their own pool would deadlock
+        with ThreadPoolExecutor(max_workers=RETRIEVAL_MAX_WORKERS, thread_name_prefix="retrieve_batch") as pool:
+            return [update["context"] for update in pool.map(retrieve_node, states)]
+    if config["backend"] == "quantized":
+        index = get_quantized_index(collections[0])
+        return [
+            [index.document(row) for row, _ in index.search(query_embedding, k=RETRIEVAL_K)]
+            for query_embedding in query_embeddings
+        ]
+    found = get_chroma_collection(collections[0])._collection.query(
+        query_embeddings=query_embeddings,
+        n_results=RETRIEVAL_K,
+        include=["documents", "metadatas"],
+    )
+    return [
+        [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+        for texts, metadatas in zip(found["documents"], found["metadatas"])
+    ]
+
+
+def answer_queries(
+    questions: List[str],
+    collection: Union[str, List[str]],
+    max_concurrency: int = CONTEXT_MAX_CONCURRENCY,
+    batch_size: int = 100,
+) -> Iterator[dict]:
+    """Answer many questions, yielding results as they complete (not in input order).
+
+    Each batch of `batch_size` questions is embedded in bulk and retrieved together, then
+    pack_node, answer_node and cite_node run on `max_concurrency` threads. Every result is the
+    answer_query dict plus 'index' (position in questions), 'cached', 'error' and 'timings' in ms:
+    embed and retrieve are the question's share of its batch, pack, answer and cite its own steps,
+    total the time from the start of its batch until it finished.
+    """
+    collections = [collection] if isinstance(collection, str) else list(dict.fromkeys(collection))
+    cache_name, version = answer_cache_key(collections)
+
+    def answer_one(question: str, docs: List[Document], query_embedding: List[float]):
+        state = {**build_state_input(question, collections), "context": docs}
+        start = time.perf_counter()
+        state.update(pack_node(state))
+        packed = time.perf_counter()
+        state.update(answer_node(state))
+        answered = time.perf_counter()
+        state.update(cite_node(state))
+        result = {
+            "context": state["context"],
+            "answer": state["answer"],
+            "citations": state["citations"],
+            "context_tokens": state["context_tokens"],
+        }
+        answer_cache.store(cache_name, version, question, query_embedding, result)
+        timings = {
+            "pack": (packed - start) * 1000,
+            "answer": (answered - packed) * 1000,
+            "cite": (time.perf_counter() - answered) * 1000,
+        }
+        return result, timings
+
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="answer") as pool:
+        for offset in range(0, len(questions), batch_size):
+            batch = questions[offset:offset + batch_size]
+            batch_start = time.perf_counter()
+            query_embeddings = embed_queries(get_embedding_model(), batch)
+            embedded = time.perf_counter()
+
+            pending = []
+            for i, (question, query_embedding) in enumerate(zip(batch, query_embeddings)):
+                cached = answer_cache.lookup(cache_name, version, query_embedding)
+                if cached is None:
+                    pending.append(i)
+                else:
+                    yield {"index": offset + i, "question": question, **cached, "cached": True, "error": None,
+                           "timings": {"total": (time.perf_counter() - batch_start) * 1000}}
+            if not pending:
+                continue
+
+            contexts = retrieve_batch(collections, [batch[i] for i in pending], [query_embeddings[i] for i in pending])
+            retrieved = time.perf_counter()
+            shared = {"embed": (embedded - batch_start) * 1000 / len(batch),
+                      "retrieve": (retrieved - embedded) * 1000 / len(pending)}
+
+            futures = {
+                pool.submit(answer_one, batch[i], docs, query_embeddings[i]): i
+                for i, docs in zip(pending, contexts)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                record = {"index": offset + i, "question": batch[i], "cached": False, "error": None}
+                try:
+                    result, timings = future.result()
+                    record.update(result)
+                except Exception as e:
+                    logger.error(f"Failed to answer question {offset + i}: {e}")
+                    record.update({"context": [], "answer": None, "citations": None, "context_tokens": None,
+                                   "error": str(e)})
+                    timings = {}
+                record["timings"] = {**shared, **timings, "total": (time.perf_counter() - batch_start) * 1000}
+                yield record
 
 
 if __name__ == "__main__":
@@ -0,0 +1,32 @@
+"""
+Switch collections between dense (vector only) and hybrid (BM25 + vector) retrieval.
+
+Switching to hybrid builds the collection's BM25 index from the chunks already stored in Chroma;
+switching back to dense clears it. Either way the collection's cached answers are dropped, in this
+and every other process serving it.
+
+    python set_retrieval_mode.py test_collection hybrid
+    python set_retrieval_mode.py --all dense
+"""
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('collections', nargs='*')
+    parser.add_argument('mode', choices=['dense', 'hybrid'])
+    parser.add_argument('--all', action='store_true', help='switch every collection in CHROMA_DIR')
+    args = parser.parse_args()
+
+    from rag import list_collections, set_retrieval_mode
+
+    collections = list_collections() if args.all else args.collections
+    if not collections:
+        parser.error('name at least one collection or pass --all')
+    for collection in collections:
+        set_retrieval_mode(collection, args.mode)
+        print(f'{collection}: {args.mode} retrieval')
+
+
+if __name__ == '__main__':
+    main()
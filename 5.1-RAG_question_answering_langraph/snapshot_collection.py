@@ -0,0 +1,45 @@
+"""
+Export a collection to a compact Parquet snapshot, or import one into this node's store.
+
+A snapshot holds every chunk's id, contextualized text, metadata and embedding (float16), plus the
+collection's settings, so a new node can serve the collection without re-parsing PDFs or paying for
+context LLM calls and embeddings again. Import bulk-loads the vectors and builds the BM25 or quantized
+index the collection uses before it returns.
+
+    python snapshot_collection.py export test_collection snapshots/test_collection.parquet
+    python snapshot_collection.py import snapshots/test_collection.parquet
+    python snapshot_collection.py import snapshots/test_collection.parquet --name test_copy
+"""
+import argparse
+import os
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export')
+    export_parser.add_argument('collection')
+    export_parser.add_argument('path')
+    import_parser = commands.add_parser('import')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--name', help='collection to create (default: the exported name)')
+    import_parser.add_argument('--batch-size', type=int, default=5000)
+    import_parser.add_argument('--resume', action='store_true', help='complete an interrupted import')
+    args = parser.parse_args()
+
+    from rag import export_collection, import_collection
+
+    start = time.perf_counter()
+    if args.command == 'export':
+        os.makedirs(os.path.dirname(args.path) or '.', exist_ok=True)
+        rows = export_collection(args.collection, args.path)
+    else:
+        rows = import_collection(args.path, collection=args.name, batch_size=args.batch_size, resume=args.resume)
+    elapsed = time.perf_counter() - start
+    print(f'{args.command}: {rows} chunks in {elapsed:.1f}s ({rows / elapsed:.0f} chunks/s), '
+          f'snapshot {os.path.getsize(args.path) / 2 ** 20:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Sweep HNSW parameters (M, construction_ef, search_ef) for a collection and report recall@k
+against query latency, build time and index memory.
+
+Indexes are built with hnswlib (installed with chromadb as chroma-hnswlib, the same library
+Chroma's vector segment uses) from the collection's stored embeddings, so the numbers carry
+over to Chroma. Queries are held out: either questions from a JSONL file ({"question": ...}
+per line) or `--sample` stored chunks removed from the index. Ground truth is exact
+brute-force cosine top-k.
+
+    python tune_hnsw.py test_collection --sample 500 --target-recall 0.95
+    python tune_hnsw.py test_collection --queries eval_queries.jsonl --apply
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import hnswlib
+import numpy as np
+
+from embedding_cache import embed_queries
+from rag import get_embedding_model, get_chroma_collection, get_hnsw_config, set_hnsw_config, RETRIEVAL_K
+
+
+def load_vectors(collection, page_size=5000):
+    vectorstore = get_chroma_collection(collection)
+    vectors = []
+    offset = 0
+    while True:
+        page = vectorstore.get(include=['embeddings'], limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        vectors.extend(page['embeddings'])
+        offset += len(page['ids'])
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def normalize(matrix):
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def exact_top_k(vectors, queries, k):
+    scores = normalize(queries) @ normalize(vectors).T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def build_index(vectors, m, construction_ef):
+    index = hnswlib.Index(space='cosine', dim=vectors.shape[1])
+    index.init_index(max_elements=len(vectors), ef_construction=construction_ef, M=m)
+    start = time.perf_counter()
+    index.add_items(vectors, np.arange(len(vectors)))
+    build_seconds = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'index.bin')
+        index.save_index(path)
+        index_mb = os.path.getsize(path) / 2 ** 20
+    return index, build_seconds, index_mb
+
+
+def evaluate(index, queries, truth, k, search_ef):
+    index.set_ef(max(search_ef, k))
+    latencies, recalls = [], []
+    for query, relevant in zip(queries, truth):
+        start = time.perf_counter()
+        labels, _ = index.knn_query(query, k=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(set(labels[0]) & set(relevant)) / k)
+    latencies.sort()
+    return statistics.mean(recalls), statistics.median(latencies), latencies[int(0.95 * (len(latencies) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('collection')
+    parser.add_argument('--queries', help='JSONL file with a question per line')
+    parser.add_argument('--sample', type=int, default=200, help='held-out stored chunks when --queries is not given')
+    parser.add_argument('--k', type=int, default=RETRIEVAL_K)
+    parser.add_argument('--M', type=int, nargs='+', default=[16, 32, 48])
+    parser.add_argument('--construction-ef', type=int, nargs='+', default=[100, 200, 400])
+    parser.add_argument('--search-ef', type=int, nargs='+', default=[10, 32, 64, 128, 256])
+    parser.add_argument('--target-recall', type=float, default=0.95)
+    parser.add_argument('--apply', action='store_true', help='persist the recommended setting and rebuild the collection')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = load_vectors(args.collection)
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            questions = [json.loads(line)['question'] for line in f if line.strip()]
+        queries = np.asarray(embed_queries(get_embedding_model(), questions), dtype=np.float32)
+    else:
+        rng = np.random.default_rng(args.seed)
+        held_out = rng.choice(len(vectors), size=min(args.sample, len(vectors) // 10 or 1), replace=False)
+        queries = vectors[held_out]
+        vectors = np.delete(vectors, held_out, axis=0)
+    truth = exact_top_k(vectors, queries, args.k)
+    print(f'{args.collection}: {len(vectors)} vectors of dim {vectors.shape[1]}, {len(queries)} held-out queries, '
+          f'current HNSW {get_hnsw_config(args.collection)}')
+    print(f"{'M':>4} {'cons_ef':>8} {'search_ef':>9} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'build s':>8} {'index MB':>9}")
+
+    results = []
+    for m in args.M:
+        for construction_ef in args.construction_ef:
+            index, build_seconds, index_mb = build_index(vectors, m, construction_ef)
+            for search_ef in args.search_ef:
+                recall, p50, p95 = evaluate(index, queries, truth, args.k, search_ef)
+                results.append({'M': m, 'construction_ef': construction_ef, 'search_ef': search_ef,
+                                'recall': recall, 'p50': p50, 'p95': p95, 'index_mb': index_mb})
+                print(f'{m:>4} {construction_ef:>8} {search_ef:>9} {recall:>9.3f} {p50:>8.3f} {p95:>8.3f} '
+                      f'{build_seconds:>8.1f} {index_mb:>9.1f}')
+
+    good = [r for r in results if r['recall'] >= args.target_recall]
+    if not good:
+        print(f'No setting reaches recall@{args.k} >= {args.target_recall}; widen the sweep')
+        return
+    best = min(good, key=lambda r: (r['p95'], r['index_mb']))
+    params = {name: best[name] for name in ('M', 'construction_ef', 'search_ef')}
+    print(f"Recommended: {params} (recall@{args.k}={best['recall']:.3f}, p95={best['p95']:.3f} ms, "
+          f"{best['index_mb']:.1f} MB)")
+    if args.apply:
+        print(f'Applied: {set_hnsw_config(args.collection, **params)}')
+
+
+if __name__ == '__main__':
+    main()
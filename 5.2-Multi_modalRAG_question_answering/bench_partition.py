@@ -0,0 +1,85 @@
+"""
+Benchmark PDF partitioning for ingestion: the previous two-pass chunk_file (two hi_res
+UnstructuredPDFLoader runs, images extracted twice) against the single partition pass.
+
+Each PDF is processed by both versions into fresh figure directories; the report lists wall time,
+speedup and the number of text chunks, tables and extracted images each produced.
+
+    python bench_partition.py data/report.pdf data/paper.pdf
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import htmltabletomd
+from langchain_community.document_loaders import UnstructuredPDFLoader
+
+from preprocessor import chunk_file
+
+
+def two_pass_chunk_file(doc_path, image_path, first_pass_image_path):
+    # the chunk_file this replaces, kept here as the baseline
+    loader = UnstructuredPDFLoader(file_path=doc_path,
+                                   strategy='hi_res',
+                                   extract_images_in_pdf=True,
+                                   infer_table_structure=True,
+                                   mode='elements',
+                                   image_output_dir_path=first_pass_image_path)
+    data = loader.load()
+    tables = [doc for doc in data if doc.metadata['category'] == 'Table']
+
+    loader = UnstructuredPDFLoader(file_path=doc_path,
+                                   strategy='hi_res',
+                                   extract_images_in_pdf=True,
+                                   infer_table_structure=True,
+                                   chunking_strategy="by_title",
+                                   max_characters=4000,
+                                   new_after_n_chars=4000,
+                                   combine_text_under_n_chars=2000,
+                                   mode='elements',
+                                   image_output_dir_path=image_path)
+    docs = loader.load()
+    for table in tables:
+        table.page_content = htmltabletomd.convert_table(table.metadata['text_as_html'])
+    return docs, tables
+
+
+def count_images(path):
+    return len([name for name in os.listdir(path) if name.endswith('.jpg')])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pdfs', nargs='+')
+    args = parser.parse_args()
+
+    print(f"{'file':<30} {'two-pass s':>10} {'single s':>9} {'speedup':>8} {'chunks':>11} {'tables':>9} {'images':>9}")
+    totals = [0.0, 0.0]
+    for pdf in args.pdfs:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            old_images, old_first_pass, new_images = (os.path.join(tmp_dir, name) for name in ('old', 'old_first', 'new'))
+            for path in (old_images, old_first_pass, new_images):
+                os.makedirs(path)
+
+            start = time.perf_counter()
+            old_docs, old_tables = two_pass_chunk_file(pdf, old_images, old_first_pass)
+            old_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            new_docs, new_tables = chunk_file(pdf, new_images)
+            new_seconds = time.perf_counter() - start
+
+            totals[0] += old_seconds
+            totals[1] += new_seconds
+            print(f'{os.path.basename(pdf)[:30]:<30} {old_seconds:>10.1f} {new_seconds:>9.1f} '
+                  f'{old_seconds / new_seconds:>7.2f}x {len(old_docs):>5}/{len(new_docs):<5} '
+                  f'{len(old_tables):>4}/{len(new_tables):<4} '
+                  f'{count_images(old_images) + count_images(old_first_pass):>4}/{count_images(new_images):<4}')
+    print(f"{'total':<30} {totals[0]:>10.1f} {totals[1]:>9.1f} {totals[0] / totals[1]:>7.2f}x")
+    print('chunks, tables and images are shown as two-pass/single-pass; the single pass leaves tables '
+          'out of the text chunks since they are summarized separately')
+
+
+if __name__ == '__main__':
+    main()
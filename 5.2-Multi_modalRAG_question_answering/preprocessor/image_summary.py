@@ -1,60 +1,85 @@
 import base64
+import hashlib
 import os
 
 from langchain_core.messages import HumanMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
 
 
-def encode_image(image_path):
-    """Getting the base64 string"""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+IMAGE_SUMMARY_PROMPT = """You are an assistant tasked with summarizing images for retrieval.
+                Remember these images could potentially contain graphs, charts or tables also.
+                These summaries will be embedded and used to retrieve the raw image for question answering.
+                Give a detailed summary of the image that is well optimized for retrieval.
+                Do not add additional words like Summary, This image represents, etc.
+             """
 
 
-def image_summarize(img_base64,chat_model, prompt):
-    """Make image summary"""
+def summary_cache_key(image_bytes, chat_model, prompt):
+    """Cache key: model, prompt and image content, so a changed prompt or model is not served stale summaries"""
+    model = getattr(chat_model, "model_name", None) or type(chat_model).__name__
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+    return f"{model}/{prompt_hash}/{hashlib.sha256(image_bytes).hexdigest()}"
 
-    msg = chat_model.invoke(
-        [
-            HumanMessage(
-                content=[
-                    {"type": "text", "text": prompt},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{img_base64}"},
-                    },
-                ]
-            )
-        ]
+
+def image_message(img_base64, prompt):
+    return [
+        HumanMessage(
+            content=[
+                {"type": "text", "text": prompt},
+                {
+                    "type": "image_url",
+                    "image_url": {"url": f"data:image/jpeg;base64,{img_base64}"},
+                },
+            ]
+        )
+    ]
+
+
+def image_summary_chain(chat_model, prompt, retries=3):
+    """base64 image -> summary; vision calls that fail (rate limits, timeouts) are retried with backoff"""
+    return (
+        RunnableLambda(lambda img_base64: image_message(img_base64, prompt))
+        | chat_model.with_retry(stop_after_attempt=retries)
+        | StrOutputParser()
     )
-    return msg.content
 
 
-def generate_img_summaries(path, chat_model):
+def generate_img_summaries(path, chat_model, summary_store=None, max_concurrency=5):
     """
     Generate summaries and base64 encoded strings for images
-    path: Path to list of .jpg files extracted by Unstructured
+    path: Path to list of .jpg files extracted by Unstructured (one document's figures)
+    summary_store: optional ByteStore caching summaries by image content hash; only images
+                   not found there are sent to the vision model
+    max_concurrency: vision requests in flight at once
     """
+    prompt = IMAGE_SUMMARY_PROMPT
 
-    # Store base64 encoded images
+    # Store base64 encoded images and the cache key of each
     img_base64_list = []
+    keys = []
+    for img_file in sorted(os.listdir(path)):
+        if img_file.endswith(".jpg"):
+            with open(os.path.join(path, img_file), "rb") as image_file:
+                image_bytes = image_file.read()
+            img_base64_list.append(base64.b64encode(image_bytes).decode("utf-8"))
+            keys.append(summary_cache_key(image_bytes, chat_model, prompt))
 
     # Store image summaries
-    image_summaries = []
+    cached = summary_store.mget(keys) if summary_store is not None else [None] * len(keys)
+    summaries = {key: value.decode("utf-8") for key, value in zip(keys, cached) if value is not None}
 
-    # Prompt
-    prompt = """You are an assistant tasked with summarizing images for retrieval.
-                Remember these images could potentially contain graphs, charts or tables also.
-                These summaries will be embedded and used to retrieve the raw image for question answering.
-                Give a detailed summary of the image that is well optimized for retrieval.
-                Do not add additional words like Summary, This image represents, etc.
-             """
-
-    # Apply to images
-    for img_file in sorted(os.listdir(path)):
-        if img_file.endswith(".jpg"):
-            img_path = os.path.join(path, img_file)
-            base64_image = encode_image(img_path)
-            img_base64_list.append(base64_image)
-            image_summaries.append(image_summarize(base64_image,chat_model, prompt))
+    # Apply to images not summarized before (identical figures are summarized once), in parallel
+    missing = {}
+    for key, base64_image in zip(keys, img_base64_list):
+        if key not in summaries:
+            missing.setdefault(key, base64_image)
+    if missing:
+        new_summaries = image_summary_chain(chat_model, prompt).batch(
+            list(missing.values()), {"max_concurrency": max_concurrency})
+        summaries.update(zip(missing, new_summaries))
+        if summary_store is not None:
+            summary_store.mset([(key, summary.encode("utf-8")) for key, summary in zip(missing, new_summaries)])
 
+    image_summaries = [summaries[key] for key in keys]
     return img_base64_list, image_summaries
@@ -1,42 +1,42 @@
 import htmltabletomd
-from langchain_community.document_loaders import UnstructuredPDFLoader
+from langchain_core.documents import Document
+from unstructured.chunking.title import chunk_by_title
+from unstructured.partition.pdf import partition_pdf
+
+
+def element_to_document(element, doc_path):
+    # same shape as UnstructuredPDFLoader(mode='elements') output
+    metadata = {'source': doc_path, **element.metadata.to_dict(), 'category': element.category}
+    return Document(page_content=str(element), metadata=metadata)
+
+
+def partition_file(doc_path, image_path):
+    """Run hi_res layout detection once, extracting images into image_path"""
+    return partition_pdf(filename=doc_path,
+                         strategy='hi_res',
+                         extract_images_in_pdf=True,
+                         infer_table_structure=True,
+                         image_output_dir_path=image_path)
+
 
 def chunk_file(doc_path, image_path):
-    # Chunk text and extract text content
-    loader = UnstructuredPDFLoader(file_path=doc_path,
-                                   strategy='hi_res',
-                                   extract_images_in_pdf=True,
-                                   infer_table_structure=True,
-                                   mode='elements',
-                                   image_output_dir_path='./figures')
-    data = loader.load()
-    tables = [doc for doc in data if doc.metadata['category'] == 'Table']
-
-    loader = UnstructuredPDFLoader(file_path=doc_path,
-                                   strategy='hi_res',
-                                   extract_images_in_pdf=True,
-                                   infer_table_structure=True,
-                                   chunking_strategy="by_title", # section-based chunking
-                                   max_characters=4000, # max size of chunks
-                                   new_after_n_chars=4000, # preferred size of chunks
-                                   combine_text_under_n_chars=2000, # smaller chunks < 2000 chars will be combined into a larger chunk
-                                   mode='elements',
-                                   image_output_dir_path=image_path)
-    docs = loader.load()
-
-    # data = texts + tables
-    #
-    # #seperate tables and text
-    # docs = []
-    # tables = []
-    #
-    # for doc in data:
-    #     if doc.metadata['category'] == 'Table':
-    #         tables.append(doc)
-    #     elif doc.metadata['category'] == 'CompositeElement':
-    #         docs.append(doc)
+    # a single partition pass: tables are taken from its elements, the rest is chunked in memory
+    elements = partition_file(doc_path, image_path)
+
+    tables = []
+    texts = []
+    for element in elements:
+        if element.category == 'Table':
+            tables.append(element_to_document(element, doc_path))
+        else:
+            texts.append(element)
 
+    chunks = chunk_by_title(texts,
+                            max_characters=4000, # max size of chunks
+                            new_after_n_chars=4000, # preferred size of chunks
+                            combine_text_under_n_chars=2000) # smaller chunks < 2000 chars will be combined into a larger chunk
+    docs = [element_to_document(chunk, doc_path) for chunk in chunks]
 
     for table in tables:
         table.page_content = htmltabletomd.convert_table(table.metadata['text_as_html'])
-    return docs, tables
\ No newline at end of file
+    return docs, tables
@@ -3,12 +3,13 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain_core.runnables import RunnablePassthrough
 
-def generate_text_table_summaries(docs, tables, chat_model=None):
+def generate_text_table_summaries(docs, tables, chat_model=None, max_concurrency=5):
     """
     Generate summaries for text and table documents using a chained LangChain pipeline.
     docs: list of text document objects
     tables: list of table document objects
     chat_model: optional ChatOpenAI model, if not passed a default will be created
+    max_concurrency: summary requests in flight at once, shared by texts and tables
     """
     if chat_model is None:
         chat_model = ChatOpenAI()
@@ -31,7 +32,7 @@ def generate_text_table_summaries(docs, tables, chat_model=None):
     summarize_chain = (
         {"element": RunnablePassthrough()}
         | prompt
-        | chat_model
+        | chat_model.with_retry(stop_after_attempt=3)
         | StrOutputParser()
     )
 
@@ -39,8 +40,9 @@ def generate_text_table_summaries(docs, tables, chat_model=None):
     text_docs = [doc.page_content for doc in docs]
     table_docs = [table.page_content for table in tables]
 
-    # Run summaries using batch execution
-    text_summaries = summarize_chain.batch(text_docs, {"max_concurrency": 5})
-    table_summaries = summarize_chain.batch(table_docs, {"max_concurrency": 5})
+    # Run summaries using batch execution; texts and tables share one batch so they overlap
+    summaries = summarize_chain.batch(text_docs + table_docs, {"max_concurrency": max_concurrency})
+    text_summaries = summaries[:len(text_docs)]
+    table_summaries = summaries[len(text_docs):]
 
     return text_summaries,text_docs, table_summaries, table_docs
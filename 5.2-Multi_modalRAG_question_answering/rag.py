@@ -1,12 +1,16 @@
+import hashlib
 import os
+import shutil
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from operator import itemgetter
-from langchain_openai import OpenAIEmbeddings
 from langchain_openai import ChatOpenAI
 from langchain.retrievers.multi_vector import MultiVectorRetriever
+from langchain.storage import LocalFileStore
 from langchain_community.storage import RedisStore
 from langchain_community.utilities.redis import get_client
+import chromadb.api.client
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
@@ -23,15 +27,21 @@ load_dotenv()
 UPLOAD_DIR = "uploads"
 FIGURES_DIR = 'figures'
 CHROMA_DIR =  "./rag_chroma_db"
+CACHE_DIR = "./rag_cache"
 redis_url = 'redis://localhost:6379'
+#LLM requests in flight per summary stream (text/table and image) while adding a document
+SUMMARY_CONCURRENCY = int(os.getenv('SUMMARY_CONCURRENCY', '5'))
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(FIGURES_DIR, exist_ok=True)
 
 
-embedding_model = OpenAIEmbeddings(model='text-embedding-3-small')
+# summaries and queries are embedded through a text-hash cache (disk for documents, LRU for queries)
+embedding_model = utils.build_cached_embeddings(model='text-embedding-3-small', cache_dir=CACHE_DIR)
 chatgpt = ChatOpenAI(model="gpt-4o-mini", temperature=0)
 redis_client = get_client(redis_url)
 redis_store = RedisStore(client=redis_client)
+# vision summaries keyed by model, prompt and image content hash, so a figure is only summarized once
+image_summary_store = LocalFileStore(os.path.join(CACHE_DIR, 'image_summaries'))
 
 def save_uploaded_file(file_storage) :
     filename = f"{file_storage.filename}"
@@ -39,7 +49,7 @@ def save_uploaded_file(file_storage) :
     file_storage.save(path)
     return path
 
-def get_chroma_collection(collection_name):
+def open_chroma_collection(collection_name):
     return Chroma(
         collection_name=collection_name,
         embedding_function=embedding_model,
@@ -47,6 +57,21 @@ def get_chroma_collection(collection_name):
         persist_directory=os.path.join(CHROMA_DIR, collection_name)
     )
 
+def release_chroma_collection(vectorstore):
+    #each collection has its own persist directory, whose client chromadb keeps cached until its system is stopped
+    client = vectorstore._client
+    systems = getattr(chromadb.api.client.SharedSystemClient, '_identifer_to_system', {})
+    system = systems.pop(getattr(client, '_identifier', None), None)
+    if system is not None:
+        system.stop()
+
+#open collection handles are shared across requests; after 15 idle minutes they are dropped and their client stopped
+collection_registry = utils.CollectionRegistry(open_chroma_collection, idle_seconds=900,
+                                               release=release_chroma_collection)
+
+def get_chroma_collection(collection_name):
+    return collection_registry.get(collection_name)
+
 def get_retriever(collection):
     vectorstore = get_chroma_collection(collection)
     retriever = MultiVectorRetriever(
@@ -65,15 +90,30 @@ def store_document_chunks(retriever, doc_summaries, doc_contents):
     retriever.vectorstore.add_documents(summary_docs)
     retriever.docstore.mset(list(zip(doc_ids, doc_contents)))
 
+def file_content_hash(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
 
 def add_document(file_path, collection):
     chroma_path = os.path.join(CHROMA_DIR, collection)
     os.makedirs(chroma_path, exist_ok=True)
-    img_path = os.path.join(FIGURES_DIR)
+    #each document extracts its figures into its own directory, so only its images are summarized
+    img_path = os.path.join(FIGURES_DIR, file_content_hash(file_path))
+    shutil.rmtree(img_path, ignore_errors=True)
     os.makedirs(img_path, exist_ok=True)
     docs, tables = preprocessor.chunk_file(file_path, img_path)
-    text_summaries, text_docs,  table_summaries, table_docs =  preprocessor.generate_text_table_summaries(docs,tables,chatgpt)
-    imgs_base64, image_summaries = preprocessor.generate_img_summaries(img_path,chatgpt)
+    #text/table and image summaries run side by side, each bounded to SUMMARY_CONCURRENCY requests
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        text_table_future = executor.submit(preprocessor.generate_text_table_summaries, docs, tables, chatgpt,
+                                            max_concurrency=SUMMARY_CONCURRENCY)
+        image_future = executor.submit(preprocessor.generate_img_summaries, img_path, chatgpt,
+                                       summary_store=image_summary_store, max_concurrency=SUMMARY_CONCURRENCY)
+        text_summaries, text_docs,  table_summaries, table_docs = text_table_future.result()
+        imgs_base64, image_summaries = image_future.result()
     retriever  = get_retriever(collection)
     # Add texts, tables, and images
     # Check that text_summaries is not empty before adding
@@ -85,6 +125,7 @@ def add_document(file_path, collection):
     # Check that image_summaries is not empty before adding
     if image_summaries:
         store_document_chunks(retriever, image_summaries, imgs_base64)
+    collection_registry.invalidate(collection)
     return True
 
 def answer_query(query, collection):
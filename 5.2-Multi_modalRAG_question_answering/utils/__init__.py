@@ -1,7 +1,12 @@
 from .utility import  split_image_text_types
 from .utility import insert_meta
+from .embedding_cache import build_cached_embeddings, LRUByteStore
+from .collection_registry import CollectionRegistry
 
 __all__ = [
     "split_image_text_types",
-    "insert_meta"
+    "insert_meta",
+    "build_cached_embeddings",
+    "LRUByteStore",
+    "CollectionRegistry"
 ]
\ No newline at end of file
@@ -0,0 +1,64 @@
+import os
+import threading
+from collections import OrderedDict
+
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_core.stores import ByteStore
+from langchain_openai import OpenAIEmbeddings
+
+
+class LRUByteStore(ByteStore):
+    """Thread-safe in-process byte store that keeps only the `max_size` most recently used keys"""
+
+    def __init__(self, max_size=10_000):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mget(self, keys):
+        with self._lock:
+            values = []
+            for key in keys:
+                value = self._data.get(key)
+                if value is not None:
+                    self._data.move_to_end(key)
+                values.append(value)
+            return values
+
+    def mset(self, key_value_pairs):
+        with self._lock:
+            for key, value in key_value_pairs:
+                self._data[key] = value
+                self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def mdelete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def yield_keys(self, prefix=None):
+        with self._lock:
+            keys = list(self._data)
+        for key in keys:
+            if prefix is None or key.startswith(prefix):
+                yield key
+
+
+def build_cached_embeddings(model='text-embedding-3-small', cache_dir='./rag_cache', query_cache_size=10_000):
+    """
+    Wrap OpenAIEmbeddings with a two-level cache keyed by sha256(text) under a per-model namespace.
+    Document embeddings are persisted on disk; query embeddings live in an in-process LRU.
+    Cache misses of an embed_documents call are sent to the model in a single batched request.
+    """
+    store_path = os.path.join(cache_dir, 'embeddings')
+    os.makedirs(store_path, exist_ok=True)
+    return CacheBackedEmbeddings.from_bytes_store(
+        OpenAIEmbeddings(model=model),
+        LocalFileStore(store_path),
+        namespace=model,
+        query_embedding_cache=LRUByteStore(max_size=query_cache_size),
+        key_encoder='sha256',
+    )